@@ -0,0 +1,180 @@
+import collections
+import contextlib
+import io
+import os
+import threading
+
+import gruntime
+import precompile
+
+# the compiler and the runtime as a library, for calling from python without going
+# through the command line:
+#   import gapi
+#   compiler = gapi.Compiler(link=['shorthand'], optimize=True)
+#   program = compiler.compile("lte X X2 Y")
+#   program.run({'X': 3, 'X2': 5})   -> Result(y=1, steps=..., status='halted', variables={...})
+#   program = gapi.Program.load('lte.g')
+# a Compiler loads its macro libraries once and then compiles any number of programs
+# with them, and a Program is decoded once and then run any number of times, each run
+# starting from the program's initial values with the inputs put over them.
+# errors are raised as exceptions (see GError) with the message the tools would have
+# printed, instead of quitting.
+# precompile.py and gruntime.py keep their settings in module globals, so these set
+# the globals for each call and put them back afterwards, and only one call happens at
+# a time (the lock). compilers and programs with different settings can be used side
+# by side in the same process.
+
+class GError(Exception):
+	pass
+
+# the program doesn't compile, or a macro library doesn't load
+class CompileError(GError):
+	pass
+
+# a compiled program file can't be read
+class LoadError(GError):
+	pass
+
+# the inputs of a run don't fit the program
+class InputError(GError):
+	pass
+
+# what a run gives back. status is "halted" or why the run was stopped, as for gbatch.py
+Result = collections.namedtuple('Result', ['y', 'steps', 'status', 'variables'])
+
+lock = threading.RLock()
+
+# sets the globals of module to settings for a call into it, captures what it prints,
+# and turns it quitting into error (with what it printed as the message)
+@contextlib.contextmanager
+def calling(module, settings, error):
+	with lock:
+		saved = dict([(name, getattr(module, name)) for name in settings])
+		for name in settings:
+			setattr(module, name, settings[name])
+		out = io.StringIO()
+		try:
+			with contextlib.redirect_stdout(out):
+				yield out
+		except SystemExit:
+			raise error(out.getvalue().strip()) from None
+		finally:
+			for name in saved:
+				setattr(module, name, saved[name])
+
+class Compiler:
+	# link is the macro libraries to use as well as stdlib, root the folder they're in
+	# (the macro folder next to this file by default). the other settings are the same
+	# as the compiler's -O, -dce and -intrinsics flags.
+	def __init__(self, link=[], optimize=False, dce=False, intrinsics=False, root=None):
+		if root is None:
+			root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'macro')
+		self.root = root
+		self.folders = ['stdlib'] + [folder for folder in link if folder != 'stdlib']
+		for folder in self.folders:
+			if not os.path.isdir(os.path.join(root, folder)):
+				raise CompileError("No macro folder found for linked folder " + folder)
+		self.flags = {
+			'debug': False,
+			'debug_extreme': False,
+			'use_intrinsics': intrinsics,
+			'optimize': optimize,
+			'eliminate_dead': dce,
+			'source_map': False,
+			'macro_root': root,
+		}
+		with calling(precompile, dict(self.flags, macros={}), CompileError):
+			precompile.macro_loading(self.folders)
+			precompile.macro_requirement_checking()
+			self.macros = precompile.macros
+
+	# compiles the text of a .gc file, %directives and all, to a Program
+	def compile(self, text, loops=True, fuse=True):
+		with calling(precompile, dict(self.flags, macros=self.macros, used_macros=set()), CompileError):
+			(program, dirs, lines) = precompile.read_source(text)
+			(statements, vars) = precompile.compile_program(program, "program", dirs)
+		# the initial values, from the %specvar directives
+		with calling(gruntime, {'variables': dict.fromkeys(vars, 0)}, CompileError):
+			for d in dirs:
+				if d.startswith("%specvar"):
+					gruntime.specvar(d)
+			variables = gruntime.variables
+		return Program(statements, variables, loops=loops, fuse=fuse)
+
+	def compile_file(self, file, loops=True, fuse=True):
+		try:
+			with open(file) as f:
+				text = f.read()
+		except OSError as e:
+			raise CompileError("Could not read " + file + ": " + str(e)) from None
+		return self.compile(text, loops, fuse)
+
+class Program:
+	# statements is the compiled program without its directives and variables the
+	# initial value of each of its variables, in %vars order. code is the decoded
+	# program, if that's already known (e.g. from a .gb file).
+	# loops and fuse are the same as leaving off the runtime's -noloops and -nofuse flags.
+	def __init__(self, statements, variables, code=None, loops=True, fuse=True):
+		self.statements = list(statements)
+		self.names = list(variables)
+		self.slots = dict([(self.names[i], i) for i in range(len(self.names))])
+		self.initial = list(variables.values())
+		if code is None:
+			with calling(gruntime, {}, LoadError):
+				code = gruntime.decode(self.statements, self.names)
+		if loops:
+			gruntime.find_loops(code)
+		if fuse:
+			gruntime.find_blocks(code)
+		self.code = code
+
+	# loads a compiled .g or .gb file
+	@classmethod
+	def load(cls, file, loops=True, fuse=True):
+		try:
+			with calling(gruntime, {'variables': {}}, LoadError):
+				if file.endswith('.gb'):
+					import gbinary
+					(variables, code) = gbinary.load(file)
+					statements = gbinary.statements(code[:-1], list(variables))
+				else:
+					code = None
+					statements = gruntime.load(file)
+					variables = gruntime.variables
+		except (OSError, IndexError) as e:
+			raise LoadError("Could not load " + file + ": " + str(e)) from None
+		return cls(statements, variables, code, loops, fuse)
+
+	# the program as the text of a .g file
+	def text(self):
+		specvars = ["%specvar " + self.names[i] + " " + str(self.initial[i]) for i in range(len(self.names)) if self.initial[i]]
+		return "\n".join(["%vars " + ",".join(self.names)] + specvars + [""] + self.statements) + "\n"
+
+	# the registers to start a run with, the initial values with inputs (variable -> value)
+	# put over them
+	def registers(self, inputs):
+		regs = list(self.initial)
+		for var in inputs:
+			if not var in self.slots:
+				raise InputError("The program has no variable " + str(var))
+			val = inputs[var]
+			if not isinstance(val, int) or isinstance(val, bool) or val < 0:
+				raise InputError("Input values must be natural numbers, " + str(var) + " is " + repr(val))
+			regs[self.slots[var]] = val
+		return regs
+
+	# runs the program with inputs (variable -> value) in place of its initial values.
+	# max_steps, timeout (in seconds) and detect_cycles are the same as the runtime's
+	# -maxsteps, -timeout and -nocycles, a run they stop comes back with that status.
+	def run(self, inputs={}, max_steps=None, timeout=None, detect_cycles=True):
+		regs = self.registers(inputs)
+		settings = {
+			'max_steps': max_steps,
+			'max_seconds': timeout,
+			'detect_cycles': detect_cycles,
+			'checkpoint': None,
+			'interrupted': False,
+		}
+		with calling(gruntime, settings, GError):
+			(steps, status) = gruntime.execute(self.code, regs)
+		return Result(regs[self.slots['Y']], steps, status, dict(zip(self.names, regs)))
@@ -0,0 +1,214 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+
+import gruntime
+
+# batch runner for compiled .g/.gb files.
+# runs one program over a whole grid of inputs, e.g.
+#   python gbatch.py lte.g X=0..100 X2=0..100 -out lte.csv
+# the program is loaded and decoded once per worker process, then every input just
+# copies the initial registers, overrides the input variables (in place of %specvar)
+# and runs. the inputs are spread over a pool of processes, one per cpu by default,
+# and the results are written in the same order as the inputs.
+# each result row is the inputs, Y, the number of steps and the status of the run,
+# which is "halted" or why the run was stopped (see gruntime.check).
+# with -vector each worker runs a whole chunk of inputs at once with gvector.py, which
+# needs numpy.
+
+# the decoded program and initial registers, set up in each worker by setup()
+names = []
+slots = {}
+initial = []
+code = []
+
+# how many inputs are sent to a worker at a time
+chunk_size = 64
+# how many inputs gvector runs at once
+vector_size = 65536
+
+# the runtime settings which come from the arguments
+settings = ['loops', 'fuse', 'max_steps', 'max_seconds', 'detect_cycles']
+
+# loads the program for this process.
+# the runtime settings (name -> value) are passed in rather than read from sys.argv
+# so this also works in worker processes which don't start with our arguments.
+def setup(file, runtime):
+	global names
+	global slots
+	global initial
+	global code
+	for name in runtime:
+		setattr(gruntime, name, runtime[name])
+	if file.endswith('.gb'):
+		import gbinary
+		(variables, code) = gbinary.load(file)
+	else:
+		program = gruntime.load(file)
+		variables = gruntime.variables
+		code = gruntime.decode(program, list(variables))
+	if gruntime.loops:
+		gruntime.find_loops(code)
+	if gruntime.fuse:
+		gruntime.find_blocks(code)
+	names = list(variables)
+	slots = dict([(names[i], i) for i in range(len(names))])
+	initial = list(variables.values())
+
+# runs the program for one set of inputs (a list of (variable, value) pairs)
+# and returns the result row.
+def run(inputs):
+	regs = list(initial)
+	for (var, val) in inputs:
+		regs[slots[var]] = val
+	(steps, status) = gruntime.execute(code, regs)
+	return (inputs, regs[slots['Y']], steps, status)
+
+# runs the program for a list of inputs at once with gvector and returns the result rows
+def run_vector(chunk):
+	import gvector
+	results = gvector.run(code, initial, slots, chunk)
+	return [(chunk[i],) + results[i] for i in range(len(chunk))]
+
+def input_error(msg, arg):
+	print("Batch error, " + msg)
+	print(arg)
+	exit(-1)
+
+def natural(val, arg):
+	if isinstance(val, int) and not isinstance(val, bool) and val >= 0:
+		return val
+	if isinstance(val, str) and val.strip().isdigit():
+		return int(val)
+	input_error("input values must be natural numbers", arg)
+
+# reads one V=values argument of the grid.
+# values is a number, a comma separated list of numbers, or an inclusive range a..b
+def grid_axis(arg):
+	(var, _, spec) = arg.partition('=')
+	if var == "" or spec == "":
+		input_error("inputs are given as V=n, V=a..b or V=a,b,c", arg)
+	values = []
+	for part in spec.split(','):
+		if '..' in part:
+			(lo, _, hi) = part.partition('..')
+			values += list(range(natural(lo, arg), natural(hi, arg)+1))
+		else:
+			values.append(natural(part, arg))
+	return (var, values)
+
+# every combination of the grid arguments, the first one given changing slowest
+def grid(axes):
+	vars = [var for (var, values) in axes]
+	for combination in itertools.product(*[values for (var, values) in axes]):
+		yield list(zip(vars, combination))
+
+# reads inputs from a .csv file (a header line of variable names, then one run per row)
+# or a .jsonl file (one object of variable -> value per line)
+def input_file(file):
+	with open(file, newline='') as f:
+		if file.endswith('.jsonl'):
+			for line in f:
+				if line.strip() == "":
+					continue
+				row = json.loads(line)
+				if not isinstance(row, dict):
+					input_error("every line of a .jsonl input file must be an object", line.strip())
+				yield [(var, natural(row[var], line.strip())) for var in row]
+		else:
+			for row in csv.DictReader(f):
+				yield [(var, natural(row[var], ",".join(row.values()))) for var in row]
+
+# checks the inputs only name variables the program has
+def check_inputs(inputs):
+	for row in inputs:
+		for (var, val) in row:
+			if not var in slots:
+				input_error("the inputs set a variable the program does not have", var)
+
+# writes result rows as they come in, csv unless the file ends in .jsonl.
+# with no file the rows go to stdout.
+def write_rows(rows, file):
+	f = sys.stdout
+	if file is not None:
+		f = open(file, 'w', newline='')
+	jsonl = file is not None and file.endswith('.jsonl')
+	writer = csv.writer(f)
+	header = None
+	for (inputs, y, steps, status) in rows:
+		if jsonl:
+			f.write(json.dumps({"inputs": dict(inputs), "Y": y, "steps": steps, "status": status}) + "\n")
+			continue
+		vars = [var for (var, val) in inputs]
+		if header is None:
+			header = vars
+			writer.writerow(vars + ["Y", "steps", "status"])
+		elif vars != header:
+			input_error("every row of csv output must set the same variables (use a .jsonl output file)", ",".join(vars))
+		writer.writerow([val for (var, val) in inputs] + [y, steps, status])
+	if f is sys.stdout:
+		f.flush()
+	else:
+		f.close()
+
+def batch(file):
+	inputs_file = None
+	out = None
+	jobs = os.cpu_count() or 1
+	axes = []
+	for i in range(2, len(sys.argv)):
+		arg = sys.argv[i]
+		prev = sys.argv[i-1]
+		if prev == '-inputs':
+			inputs_file = arg
+		elif prev == '-out':
+			out = arg
+		elif prev == '-maxsteps' or prev == '-timeout':
+			continue
+		elif prev == '-jobs':
+			if not arg.isdigit() or int(arg) < 1:
+				input_error("-jobs takes a number of processes", arg)
+			jobs = int(arg)
+		elif not arg.startswith('-'):
+			axes.append(grid_axis(arg))
+	if inputs_file is not None and axes != []:
+		input_error("give either a grid or an -inputs file, not both", inputs_file)
+	if inputs_file is not None:
+		inputs = input_file(inputs_file)
+	else:
+		inputs = grid(axes)
+	gruntime.loops = not '-noloops' in sys.argv
+	gruntime.fuse = not '-nofuse' in sys.argv
+	gruntime.read_limits()
+	runtime = dict([(name, getattr(gruntime, name)) for name in settings])
+	# load it here too, so a bad program or a bad input is reported before any work starts
+	setup(file, runtime)
+	inputs = list(inputs)
+	check_inputs(inputs)
+	if '-vector' in sys.argv:
+		try:
+			import gvector
+		except ImportError:
+			input_error("-vector needs numpy", "pip install numpy")
+		# an even share for each worker, up to vector_size at a time
+		size = max(1, min(vector_size, -(-len(inputs) // jobs)))
+		chunks = [inputs[i:i+size] for i in range(0, len(inputs), size)]
+		if jobs == 1 or len(chunks) == 1:
+			write_rows(itertools.chain.from_iterable(map(run_vector, chunks)), out)
+		else:
+			with multiprocessing.Pool(jobs, setup, (file, runtime)) as pool:
+				write_rows(itertools.chain.from_iterable(pool.imap(run_vector, chunks)), out)
+	elif jobs == 1:
+		write_rows(map(run, inputs), out)
+	else:
+		with multiprocessing.Pool(jobs, setup, (file, runtime)) as pool:
+			write_rows(pool.imap(run, inputs, chunk_size), out)
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print("Please provide at least 1 argument, the path to a compiled G file, then the inputs as V=a..b arguments or -inputs and a .csv/.jsonl file.")
+		exit(-1)
+	batch(sys.argv[1])
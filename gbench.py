@@ -0,0 +1,408 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import gruntime
+import precompile
+
+# benchmarks for the compiler and the runtime.
+#   python gbench.py [-sizes 1,10,100] [-repeat N] [-only NAME] [-out FILE] [compiler flags]
+#   python gbench.py -compare old.json new.json
+#   python gbench.py -linkage [-sizes N] [-only NAME] [compiler flags]
+# runs two kinds of benchmark:
+# - the sample programs, compiled once and then run for each of a sweep of input sizes
+# - made up programs which are big for the compiler: a long flat list of stdlib macro
+#   calls, and a chain of macros which each call the next one down, nested deeply
+# for each one it reports the compile time of each phase (see precompile.phase_times),
+# the size of the compiled program, the steps executed, steps per second, and the peak
+# memory python allocated while compiling and while running (from tracemalloc, which is
+# done as a separate pass since it slows everything down).
+# the results are saved as json (gbench.json unless -out is given), and -compare shows
+# how two of those differ.
+# -linkage compiles each program both ways, with every macro call expanded and with
+# -shared, and shows the size of each and how long it takes to compile, load and run,
+# checking the two give the same Y in the same number of steps. besides the programs
+# above it has chains of macros which each call the next one down twice, which double
+# in size with every level when they're expanded.
+# compiler flags such as -O, -dce and -intrinsics, and the runtime's -noloops, -nofuse,
+# -jit, -maxsteps and -timeout are used for every benchmark, and -shared for every
+# benchmark but -linkage.
+
+# the sample programs and the %specvar values to use for an input of size n
+samples = {
+	'monus': lambda n: {'X': n, 'X2': n // 2},
+	'lte': lambda n: {'X': n, 'X2': n},
+	'be_test': lambda n: {'X': n, 'X2': n},
+	'is_even_function': lambda n: {'X': n},
+	'zero_function': lambda n: {'X': n},
+	'evenness_by_macro': lambda n: {'X': n},
+}
+sizes = [1, 10, 100, 1000]
+
+# the made up programs, by number of calls and depth of nesting
+flat_sizes = [100, 1000, 3000]
+nested_depths = [10, 40, 90]
+# the calls the flat programs are made of, over and over
+flat_calls = ["sum A B C", "monus C A D", "assign F D", "lte A D G", "mult B G H", "iseven H K"]
+# how many calls to the top of the chain the nested programs make
+nested_calls = 20
+# the depths of the chains of macros that call the next one down twice, for -linkage
+fan_depths = [4, 8, 12]
+# the name of the macro library the nested chain is written to
+nested_library = 'gbench'
+
+repeat = 3
+# -nomemory skips the tracemalloc pass
+measure_memory = True
+# a run which hasn't finished after this long is stopped (unless -timeout says otherwise)
+default_timeout = 60.0
+
+def bench_error(msg, arg):
+	print("Benchmark error, " + msg)
+	print(arg)
+	exit(-1)
+
+# writes the macros for the nested programs, nestK calls nest(K-1) and nest0 is a ++,
+# and for the fan programs, fanK calls fan(K-1) twice and fan0 is a ++
+def write_nested_library(folder, depth):
+	os.makedirs(folder, exist_ok=True)
+	for k in range(depth+1):
+		lines = ["%prefix nest" + str(k), "%input 1 variable 0 label"]
+		if k == 0:
+			lines += ["", "_V1++"]
+		else:
+			lines += ["%require nest" + str(k-1), "", "_V1++", "nest" + str(k-1) + " _V1", "_V1--"]
+		with open(os.path.join(folder, "nest" + str(k) + ".gmacro"), "w") as f:
+			f.write("\n".join(lines) + "\n")
+	for k in range(max(fan_depths)+1):
+		lines = ["%prefix fan" + str(k), "%input 1 variable 0 label"]
+		if k == 0:
+			lines += ["", "_V1++"]
+		else:
+			lines += ["%require fan" + str(k-1), "", "fan" + str(k-1) + " _V1", "fan" + str(k-1) + " _V1"]
+		with open(os.path.join(folder, "fan" + str(k) + ".gmacro"), "w") as f:
+			f.write("\n".join(lines) + "\n")
+
+# the made up programs, as (name, source text)
+def synthetic_programs():
+	programs = []
+	for n in flat_sizes:
+		text = "\n".join([flat_calls[i % len(flat_calls)] for i in range(n)])
+		programs.append(("flat-" + str(n), text))
+	for depth in nested_depths:
+		text = "\n".join(["nest" + str(depth) + " X"] * nested_calls)
+		programs.append(("nested-" + str(depth), text))
+	return programs
+
+# compiles a program, keeping the compiler's messages out of the report.
+# returns (statements, variables, phase times).
+def compile_quietly(program, dirs):
+	out = io.StringIO()
+	try:
+		with contextlib.redirect_stdout(out):
+			(compiled, vars) = precompile.compile_program(program, "gbench", dirs)
+	except SystemExit:
+		print(out.getvalue())
+		raise
+	return (compiled, vars, dict(precompile.phase_times))
+
+# decodes a compiled program with the given %specvar values and runs it.
+# returns (steps, status, seconds to decode, seconds to run, Y).
+def run(compiled, vars, inputs):
+	start = time.perf_counter()
+	gruntime.variables = dict.fromkeys(vars, 0)
+	for var in inputs:
+		if var in gruntime.variables:
+			gruntime.variables[var] = inputs[var]
+	if gruntime.is_linked(compiled):
+		# compiled with -shared
+		(code, regions) = gruntime.decode_linked(compiled, list(vars))
+		gruntime.find_linked_shortcuts(code, regions)
+		regs = list(gruntime.variables.values())
+		loaded = time.perf_counter()
+		(steps, status) = gruntime.execute_linked(code, regs, regions)
+		done = time.perf_counter()
+		return (steps, status, loaded - start, done - loaded, regs[list(vars).index('Y')])
+	code = gruntime.decode(compiled, list(vars))
+	if gruntime.loops:
+		gruntime.find_loops(code)
+	if gruntime.fuse:
+		gruntime.find_blocks(code)
+	regs = list(gruntime.variables.values())
+	loaded = time.perf_counter()
+	if gruntime.jit:
+		import gjit
+		(steps, status) = gjit.execute(code, regs)
+	else:
+		(steps, status) = gruntime.execute(code, regs)
+	done = time.perf_counter()
+	return (steps, status, loaded - start, done - loaded, regs[list(vars).index('Y')])
+
+# the peak memory python allocates while f runs, in kilobytes
+def peak_memory(f):
+	tracemalloc.start()
+	try:
+		f()
+		(current, peak) = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return peak // 1024
+
+# benchmarks compiling a program, returns the compile part of a result
+def bench_compile(program, dirs):
+	best = None
+	for i in range(repeat):
+		(compiled, vars, phases) = compile_quietly(program, dirs)
+		if best is None or sum(phases.values()) < sum(best.values()):
+			best = phases
+	result = {
+		'compile_phases': best,
+		'compile_seconds': sum(best.values()),
+		'lines': len(compiled),
+		'variables': len(vars),
+	}
+	if measure_memory:
+		result['compile_peak_kb'] = peak_memory(lambda: compile_quietly(program, dirs))
+	return (compiled, vars, result)
+
+# benchmarks running a compiled program on one set of inputs
+def bench_run(compiled, vars, inputs):
+	best = None
+	for i in range(repeat):
+		r = run(compiled, vars, inputs)
+		if best is None or r[3] < best[3]:
+			best = r
+	(steps, status, load_seconds, run_seconds, y) = best
+	result = {
+		'inputs': inputs,
+		'Y': y,
+		'steps': steps,
+		'status': status,
+		'load_seconds': load_seconds,
+		'run_seconds': run_seconds,
+		'steps_per_second': steps / run_seconds if run_seconds > 0 else 0,
+	}
+	if measure_memory:
+		result['run_peak_kb'] = peak_memory(lambda: run(compiled, vars, inputs))
+	return result
+
+def report(name, result):
+	line = "%-28s" % name
+	if 'compile_seconds' in result:
+		line += " compile %8.4fs %7d lines" % (result['compile_seconds'], result['lines'])
+	else:
+		line += " " * 32
+	line += " %12d steps %8.4fs %12.0f steps/s" % (result['steps'], result['run_seconds'], result['steps_per_second'])
+	if result['status'] != "halted":
+		line += " (" + result['status'] + ")"
+	print(line)
+	if 'compile_phases' in result:
+		phases = result['compile_phases']
+		print(" " * 29 + " ".join([phase + " " + "%.4fs" % phases[phase] for phase in phases]))
+
+# runs every benchmark, returns the results by name
+def bench(root, only):
+	results = {}
+	for name in samples:
+		if only and not only in name:
+			continue
+		with open(os.path.join(root, name + ".gc")) as f:
+			(program, dirs, lines) = precompile.read_source(f.read())
+		# the inputs are given with the runs, not by %specvar
+		dirs = [d for d in dirs if not d.startswith("%specvar")]
+		(compiled, vars, compiled_result) = bench_compile(program, dirs)
+		for n in sizes:
+			result = bench_run(compiled, vars, samples[name](n))
+			if n == sizes[0]:
+				# the compile only happens once, it goes with the first size
+				result.update(compiled_result)
+			results[name + "-" + str(n)] = result
+			report(name + "-" + str(n), result)
+	for (name, text) in synthetic_programs():
+		if only and not only in name:
+			continue
+		(program, dirs, lines) = precompile.read_source(text)
+		(compiled, vars, result) = bench_compile(program, dirs)
+		result.update(bench_run(compiled, vars, {}))
+		results[name] = result
+		report(name, result)
+	return results
+
+# compiles each program with its macro calls expanded and with -shared, runs both and
+# shows how they compare (the samples are run with the largest of -sizes)
+def bench_linkage(root, only):
+	programs = []
+	for name in samples:
+		with open(os.path.join(root, name + ".gc")) as f:
+			(program, dirs, lines) = precompile.read_source(f.read())
+		dirs = [d for d in dirs if not d.startswith("%specvar")]
+		programs.append((name, program, dirs, samples[name](sizes[-1])))
+	for (name, text) in synthetic_programs():
+		(program, dirs, lines) = precompile.read_source(text)
+		programs.append((name, program, dirs, {}))
+	for depth in fan_depths:
+		(program, dirs, lines) = precompile.read_source("fan" + str(depth) + " X")
+		programs.append(("fan-" + str(depth), program, dirs, {}))
+	print("%-20s %-8s %9s %10s %10s %10s %12s" % ("", "", "lines", "compile", "load", "run", "steps"))
+	agree = True
+	for (name, program, dirs, inputs) in programs:
+		if only and not only in name:
+			continue
+		results = []
+		for linkage in ["inlined", "shared"]:
+			precompile.shared = linkage == "shared"
+			start = time.perf_counter()
+			(compiled, vars, phases) = compile_quietly(program, dirs)
+			compile_seconds = time.perf_counter() - start
+			(steps, status, load_seconds, run_seconds, y) = run(compiled, vars, inputs)
+			results.append((y, steps, status))
+			line = "%-20s %-8s %9d %9.4fs %9.4fs %9.4fs %12d" % (name if linkage == "inlined" else "", linkage, len(compiled), compile_seconds, load_seconds, run_seconds, steps)
+			if status != "halted":
+				line += " (" + status + ")"
+			print(line)
+		if results[0] != results[1] and results[0][2] == "halted":
+			print("%-20s the two don't agree, Y %d in %d steps inlined and %d in %d shared" % ("", results[0][0], results[0][1], results[1][0], results[1][1]))
+			agree = False
+	return agree
+
+# loads the macros, timing a load from scratch (parsing every macro) and one from the cache
+def bench_macros(folders):
+	times = {}
+	for kind in ['cold', 'warm']:
+		if kind == 'cold':
+			for folder in folders:
+				if os.path.exists(os.path.join('macro', folder, precompile.macro_cache_name)):
+					os.remove(os.path.join('macro', folder, precompile.macro_cache_name))
+		precompile.macros = {}
+		start = time.perf_counter()
+		with contextlib.redirect_stdout(io.StringIO()):
+			precompile.macro_loading(folders)
+			precompile.macro_requirement_checking()
+		times[kind] = time.perf_counter() - start
+		print("macro loading (" + kind + ") %.4fs" % times[kind])
+	return times
+
+# shows how the results in two files differ, new relative to old
+def compare(old_file, new_file):
+	results = []
+	for file in [old_file, new_file]:
+		try:
+			with open(file) as f:
+				results.append(json.load(f))
+		except (OSError, ValueError):
+			bench_error("could not read results from a file", file)
+	(old, new) = (results[0]['benchmarks'], results[1]['benchmarks'])
+	def change(a, b):
+		if not a:
+			return "      -"
+		return "%+6.1f%%" % (100.0 * (b - a) / a)
+	print("%-28s %14s %14s %14s %14s" % ("", "compile", "run", "steps", "peak memory"))
+	for name in new:
+		if not name in old:
+			print("%-28s (new)" % name)
+			continue
+		(a, b) = (old[name], new[name])
+		cells = []
+		for key in ['compile_seconds', 'run_seconds', 'steps']:
+			if key in a and key in b:
+				cells.append(change(a[key], b[key]))
+			else:
+				cells.append("")
+		peak_a = a.get('compile_peak_kb', 0) + a.get('run_peak_kb', 0)
+		peak_b = b.get('compile_peak_kb', 0) + b.get('run_peak_kb', 0)
+		cells.append(change(peak_a, peak_b) if peak_a and peak_b else "")
+		print("%-28s %14s %14s %14s %14s" % tuple([name] + cells))
+		if a['status'] != b['status']:
+			print("%-28s status changed from %s to %s" % ("", a['status'], b['status']))
+	for name in old:
+		if not name in new:
+			print("%-28s (missing)" % name)
+
+def numbers(arg, flag):
+	if not all([part.isdigit() for part in arg.split(',')]):
+		bench_error(flag + " takes a comma separated list of numbers", arg)
+	return [int(part) for part in arg.split(',')]
+
+def main():
+	global sizes
+	global repeat
+	global measure_memory
+	if '-compare' in sys.argv:
+		i = sys.argv.index('-compare')
+		if i+2 >= len(sys.argv):
+			bench_error("-compare takes two results files", " ".join(sys.argv[i+1:]))
+		compare(sys.argv[i+1], sys.argv[i+2])
+		return
+	out = 'gbench.json'
+	only = None
+	for i in range(1, len(sys.argv)-1):
+		(arg, val) = (sys.argv[i], sys.argv[i+1])
+		if arg == '-sizes':
+			sizes = numbers(val, arg)
+		elif arg == '-repeat':
+			repeat = max(1, numbers(val, arg)[0])
+		elif arg == '-only':
+			only = val
+		elif arg == '-out':
+			out = os.path.abspath(val)
+	if '-nomemory' in sys.argv:
+		measure_memory = False
+	precompile.read_flags()
+	gruntime.loops = not '-noloops' in sys.argv
+	gruntime.fuse = not '-nofuse' in sys.argv
+	gruntime.jit = '-jit' in sys.argv
+	if precompile.shared and gruntime.jit:
+		bench_error("-jit can't run programs compiled with -shared", "-shared -jit")
+	gruntime.read_limits()
+	if gruntime.max_seconds is None:
+		gruntime.max_seconds = default_timeout
+	root = os.path.dirname(os.path.abspath(__file__))
+	folders = precompile.linked_folders()
+	# some of the samples use shorthand
+	if not 'shorthand' in folders:
+		folders.append('shorthand')
+	# everything happens in a copy of the macro libraries, so the macro caches and the
+	# library of nested macros don't end up in the real ones
+	with tempfile.TemporaryDirectory() as work:
+		shutil.copytree(os.path.join(root, 'macro'), os.path.join(work, 'macro'))
+		write_nested_library(os.path.join(work, 'macro', nested_library), max(nested_depths))
+		cwd = os.getcwd()
+		os.chdir(work)
+		try:
+			if '-linkage' in sys.argv:
+				with contextlib.redirect_stdout(io.StringIO()):
+					precompile.macro_loading(folders + [nested_library])
+					precompile.macro_requirement_checking()
+				agree = bench_linkage(root, only)
+			else:
+				macro_times = bench_macros(folders)
+				precompile.macro_loading([nested_library])
+				precompile.macro_requirement_checking()
+				results = bench(root, only)
+		finally:
+			os.chdir(cwd)
+	if '-linkage' in sys.argv:
+		if not agree:
+			exit(-1)
+		return
+	with open(out, "w") as f:
+		json.dump({
+			'version': 1,
+			'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+			'python': platform.python_version(),
+			'machine': platform.machine(),
+			'flags': [arg for arg in sys.argv[1:] if arg.startswith('-')],
+			'macro_loading': macro_times,
+			'benchmarks': results,
+		}, f, indent=1)
+	print("Wrote results to " + out)
+
+if __name__ == '__main__':
+	main()
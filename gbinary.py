@@ -0,0 +1,160 @@
+import mmap
+import os
+import struct
+import sys
+
+import gruntime
+
+# binary format for compiled programs (.gb files).
+# the runtime can map one of these and go straight to running it, instead of
+# reading, tokenizing and checking every line of a .g file.
+# layout (all little endian):
+# - header: magic, format version, variable count, intrinsic count, instruction count,
+#   offset of the instructions
+# - initial value of every variable (8 bytes each, in %vars order)
+# - names: the variables then the intrinsic prefixes used, separated by newlines
+# - instructions, fixed width: opcode, intrinsic number, 3 variable slots, jump target
+# instructions are the decoded form (gruntime.decode) with jump targets already resolved
+# to instruction numbers, so loading is just unpacking the records.
+
+magic = b'GBIN'
+version = 1
+header = struct.Struct('<4sHHIIII')
+value = struct.Struct('<Q')
+record = struct.Struct('<BBxxIIII')
+
+# the binary for a .g file lives next to it as a .gb file
+def binary_path(file):
+	return os.path.splitext(file)[0] + ".gb"
+
+# packs the decoded code of a program (without the exit decode appends)
+# and its variables (name -> initial value) into the bytes of a .gb file.
+def pack(code, variables):
+	prefixes = []
+	records = []
+	for (op, slot, target) in code:
+		if op == gruntime.OP_NATIVE or op == gruntime.OP_BRANCH:
+			(fn, prefix, slots) = slot
+			if not prefix in prefixes:
+				prefixes.append(prefix)
+			slots = list(slots) + [0] * (3 - len(slots))
+			records.append(record.pack(op, prefixes.index(prefix), slots[0], slots[1], slots[2], target))
+		else:
+			records.append(record.pack(op, 0, slot, 0, 0, target))
+	values = []
+	for var in variables:
+		if variables[var] >= 2**64:
+			print("Binary format error, the initial value of " + var + " is too large")
+			exit(-1)
+		values.append(value.pack(variables[var]))
+	names = "\n".join(list(variables) + prefixes).encode()
+	offset = header.size + len(values) * value.size + len(names)
+	# keep the instructions 4 byte aligned
+	padding = b'\0' * (-offset % 4)
+	offset += len(padding)
+	head = header.pack(magic, version, 0, len(variables), len(prefixes), len(code), offset)
+	return head + b''.join(values) + names + padding + b''.join(records)
+
+def bad_instruction(file, pc):
+	print("Runtime error, " + file + " has a bad instruction at " + str(pc))
+	exit(-1)
+
+# reads a .gb file and returns (variables, code) - the variables (name -> initial value)
+# and the decoded code, ready for gruntime.execute (with the exit at the end).
+def load(file):
+	with open(file, 'rb') as f:
+		try:
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			mm = b''
+	if len(mm) < header.size:
+		print("Runtime error, " + file + " is not a compiled binary")
+		exit(-1)
+	(mg, ver, reserved, nvars, nprefixes, ncode, offset) = header.unpack_from(mm, 0)
+	if mg != magic or ver != version:
+		print("Runtime error, " + file + " is not a compiled binary or is from a different version")
+		exit(-1)
+	if offset + ncode * record.size > len(mm):
+		print("Runtime error, " + file + " is truncated")
+		exit(-1)
+	names_start = header.size + nvars * value.size
+	names = bytes(mm[names_start:offset]).rstrip(b'\0').decode().split("\n")
+	vars = names[:nvars]
+	prefixes = names[nvars:nvars+nprefixes]
+	variables = {}
+	for i in range(nvars):
+		variables[vars[i]] = value.unpack_from(mm, header.size + i * value.size)[0]
+	view = memoryview(mm)[offset:offset + ncode * record.size]
+	code = []
+	for (op, prefix, a, b, c, target) in record.iter_unpack(view):
+		if op == gruntime.OP_NATIVE or op == gruntime.OP_BRANCH:
+			if prefix >= nprefixes or not prefixes[prefix] in gruntime.intrinsics:
+				bad_instruction(file, len(code))
+			prefix = prefixes[prefix]
+			slots = (a, b, c)[:gruntime.intrinsics[prefix][0]]
+			if target > ncode or max(slots + (0,)) >= max(nvars, 1):
+				bad_instruction(file, len(code))
+			code.append((op, (gruntime.intrinsic_function(prefix, slots), prefix, slots), target))
+		elif op <= gruntime.OP_EXIT:
+			if target > ncode or (op <= gruntime.OP_IF and a >= nvars):
+				bad_instruction(file, len(code))
+			code.append((op, a, target))
+		else:
+			bad_instruction(file, len(code))
+	view.release()
+	if isinstance(mm, mmap.mmap):
+		mm.close()
+	code.append((gruntime.OP_EXIT, 0, 0))
+	return (variables, code)
+
+# turns decoded code back into .g statements
+def statements(code, names):
+	program = []
+	for (op, slot, target) in code:
+		if op == gruntime.OP_INC:
+			program.append(names[slot] + "++")
+		elif op == gruntime.OP_DEC:
+			program.append(names[slot] + "--")
+		elif op == gruntime.OP_IF:
+			program.append("if " + names[slot] + " not 0 goto " + str(target))
+		elif op == gruntime.OP_SKIP:
+			program.append("skip")
+		elif op == gruntime.OP_EXIT:
+			program.append("exit")
+		else:
+			(fn, prefix, slots) = slot
+			operands = [names[s] for s in slots]
+			if op == gruntime.OP_BRANCH:
+				operands.append(str(target))
+			program.append(" ".join([prefix] + operands))
+	return program
+
+# disassembles a .gb file back into the text of a .g file
+def disassemble(file):
+	(variables, code) = load(file)
+	names = list(variables)
+	lines = ["%vars " + ",".join(names)]
+	dirs = ["%specvar " + var + " " + str(variables[var]) for var in names if variables[var] != 0]
+	lines.append("\n".join(dirs) + "\n")
+	return "\n".join(lines + statements(code[:-1], names))
+
+# writes the .gb for a compiled .g file, used by precompile.py -binary
+def emit(file):
+	program = gruntime.load(file)
+	names = list(gruntime.variables)
+	code = gruntime.decode(program, names)[:-1]
+	with open(binary_path(file), "wb") as f:
+		f.write(pack(code, gruntime.variables))
+	print("Wrote compiled binary to " + binary_path(file))
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print("Please provide at least 1 argument, the path to a compiled G file (or -dis and the path to a .gb file).")
+		exit(-1)
+	if sys.argv[1] == '-dis':
+		if len(sys.argv) < 3:
+			print("Please provide the path to a .gb file to disassemble.")
+			exit(-1)
+		print(disassemble(sys.argv[2]))
+	else:
+		emit(sys.argv[1])
@@ -0,0 +1,113 @@
+import json
+import os
+import socket
+import sys
+
+# a small client for gservice.py -socket.
+#   python gclient.py [-socket FILE] compile my_program.gc [-name NAME]
+#   python gclient.py [-socket FILE] load my_program.g [-name NAME]
+#   python gclient.py [-socket FILE] run NAME X=3 X2=5 [-maxsteps N] [-timeout S] [-state]
+#   python gclient.py [-socket FILE] programs | drop NAME | shutdown
+#   python gclient.py [-socket FILE] -          (sends json lines from stdin as they are)
+# the socket is gservice.sock unless -socket is given. the responses are printed as
+# json lines, and the client waits for one for every request it sent.
+
+default_socket = 'gservice.sock'
+
+def client_error(msg, arg):
+	print("Client error, " + msg)
+	print(arg)
+	exit(-1)
+
+# the value of a -flag argument, or None
+def flag(name):
+	if name in sys.argv:
+		i = sys.argv.index(name)
+		if i+1 == len(sys.argv):
+			client_error(name + " needs a value", name)
+		return sys.argv[i+1]
+	return None
+
+def number(val, name):
+	try:
+		return int(val)
+	except ValueError:
+		pass
+	try:
+		return float(val)
+	except ValueError:
+		client_error(name + " takes a number", val)
+
+# the request for the command line, without the flags
+def command_request(args):
+	op = args[0]
+	request = {'op': op}
+	if op == 'compile' or op == 'load':
+		if len(args) < 2:
+			client_error(op + " needs a file", " ".join(args))
+		# the service may well be running somewhere else
+		request['file'] = os.path.abspath(args[1])
+		if flag('-name') is not None:
+			request['name'] = flag('-name')
+	elif op == 'run' or op == 'drop':
+		if len(args) < 2:
+			client_error(op + " needs the name of a program", " ".join(args))
+		request['program'] = args[1]
+		if op == 'run':
+			inputs = {}
+			for arg in args[2:]:
+				(var, _, val) = arg.partition('=')
+				if var == "" or not val.isdigit():
+					client_error("inputs are given as V=n", arg)
+				inputs[var] = int(val)
+			request['inputs'] = inputs
+			if flag('-maxsteps') is not None:
+				request['max_steps'] = int(number(flag('-maxsteps'), '-maxsteps'))
+			if flag('-timeout') is not None:
+				request['timeout'] = number(flag('-timeout'), '-timeout')
+			if '-state' in sys.argv:
+				request['state'] = True
+	elif op != 'programs' and op != 'shutdown':
+		client_error("unknown command", op)
+	return request
+
+def main():
+	path = flag('-socket') or default_socket
+	# the arguments which aren't flags or their values
+	args = []
+	for i in range(1, len(sys.argv)):
+		if sys.argv[i].startswith('-') and sys.argv[i] != '-':
+			continue
+		if sys.argv[i-1] in ['-socket', '-name', '-maxsteps', '-timeout']:
+			continue
+		args.append(sys.argv[i])
+	if args == []:
+		print("Please provide a command: compile, load, run, programs, drop, shutdown, or - to send json lines from stdin.")
+		exit(-1)
+	if args[0] == '-':
+		lines = [line.strip() for line in sys.stdin if line.strip() != ""]
+	else:
+		lines = [json.dumps(command_request(args))]
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(path)
+	except OSError as e:
+		client_error("could not connect to the service (is gservice.py -socket running?)", path + ": " + str(e))
+	conn = sock.makefile('rw')
+	for line in lines:
+		conn.write(line + "\n")
+	conn.flush()
+	failed = False
+	for i in range(len(lines)):
+		response = conn.readline()
+		if response == "":
+			client_error("the service closed the connection", path)
+		print(response.strip())
+		if not json.loads(response).get('ok'):
+			failed = True
+	sock.close()
+	if failed:
+		exit(-1)
+
+if __name__ == '__main__':
+	main()
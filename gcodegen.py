@@ -0,0 +1,285 @@
+import hashlib
+import os
+import sys
+
+import goptimize
+import gruntime
+
+# python code generation backend for compiled .g files.
+# instead of interpreting the program one statement at a time this translates it
+# into the source of a python function, compiles it and runs that.
+# - every variable becomes a local (r0, r1, ... in %vars order)
+# - basic blocks become straight-line code
+# - if-gotos become python ifs, blocks with only one way in are inlined where they are
+#   jumped to, and loops back to the start of a region become a plain `continue`
+# - anything else (blocks with more than one way in) is reached through a small
+#   dispatch on pc at the top of the function
+# the generated module is cached next to the .g file as a .gpy file.
+
+# how deep the inlined ifs are allowed to nest before a block is
+# reached through the dispatch instead (python has a limit on indentation).
+max_depth = 40
+
+# bump this whenever the generated code changes so stale .gpy caches get rebuilt
+version = 2
+
+# splits decoded code into basic blocks.
+# returns a dict of block start -> block end (exclusive).
+def find_blocks(code):
+	leaders = set([0])
+	for pc in range(len(code)):
+		op, slot, target = code[pc]
+		if op == gruntime.OP_IF or op == gruntime.OP_BRANCH:
+			leaders.add(target)
+			leaders.add(pc+1)
+		elif op == gruntime.OP_EXIT:
+			leaders.add(pc+1)
+	leaders = sorted([l for l in leaders if l < len(code)])
+	blocks = {}
+	for i in range(len(leaders)):
+		if i+1 < len(leaders):
+			blocks[leaders[i]] = leaders[i+1]
+		else:
+			blocks[leaders[i]] = len(code)
+	return blocks
+
+# the slot an intrinsic (the slot of an OP_NATIVE) writes to
+def written(native):
+	(fn, prefix, slots) = native
+	return slots[goptimize.intrinsic_dest[prefix]]
+
+# returns the blocks control can go to after the given block.
+# the goto idiom (V++ then if V not 0 goto L in the same block) is an
+# unconditional jump so it has no fallthrough.
+def successors(code, blocks, start):
+	end = blocks[start]
+	op, slot, target = code[end-1]
+	if op == gruntime.OP_EXIT:
+		return []
+	if op == gruntime.OP_BRANCH:
+		if slot[1] == 'goto':
+			return [target]
+		return [target, end]
+	if op != gruntime.OP_IF:
+		return [end]
+	# is the tested variable incremented earlier in the block, and not decremented
+	# or set by an intrinsic after?
+	nonzero = False
+	for pc in range(start, end-1):
+		if code[pc][1] == slot and code[pc][0] == gruntime.OP_INC:
+			nonzero = True
+		elif code[pc][1] == slot and code[pc][0] == gruntime.OP_DEC:
+			nonzero = False
+		elif code[pc][0] == gruntime.OP_NATIVE and written(code[pc][1]) == slot:
+			nonzero = False
+	if nonzero:
+		return [target]
+	return [target, end]
+
+# works out which blocks need to be reachable through the dispatch.
+# this is the first block plus every block with more than one way in,
+# only counting the ways in from blocks that can actually run.
+def find_entries(code, blocks):
+	reachable = set([0])
+	todo = [0]
+	edges = {}
+	while todo:
+		start = todo.pop()
+		for succ in successors(code, blocks, start):
+			edges[succ] = edges.get(succ, 0) + 1
+			if not succ in reachable:
+				reachable.add(succ)
+				todo.append(succ)
+	entries = set([0])
+	for start in edges:
+		if edges[start] > 1:
+			entries.add(start)
+	return entries
+
+# generates the python source for a decoded program.
+# the result defines run(regs), which runs the program against the list of registers
+# (updating it in place) and returns the number of steps executed, same as gruntime.execute.
+def generate(names, code):
+	blocks = find_blocks(code)
+	entries = find_entries(code, blocks)
+	writeback = "regs[:] = [" + ", ".join(["r" + str(i) for i in range(len(names))]) + "]"
+	regions = {}
+	loops = set()
+	pending = sorted(entries)
+	# the blocks being inlined on the path emit_jump is on
+	inlining = set()
+
+	# emits the code for one block (and anything inlined after it) into out.
+	# known maps a slot to True/False if the variable is known to be nonzero/zero on this path.
+	# steps is the step count not yet added on this path, it is only written out
+	# right before control leaves the path so a loop iteration costs one addition.
+	def emit_block(out, start, head, depth, known, steps):
+		end = blocks[start]
+		ind = "\t" * depth
+		if code[end-1][0] == gruntime.OP_EXIT:
+			steps += end - start - 1
+		else:
+			steps += end - start
+		for pc in range(start, end):
+			op, slot, target = code[pc]
+			r = "r" + str(slot)
+			if op == gruntime.OP_INC:
+				if known.get(slot) is False:
+					out.append(ind + r + " = 1")
+				else:
+					out.append(ind + r + " += 1")
+				known[slot] = True
+			elif op == gruntime.OP_DEC:
+				# decrements clamp at 0
+				if known.get(slot):
+					out.append(ind + r + " -= 1")
+				elif known.get(slot) is None:
+					out.append(ind + "if " + r + ":")
+					out.append(ind + "\t" + r + " -= 1")
+				if known.get(slot):
+					del known[slot]
+			elif op == gruntime.OP_NATIVE:
+				# intrinsic, written out inline over the locals
+				for l in gruntime.intrinsic_code(slot[1], ["r" + str(s) for s in slot[2]]):
+					out.append(ind + l)
+				if written(slot) in known:
+					del known[written(slot)]
+			elif op == gruntime.OP_BRANCH:
+				if slot[1] == 'goto':
+					emit_jump(out, target, head, depth, known, steps)
+				else:
+					out.append(ind + "if " + gruntime.intrinsic_code(slot[1], ["r" + str(s) for s in slot[2]]) + ":")
+					emit_jump(out, target, head, depth+1, dict(known), steps)
+					emit_jump(out, end, head, depth, known, steps)
+				return
+			elif op == gruntime.OP_EXIT:
+				emit_steps(out, depth, steps)
+				out.append(ind + writeback)
+				out.append(ind + "return steps")
+				return
+			elif op == gruntime.OP_IF:
+				if known.get(slot):
+					emit_jump(out, target, head, depth, known, steps)
+				elif known.get(slot) is False:
+					emit_jump(out, end, head, depth, known, steps)
+				else:
+					taken = dict(known)
+					taken[slot] = True
+					known[slot] = False
+					out.append(ind + "if " + r + ":")
+					emit_jump(out, target, head, depth+1, taken, steps)
+					emit_jump(out, end, head, depth, known, steps)
+				return
+		# fell off the end of the block into the next one
+		emit_jump(out, end, head, depth, known, steps)
+
+	def emit_jump(out, target, head, depth, known, steps):
+		ind = "\t" * depth
+		if target == head:
+			loops.add(head)
+			emit_steps(out, depth, steps)
+			out.append(ind + "continue")
+		elif target in entries:
+			emit_steps(out, depth, steps)
+			out.append(ind + "pc = " + str(target))
+			out.append(ind + "break")
+		elif depth > max_depth or target in inlining:
+			# too deep, or a loop find_entries didn't see coming (which would be inlined
+			# forever), so go through the dispatch for this one
+			entries.add(target)
+			pending.append(target)
+			emit_steps(out, depth, steps)
+			out.append(ind + "pc = " + str(target))
+			out.append(ind + "break")
+		else:
+			inlining.add(target)
+			emit_block(out, target, head, depth, known, steps)
+			inlining.remove(target)
+
+	def emit_steps(out, depth, steps):
+		if steps:
+			out.append("\t" * depth + "steps += " + str(steps))
+
+	while pending:
+		head = pending.pop()
+		out = []
+		emit_block(out, head, head, 0, {}, 0)
+		regions[head] = out
+
+	# builds the dispatch over region heads as a binary tree of ifs on pc
+	def emit_dispatch(src, heads, depth):
+		ind = "\t" * depth
+		if len(heads) == 1:
+			if heads[0] in loops:
+				src.append(ind + "while True:")
+				for l in regions[heads[0]]:
+					src.append(ind + "\t" + l)
+			else:
+				# no loop back to the head, so go straight back to the dispatch
+				for l in regions[heads[0]]:
+					if l.strip() == "break":
+						l = l.replace("break", "continue")
+					src.append(ind + l)
+			return
+		mid = len(heads) // 2
+		src.append(ind + "if pc < " + str(heads[mid]) + ":")
+		emit_dispatch(src, heads[:mid], depth+1)
+		src.append(ind + "else:")
+		emit_dispatch(src, heads[mid:], depth+1)
+
+	src = []
+	src.append("# variables: " + ",".join(names))
+	src.append("def run(regs):")
+	if names:
+		src.append("\t" + ", ".join(["r" + str(i) for i in range(len(names))]) + ", = regs")
+	src.append("\tsteps = 0")
+	src.append("\tpc = 0")
+	src.append("\twhile True:")
+	emit_dispatch(src, sorted(regions), 2)
+	return "\n".join(src) + "\n"
+
+# hash of everything the generated code depends on (not the %specvar values)
+def program_hash(names, program):
+	h = hashlib.sha1()
+	h.update(str(version).encode())
+	h.update((",".join(names) + "\n" + "\n".join(program)).encode())
+	return h.hexdigest()
+
+# the cached module for a .g file lives next to it as a .gpy file
+def cache_path(file):
+	return os.path.splitext(file)[0] + ".gpy"
+
+# returns the python source for a .g file, using the cached .gpy if it is up to date
+# and regenerating (and re-caching) it if not.
+def source_for(file, program, names):
+	digest = program_hash(names, program)
+	header = "# generated by gcodegen.py from " + os.path.basename(file) + " - " + digest
+	path = cache_path(file)
+	if os.path.exists(path):
+		with open(path) as f:
+			src = f.read()
+		if src.startswith(header + "\n"):
+			return src
+	src = header + "\n" + generate(names, gruntime.decode(program, names))
+	with open(path, "w") as f:
+		f.write(src)
+	return src
+
+# returns the compiled run(regs) function for a loaded .g file.
+def load(file, program, names):
+	src = source_for(file, program, names)
+	module = {}
+	exec(compile(src, cache_path(file), "exec"), module)
+	return module['run']
+
+# writes the .gpy for a compiled .g file, used by precompile.py -emitpy
+def emit(file):
+	program = gruntime.load(file)
+	source_for(file, program, list(gruntime.variables))
+	print("Wrote generated python to " + cache_path(file))
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print("Please provide at least 1 argument, the path to a compiled G file.")
+		exit(-1)
+	emit(sys.argv[1])
@@ -0,0 +1,286 @@
+import time
+
+import gruntime
+
+# tracing jit for gruntime.py -jit.
+# the runtime already runs simple counting loops and straight-line blocks in one go
+# (find_loops, find_blocks), but loops with branches in them, or loops within loops,
+# are still run an instruction at a time. this counts how often each backward jump is
+# taken, and once a loop head has been jumped back to hot_loop times it records the
+# path one pass of the loop takes from there (following the actual values) and
+# compiles it to a python function which keeps the variables it uses in locals and
+# goes round the loop for as long as the path is the same:
+# - every branch on the path becomes a guard, which leaves the trace (back to the
+#   interpreter, at the other side of the branch) when it goes the other way
+# - a taken jump leaves the trace too when a check is due, so the limits and cycle
+#   checks happen at exactly the same steps as without -jit
+# intrinsics are put in the trace as python (see gruntime.intrinsic_code). only
+# innermost loops are traced: a path which jumps back anywhere other than its own head
+# (an inner loop, which gets a trace of its own) or which reaches the exit isn't, and
+# that head isn't tried again.
+# the results and step counts are the same as gruntime.execute.
+
+# how many times a loop head is jumped back to before its loop is traced
+hot_loop = 50
+# the longest path that's traced, in instructions
+max_trace = 400
+
+# counts for the last run, see report
+stats = {}
+
+# follows one pass of the loop at head on a copy of the registers.
+# returns the path as a list of (pc, whether it jumped), or None if it can't be traced.
+def record(code, head, regs):
+	regs = list(regs)
+	pc = head
+	path = []
+	while len(path) < max_trace:
+		op, slot, target = code[pc]
+		at = pc
+		taken = False
+		if op == gruntime.OP_INC:
+			regs[slot] += 1
+			pc += 1
+		elif op == gruntime.OP_DEC:
+			if regs[slot]:
+				regs[slot] -= 1
+			pc += 1
+		elif op == gruntime.OP_SKIP:
+			pc += 1
+		elif op == gruntime.OP_IF:
+			taken = regs[slot] != 0
+			pc = target if taken else pc + 1
+		elif op == gruntime.OP_BLOCK:
+			for s, a, b in slot:
+				regs[s] = max(regs[s] + a, b)
+			test, jump, next_pc, length = target
+			taken = test >= 0 and regs[test] != 0
+			pc = jump if taken else next_pc
+		elif op == gruntime.OP_LOOP:
+			min_count, length, extra, exit_pc, adds, subs, path_ = target
+			n = max(regs[slot], min_count)
+			for s, k in adds:
+				regs[s] += k*n
+			for s, k in subs:
+				regs[s] = max(regs[s] - k*n, 0)
+			regs[slot] = 0
+			pc = exit_pc
+		elif op == gruntime.OP_NATIVE:
+			slot[0](regs)
+			pc += 1
+		elif op == gruntime.OP_BRANCH:
+			taken = bool(slot[0](regs))
+			pc = target if taken else pc + 1
+		else:
+			# the exit
+			return None
+		path.append((at, taken))
+		if taken and pc == head:
+			return path
+		if taken and pc <= at:
+			# an inner loop
+			return None
+	return None
+
+# the slots the instructions on a path use
+def path_slots(code, path):
+	used = set()
+	for (at, taken) in path:
+		op, slot, target = code[at]
+		if op == gruntime.OP_BLOCK:
+			used.update([s for (s, a, b) in slot])
+			if target[0] >= 0:
+				used.add(target[0])
+		elif op == gruntime.OP_LOOP:
+			used.add(slot)
+			used.update([s for (s, k) in target[4] + target[5]])
+		elif op == gruntime.OP_NATIVE or op == gruntime.OP_BRANCH:
+			used.update(slot[2])
+		elif op != gruntime.OP_SKIP:
+			used.add(slot)
+	return sorted(used)
+
+# turns a recorded path into the source of a python function
+# trace(regs, gc, check_at) -> (pc, gc, whether it left by a jump)
+def trace_source(code, head, path):
+	used = path_slots(code, path)
+	lines = ["def trace(regs, gc, check_at):"]
+	lines += ["\tr%d = regs[%d]" % (s, s) for s in used]
+	lines.append("\twhile True:")
+	sync = "".join(["regs[%d] = r%d; " % (s, s) for s in used])
+	# steps since gc was last brought up to date
+	pending = 0
+	def leave(pc, jumped):
+		return "%sreturn (%d, gc + %d, %s)" % (sync, pc, pending, jumped)
+	# a branch on the path: a guard for going the other way, and the check for a jump
+	# (test being a python condition)
+	def branch(test, taken, jump, fall):
+		if taken:
+			lines.append("\t\tif not (%s): %s" % (test, leave(fall, False)))
+			lines.append("\t\tif gc + %d >= check_at: %s" % (pending, leave(jump, True)))
+		else:
+			lines.append("\t\tif %s: %s" % (test, leave(jump, True)))
+	for (at, taken) in path:
+		op, slot, target = code[at]
+		if op == gruntime.OP_INC:
+			lines.append("\t\tr%d += 1" % slot)
+			pending += 1
+		elif op == gruntime.OP_DEC:
+			lines.append("\t\tif r%d: r%d -= 1" % (slot, slot))
+			pending += 1
+		elif op == gruntime.OP_SKIP:
+			pending += 1
+		elif op == gruntime.OP_IF:
+			pending += 1
+			branch("r%d" % slot, taken, target, at + 1)
+		elif op == gruntime.OP_BLOCK:
+			for s, a, b in slot:
+				lines.append("\t\tr%d += %d" % (s, a))
+				lines.append("\t\tif r%d < %d: r%d = %d" % (s, b, s, b))
+			test, jump, next_pc, length = target
+			pending += length
+			if test >= 0:
+				branch("r%d" % test, taken, jump, next_pc)
+		elif op == gruntime.OP_LOOP:
+			min_count, length, extra, exit_pc, adds, subs, path_ = target
+			lines.append("\t\tn = r%d if r%d > %d else %d" % (slot, slot, min_count, min_count))
+			for s, k in adds:
+				lines.append("\t\tr%d += %d*n" % (s, k))
+			for s, k in subs:
+				lines.append("\t\tr%d -= %d*n" % (s, k))
+				lines.append("\t\tif r%d < 0: r%d = 0" % (s, s))
+			lines.append("\t\tr%d = 0" % slot)
+			lines.append("\t\tgc += n*%d + %d" % (length, extra + pending))
+			pending = 0
+		elif op == gruntime.OP_NATIVE:
+			ops = ["r%d" % s for s in slot[2]]
+			lines += ["\t\t" + l for l in gruntime.intrinsic_code(slot[1], ops)]
+			pending += 1
+		elif op == gruntime.OP_BRANCH:
+			ops = ["r%d" % s for s in slot[2]]
+			pending += 1
+			branch(gruntime.intrinsic_code(slot[1], ops), taken, target, at + 1)
+	lines.append("\t\tgc += %d" % pending)
+	return "\n".join(lines) + "\n"
+
+def compile_trace(code, head, path):
+	scope = {}
+	exec(trace_source(code, head, path), scope)
+	return scope['trace']
+
+# same as gruntime.execute, with the loops which get hot run by traces.
+# fills in stats as it goes.
+def execute(code, regs):
+	global stats
+	stats = {'traces': 0, 'untraceable': 0, 'entries': 0, 'side_exits': 0, 'trace_steps': 0, 'steps': 0}
+	# the trace for each loop head: None if there isn't one yet, False if it can't be traced
+	traces = [None] * len(code)
+	hot = [0] * len(code)
+	gc = 0
+	pc = 0
+	watch = {'start': time.monotonic(), 'monotone': None, 'saved': None, 'power': 1, 'count': 0, 'saved_at': 0}
+	check_at = gruntime.next_check(0)
+	while True:
+		op, slot, target = code[pc]
+		at = pc
+		jumped = False
+		if op == gruntime.OP_BLOCK:
+			for s, a, b in slot:
+				v = regs[s] + a
+				if v > b:
+					regs[s] = v
+				else:
+					regs[s] = b
+			test, jump, pc, length = target
+			gc += length
+			if test >= 0 and regs[test]:
+				pc = jump
+				jumped = True
+		elif op == gruntime.OP_IF:
+			gc += 1
+			if regs[slot]:
+				pc = target
+				jumped = True
+			else:
+				pc += 1
+		elif op == gruntime.OP_INC:
+			regs[slot] += 1
+			pc += 1
+			gc += 1
+		elif op == gruntime.OP_DEC:
+			if regs[slot]:
+				regs[slot] -= 1
+			pc += 1
+			gc += 1
+		elif op == gruntime.OP_SKIP:
+			pc += 1
+			gc += 1
+		elif op == gruntime.OP_NATIVE:
+			slot[0](regs)
+			pc += 1
+			gc += 1
+		elif op == gruntime.OP_BRANCH:
+			gc += 1
+			if slot[0](regs):
+				pc = target
+				jumped = True
+			else:
+				pc += 1
+		elif op == gruntime.OP_LOOP:
+			min_count, length, extra, exit_pc, adds, subs, path = target
+			n = regs[slot]
+			if n < min_count:
+				n = min_count
+			for s, k in adds:
+				regs[s] += k*n
+			for s, k in subs:
+				v = regs[s] - k*n
+				if v > 0:
+					regs[s] = v
+				else:
+					regs[s] = 0
+			regs[slot] = 0
+			gc += n*length + extra
+			pc = exit_pc
+		else:
+			stats['steps'] = gc
+			return (gc, "halted")
+		while jumped:
+			jumped = False
+			if gc >= check_at:
+				stop = gruntime.check(watch, code, pc, regs, gc)
+				if stop:
+					stats['steps'] = gc
+					return (gc, stop)
+				check_at = gruntime.next_check(gc)
+			if pc > at:
+				break
+			t = traces[pc]
+			if t is None:
+				hot[pc] += 1
+				if hot[pc] == hot_loop:
+					path = record(code, pc, regs)
+					if path is None:
+						traces[pc] = False
+						stats['untraceable'] += 1
+					else:
+						traces[pc] = compile_trace(code, pc, path)
+						stats['traces'] += 1
+			elif t:
+				before = gc
+				(pc, gc, jumped) = t(regs, gc, check_at)
+				stats['entries'] += 1
+				stats['trace_steps'] += gc - before
+				if not jumped or gc < check_at:
+					# left by a guard rather than for a check
+					stats['side_exits'] += 1
+				# a trace can leave by a jump to anywhere, which is handled like any other jump
+				at = len(code)
+
+# prints how much of the last run was in traces
+def report():
+	total = max(stats['steps'], 1)
+	print("JIT: " + str(stats['traces']) + " loops traced (" + str(stats['untraceable']) + " could not be), "
+		+ str(stats['trace_steps']) + " of " + str(stats['steps']) + " steps (" + "%.1f%%" % (100.0 * stats['trace_steps'] / total)
+		+ ") ran in traces and " + str(stats['steps'] - stats['trace_steps']) + " in the interpreter, "
+		+ str(stats['entries']) + " trace entries, " + str(stats['side_exits']) + " side exits")
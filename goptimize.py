@@ -0,0 +1,420 @@
+import re
+
+import gruntime
+
+# optimization passes for expanded programs, used by precompile.py -O.
+# these work on the program after macro expansion but before label replacement,
+# so jumps still go to labels and statements can be removed freely.
+# - skips (e.g. the end of macro markers) are removed, their labels move to the next line
+# - an if-goto whose variable is known to be nonzero (e.g. the goto idiom V++ ; if V not 0 goto L)
+#   becomes an unconditional jump, and one whose variable is known to be zero is removed,
+#   as is a V-- on a variable known to be zero (so zeroing loops on zero variables go away)
+# - jumps to jumps are threaded to their final target, jumps to an exit become an exit
+#   and jumps to the next line are removed
+# - ++ and -- on variables made up by the compiler which are never tested are removed
+# all of this keeps the values of the variables from the source program exactly the same
+# (only the variables made up during macro expansion, and the step counts, change).
+# there is no unconditional jump in G, so the jumps are written as
+# `if T not 0 goto L` with one variable T set to 1 at the start of the program,
+# or as `goto L` when the runtime is doing intrinsics anyway.
+
+label_checker = re.compile(r'\[[A-Za-z]+[0-9]*\]$')
+
+# parses statements into instructions, [labels, op, args, comment] where op is one of
+# inc, dec (args [V]), if (args [V, L]), jump (args [L]), skip, exit,
+# or call for an intrinsic (args is all the tokens of the call)
+def parse(program):
+	code = []
+	for stmt in program:
+		comment = ""
+		if " ; " in stmt:
+			comment = stmt[stmt.index(" ; "):]
+			stmt = stmt[:stmt.index(" ; ")]
+		tokens = [token for token in stmt.split(' ') if token.strip() != ""]
+		labels = []
+		if label_checker.match(tokens[0]):
+			labels.append(tokens[0][1:-1])
+			tokens = tokens[1:]
+		first = tokens[0]
+		if first.endswith("++"):
+			code.append([labels, 'inc', [first[:-2]], comment])
+		elif first.endswith("--"):
+			code.append([labels, 'dec', [first[:-2]], comment])
+		elif first == "if":
+			code.append([labels, 'if', [tokens[1], tokens[5]], comment])
+		elif first == "goto":
+			# (goto is a macro, so it's only still here when it's the intrinsic)
+			code.append([labels, 'jump', [tokens[1]], comment])
+		elif first == "skip" or first == "exit":
+			code.append([labels, first, [], comment])
+		else:
+			code.append([labels, 'call', tokens, comment])
+	return code
+
+# the variables an instruction uses, and the labels it can jump to
+def operands(ins):
+	(labels, op, args, comment) = ins
+	if op == 'inc' or op == 'dec':
+		return (args, [])
+	if op == 'if':
+		return ([args[0]], [args[1]])
+	if op == 'jump':
+		return ([], args)
+	if op == 'call':
+		(var_count, label_count) = gruntime.intrinsics[args[0]]
+		return (args[1:1+var_count], args[1+var_count:1+var_count+label_count])
+	return ([], [])
+
+# maps each label to the index of the instruction it is on
+def label_index(code):
+	index = {}
+	for i in range(len(code)):
+		for label in code[i][0]:
+			index[label] = i
+	return index
+
+# rebuilds the code without the instructions at the given indexes,
+# moving their labels onto the instruction after them.
+def remove(code, dead):
+	out = []
+	labels = []
+	for i in range(len(code)):
+		if i in dead:
+			labels += code[i][0]
+		else:
+			code[i][0] = labels + code[i][0]
+			labels = []
+			out.append(code[i])
+	return out
+
+# the places control can go after instruction i, as (index, fact) where fact is
+# (variable, value) if taking that way means the variable is known to be zero (0) or nonzero (1).
+# a jump to a label that doesn't exist terminates the program, so it has no successor.
+def successors(code, index, i):
+	(labels, op, args, comment) = code[i]
+	if op == 'exit':
+		return []
+	if op == 'jump':
+		if args[0] in index:
+			return [(index[args[0]], None)]
+		return []
+	if op == 'if':
+		succs = [(i+1, (args[0], 0))]
+		if args[1] in index:
+			succs.append((index[args[1]], (args[0], 1)))
+		return succs
+	succs = [(i+1, None)]
+	for label in operands(code[i])[1]:
+		if label in index:
+			succs.append((index[label], None))
+	return succs
+
+# works out which variables are known to be zero or nonzero before each instruction.
+# the state at each instruction is a pair of bitsets (python ints, one bit per variable):
+# the variables known to be zero and the ones known to be nonzero.
+# returns the list of states (None where unreachable) and the bit for each variable.
+# the made up variables start at zero, the source ones could be set to anything by %specvar.
+def known_values(code, index, source_vars):
+	bits = {}
+	start = 0
+	for ins in code:
+		for var in operands(ins)[0]:
+			if not var in bits:
+				bits[var] = 1 << len(bits)
+				if not var in source_vars:
+					start |= bits[var]
+	states = [None] * len(code)
+	states[0] = (start, 0)
+	todo = [0]
+	while todo:
+		i = todo.pop()
+		(zero, nonzero) = states[i]
+		(labels, op, args, comment) = code[i]
+		if op == 'inc':
+			zero &= ~bits[args[0]]
+			nonzero |= bits[args[0]]
+		elif op == 'dec':
+			nonzero &= ~bits[args[0]]
+		elif op == 'call':
+			for var in operands(code[i])[0]:
+				zero &= ~bits[var]
+				nonzero &= ~bits[var]
+			if args[0] == 'zero':
+				zero |= bits[args[1]]
+			elif args[0] == 'unit':
+				nonzero |= bits[args[1]]
+		for (succ, fact) in successors(code, index, i):
+			new = (zero, nonzero)
+			if fact:
+				bit = bits[fact[0]]
+				if fact[1] == 0:
+					if nonzero & bit:
+						# the if can't go this way
+						continue
+					new = (zero | bit, nonzero)
+				else:
+					if zero & bit:
+						continue
+					new = (zero, nonzero | bit)
+			if states[succ] is None:
+				states[succ] = new
+				todo.append(succ)
+			else:
+				# keep only what is known on every way in
+				merged = (states[succ][0] & new[0], states[succ][1] & new[1])
+				if merged != states[succ]:
+					states[succ] = merged
+					todo.append(succ)
+	return (states, bits)
+
+# uses the known values to drop/fold instructions, returns (code, changed)
+def fold_known(code, source_vars):
+	index = label_index(code)
+	(states, bits) = known_values(code, index, source_vars)
+	dead = set()
+	jumps = 0
+	for i in range(len(code)):
+		if states[i] is None:
+			continue
+		(zero, nonzero) = states[i]
+		(labels, op, args, comment) = code[i]
+		if op == 'dec' and zero & bits[args[0]]:
+			# decrementing zero does nothing
+			dead.add(i)
+		elif op == 'if' and zero & bits[args[0]]:
+			# never taken
+			dead.add(i)
+		elif op == 'if' and nonzero & bits[args[0]]:
+			# always taken
+			code[i] = [labels, 'jump', [args[1]], comment]
+			jumps += 1
+	return (remove(code, dead), len(dead) > 0 or jumps > 0)
+
+# follows a label through unconditional jumps (and through if-gotos on the same
+# variable, when we got there by that variable being nonzero) to where it ends up.
+def final_target(code, index, label, var):
+	seen = set()
+	while label in index and not label in seen:
+		seen.add(label)
+		(labels, op, args, comment) = code[index[label]]
+		if op == 'jump':
+			label = args[0]
+		elif op == 'if' and var is not None and args[0] == var:
+			label = args[1]
+		else:
+			break
+	return label
+
+# threads jumps to their final targets and drops jumps to the next line, returns (code, changed)
+def thread_jumps(code):
+	changed = False
+	index = label_index(code)
+	dead = set()
+	for i in range(len(code)):
+		(labels, op, args, comment) = code[i]
+		if op == 'jump' or op == 'if':
+			var = args[0] if op == 'if' else None
+			target = final_target(code, index, args[-1], var)
+			if target != args[-1]:
+				args[-1] = target
+				changed = True
+			if op == 'jump' and (not target in index or code[index[target]][1] == 'exit'):
+				# a jump straight to the end
+				code[i] = [labels, 'exit', [], comment]
+				changed = True
+			elif target in index and index[target] == i+1:
+				# jumps to the next line either way
+				dead.add(i)
+		elif op == 'skip':
+			dead.add(i)
+	return (remove(code, dead), changed or len(dead) > 0)
+
+# removes ++ and -- on made up variables which are never tested, returns (code, changed)
+def remove_unused(code, source_vars):
+	tested = set()
+	for ins in code:
+		if ins[1] != 'inc' and ins[1] != 'dec':
+			tested.update(operands(ins)[0])
+	dead = set()
+	for i in range(len(code)):
+		(labels, op, args, comment) = code[i]
+		if (op == 'inc' or op == 'dec') and not args[0] in tested and not args[0] in source_vars:
+			dead.add(i)
+	return (remove(code, dead), len(dead) > 0)
+
+# which operand each non-branching intrinsic writes its result to.
+# everything else an intrinsic is given it only reads.
+intrinsic_dest = {
+	'zero': 0,
+	'unit': 0,
+	'assign': 0,
+	'sum': 2,
+	'mult': 2,
+	'monus': 2,
+	'lte': 2,
+	'iseven': 1,
+}
+
+# the variables an instruction reads and the variable it completely overwrites (or None).
+# V++ and V-- are left out, they only read the variable to change that same variable,
+# so on their own they don't make it worth keeping.
+def reads_writes(ins):
+	(labels, op, args, comment) = ins
+	if op == 'inc' or op == 'dec':
+		return ([], None)
+	vars = operands(ins)[0]
+	if op == 'call' and args[0] in intrinsic_dest:
+		dest = vars[intrinsic_dest[args[0]]]
+		sources = vars[:intrinsic_dest[args[0]]] + vars[intrinsic_dest[args[0]]+1:]
+		if args[0] == 'zero' or args[0] == 'unit':
+			sources = []
+		if args[0] == 'mult' or dest in sources:
+			# mult adds onto whatever is in dst already,
+			# and e.g. sum X Y X reads X before writing it
+			return (vars, None)
+		return (sources, dest)
+	return (vars, None)
+
+# works out which variables are live (could still be tested, or are part of the result)
+# after each instruction, as bitsets like known_values.
+# observed are the variables whose values at the end count as the result of the program.
+def live_variables(code, index, observed):
+	bits = {}
+	for ins in code:
+		for var in operands(ins)[0]:
+			if not var in bits:
+				bits[var] = 1 << len(bits)
+	at_end = 0
+	for var in observed:
+		if var in bits:
+			at_end |= bits[var]
+	succs = []
+	preds = [[] for ins in code]
+	for i in range(len(code)):
+		succs.append([succ for (succ, fact) in successors(code, index, i)])
+		for succ in succs[i]:
+			preds[succ].append(i)
+	# instructions which can end the program (an exit, or a jump to a label that doesn't exist)
+	ends = set()
+	for i in range(len(code)):
+		(labels, op, args, comment) = code[i]
+		if op == 'exit' or [label for label in operands(code[i])[1] if not label in index]:
+			ends.add(i)
+	live_in = [0] * len(code)
+	live_out = [0] * len(code)
+	todo = list(range(len(code)))
+	queued = set(todo)
+	while todo:
+		i = todo.pop()
+		queued.discard(i)
+		out = at_end if i in ends else 0
+		for succ in succs[i]:
+			out |= live_in[succ]
+		live_out[i] = out
+		(reads, write) = reads_writes(code[i])
+		if write is not None:
+			out &= ~bits[write]
+		for var in reads:
+			out |= bits[var]
+		if out != live_in[i]:
+			live_in[i] = out
+			for pred in preds[i]:
+				if not pred in queued:
+					queued.add(pred)
+					todo.append(pred)
+	return (live_out, bits)
+
+# removes statements which can never run and writes to variables which are never
+# used afterwards, returns (code, changed).
+# the instruction with the E label is always kept, since label replacement sends
+# jumps to labels that don't exist there.
+def remove_dead(code, observed):
+	index = label_index(code)
+	# this also knows which way the goto idiom goes, so the line after one is unreachable
+	# unless something else jumps to it
+	(states, bits) = known_values(code, index, observed)
+	(live_out, bits) = live_variables(code, index, observed)
+	dead = set()
+	for i in range(len(code)):
+		(labels, op, args, comment) = code[i]
+		if 'E' in labels:
+			continue
+		if states[i] is None:
+			dead.add(i)
+		elif (op == 'inc' or op == 'dec') and not live_out[i] & bits[args[0]]:
+			dead.add(i)
+		elif op == 'call' and args[0] in intrinsic_dest:
+			# an intrinsic only changes its dst, so it isn't needed if that isn't used afterwards
+			dest = operands(code[i])[0][intrinsic_dest[args[0]]]
+			if not live_out[i] & bits[dest]:
+				dead.add(i)
+	return (remove(code, dead), len(dead) > 0)
+
+# removes dead code from an expanded program (list of statements, labels not replaced yet).
+# observed are the variables whose final values have to stay the same.
+def eliminate_dead_code(program, vars, observed):
+	code = parse(program)
+	changed = True
+	while changed:
+		(code, changed) = remove_dead(code, observed)
+	# any jumps here were goto intrinsics to start with
+	return write(code, vars, True)
+
+# the variables a (compiled or expanded) program uses
+def variables_used(program):
+	used = set()
+	for ins in parse(program):
+		used.update(operands(ins)[0])
+	return used
+
+# writes the instructions back out as statements.
+# every instruction gets at most one label, any others on it are renamed to that one.
+# E has to stay as it is, label replacement sends jumps to labels that don't exist there.
+def write(code, vars, use_goto):
+	alias = {}
+	for ins in code:
+		if 'E' in ins[0]:
+			ins[0] = ['E'] + [label for label in ins[0] if label != 'E']
+		for label in ins[0]:
+			alias[label] = ins[0][0]
+	program = []
+	always = None
+	for (labels, op, args, comment) in code:
+		stmt = ""
+		if labels:
+			stmt = "[" + labels[0] + "] "
+		if op == 'inc':
+			stmt += args[0] + "++"
+		elif op == 'dec':
+			stmt += args[0] + "--"
+		elif op == 'if':
+			stmt += "if " + args[0] + " not 0 goto " + alias.get(args[1], args[1])
+		elif op == 'jump' and use_goto:
+			stmt += "goto " + alias.get(args[0], args[0])
+		elif op == 'jump':
+			if always is None:
+				always = vars.fresh()
+			stmt += "if " + always + " not 0 goto " + alias.get(args[0], args[0])
+		elif op == 'call':
+			(var_count, label_count) = gruntime.intrinsics[args[0]]
+			stmt += " ".join(args[:1+var_count] + [alias.get(label, label) for label in args[1+var_count:]])
+		else:
+			stmt += op
+		program.append(stmt + comment)
+	if always is not None:
+		program.insert(0, always + "++")
+	return program
+
+# optimizes an expanded program (list of statements, labels not replaced yet).
+# vars is the symbol table of variables (for making up the always nonzero one),
+# source_vars are the variables named in the source program, which are left alone,
+# and use_goto says whether jumps can be written as the goto intrinsic.
+def optimize(program, vars, source_vars, use_goto=False):
+	code = parse(program)
+	changed = True
+	while changed:
+		(code, folded) = fold_known(code, source_vars)
+		(code, threaded) = thread_jumps(code)
+		(code, removed) = remove_unused(code, source_vars)
+		changed = folded or threaded or removed
+	return write(code, vars, use_goto)
@@ -1,200 +1,1495 @@
-import re
-import sys
-
-# the actual runtime for executing a compiled .g file.
-# this steals some code from precompile.py since the language is p simple
-# this can only run 'pure' g code (i.e. statements from 1 of the 5 possible types)
-# so no macros are expected to be present in these files.
-# there is allotment for specific directives (e.g. %vars)
-# but these must all be present in the header of the compiled file.
-
-variables = {}
-debug = False
-step = False
-
-def run_program(program):
-	global variables
-	gc = 0
-	pc = 0
-	# possible stmt in a program:
-	# V++
-	# V--
-	# if V not 0 goto L
-	# skip
-	# any content after a semicolon ; should be ignored
-	inc_checker = re.compile(r'[A-Za-z]+[0-9]*\+\+$')
-	dec_checker = re.compile(r'[A-Za-z]+[0-9]*\-\-$')
-	while True:
-		stmt = program[pc]
-		if debug:
-			print(variables)
-			print(str(gc) + ": (pc " + str(pc) + ") - " + stmt)
-			print()
-		if step:
-			print("State: " + str(variables))
-			print("Next instruction: " + stmt)
-			input("Enter to proceed")
-			print()
-		# tokenize the statement
-		stmt_tokens = stmt.split(' ')
-		stmt_tokens = [token for token in stmt_tokens if token.strip() != ""]
-		# start with the first token in the list.
-		first = stmt_tokens[0]
-		if inc_checker.match(first):
-			# match an increment operation, V++.
-			# make sure no other tokens exist after first.
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(pc+1)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-			# grab the variable name
-			var = first.replace("++", "")
-			# increment the variable
-			variables[var] += 1
-		elif dec_checker.match(first):
-			# match a decrement operation, V--.
-			# make sure no other tokens exist after first.
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(pc+1)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-			# grab the variable name
-			var = first.replace("--", "")
-			# decrement the variable, clamped to 0
-			variables[var] = max(0, variables[var]-1)
-		elif first == "if":
-			# if statement (conditional branch) has a very specific structure.
-			# if V not 0 goto L
-			# check remaining tokens... structure is very firm so we don't need to 
-			# be too concerned about looping over the tokens, just check the
-			# exact matching structure.
-			# check for wrong count of tokens
-			if len(stmt_tokens) < 6:
-				print("Error on line "+str(pc+1)+": Not enough tokens")
-				print(stmt)
-				exit(-1)
-			# check for too many tokens (not in a comment)
-			if len(stmt_tokens) > 6 and stmt_tokens[6].strip() != ";":
-				print("Error on line "+str(pc+1)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-			# get the V from the statement
-			var_compare = stmt_tokens[1]
-			# check for bad setup of the rest of the statement
-			if not stmt_tokens[2] == "not" or not stmt_tokens[3] == "0" or not stmt_tokens[4] == "goto":
-				print("Error on line "+str(pc+1)+": if statement missing not 0 goto clause")
-				print(stmt)
-				exit(-1)
-			# get the L from the statement
-			label_compare = stmt_tokens[5]
-			# now we compare the value of var_compare to 0
-			if variables[var_compare] != 0:
-				# if it's not 0 we change pc and continue
-				pc = int(label_compare)
-				gc += 1
-				continue
-		elif first == "skip":
-			# skip is always 'naked'
-			# make sure no other tokens exist
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(pc+1)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-		elif first == "exit":
-			# this isnt part of the formal grammar
-			# but i will use it when compiling to just be a straight-up termination
-			# statement.
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(pc+1)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-			return
-		else:
-			print("Error on line "+str(pc+1)+": Unmatched initial token")
-			print(stmt)
-			exit(-1)
-		pc += 1
-		gc += 1
-
-# definition for %specvar directive
-# %specvar provides an initialization value for a variable,
-# e.g. %specvar X 4 means X <- 4.
-def specvar(l):
-	global variables
-	# confirm the correct format
-	if not len(l.split(" ")) == 3:
-		print("Runtime error, %specvar has incorrect argument count")
-		print(l)
-		exit(-1)
-	var = l.split(" ")[1]
-	if not var in variables:
-		print("Runtime error, %specvar specifies a non-existent variable")
-		print(l)
-		exit(-1)
-	val = l.split(" ")[2]
-	if not val.isdigit():
-		print("Runtime error, %specvar assigns a non-numeric value to a variable")
-		print(l)
-		exit(-1)
-	# assign the value to the variable
-	variables[var] = int(val)
-
-def gruntime(file):
-	global variables
-	global debug
-	global step
-	if '-debug' in sys.argv:
-		debug = True
-	if '-step' in sys.argv:
-		step = True
-	program = []
-	# open the input file
-	with open(file) as f:
-		# load all lines into program
-		program = f.readlines()
-		# replace all newlines with blank and trim
-		# I also do a replacement from ';' -> ' ; ' to avoid difficulty tokenizing comments
-		program = [l.replace('\n', '').replace(';', ' ; ').strip() for l in program]
-		# remove any blank lines
-		program = [l for l in program if l is not ""]
-		# remove any lines starting with ;
-		# to not have to tokenize
-		program = [l for l in program if not l.startswith(';')]
-		# check for a leading '%vars' directive
-		# the %vars directive will always, always be line 0
-		if program[0].startswith("%vars"):
-			# load the list of vars
-			vars_ = program[0].split(" ")
-			if not len(vars_) == 2:
-				print("Runtime error, %vars malformed")
-				print(program[0])
-				exit(-1)
-			vars = vars_[1].split(',')
-			for var in vars:
-				variables[var] = 0
-			# now remove the leading %vars directive
-			program = program[1:]
-		# check for any other % directives
-		# some will be processed but the rest will be ignored
-		line = 0
-		l = program[line]
-		while (l.startswith("%")):
-			# %specvar V i fills variable V with integer i initially.
-			if l.startswith("%specvar"):
-				# offloaded
-				specvar(l)
-			line += 1
-			l = program[line]
-		# this cuts off all the % directives
-		program = program[line:]
-		# now we want to actually run the program.
-		run_program(program)
-		# print the return value of the program
-		print("out: " + str(variables['Y']))
-		print("final state: " + str(variables))
-
-if __name__ == '__main__':
-	if len(sys.argv) < 2:
-		print("Please provide at least 1 argument, the path to a compiled G file, and optionally additional -flags after this.")
-		exit(-1)
-	gruntime(sys.argv[1])
\ No newline at end of file
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
+import time
+
+# the actual runtime for executing a compiled .g file.
+# this steals some code from precompile.py since the language is p simple
+# this can only run 'pure' g code (i.e. statements from 1 of the 5 possible types)
+# so no macros are expected to be present in these files.
+# there is allotment for specific directives (e.g. %vars)
+# but these must all be present in the header of the compiled file.
+
+variables = {}
+debug = False
+step = False
+loops = True
+fuse = True
+# limits on a single run (see check), None for no limit
+max_steps = None
+max_seconds = None
+# stop runs which come back to exactly the same state, since those never halt
+detect_cycles = True
+# how many steps go by between checks of the limits and the state
+check_interval = 4096
+# when set, a run is paused at the first check once it's taken this many steps, after
+# the limits and cycles have been checked (gservice runs a slice at a time this way)
+pause_at = None
+# -profile, and the number of times each line ran in the last profiled run
+profile = False
+profiled = None
+# the settings of -trace (see gtrace.py), None when not tracing
+trace = None
+# -jit, run hot loops with traces compiled to python (see gjit.py)
+jit = False
+# the settings of -checkpoint (see read_checkpoint), None when not saving checkpoints
+checkpoint = None
+# set when the process is asked to stop while saving checkpoints, the run saves one
+# and stops at the next check
+interrupted = False
+# the pc a run stopped by a limit stopped at, so it can be carried on from there
+# (see execute)
+stopped_pc = None
+
+# opcodes for decoded statements.
+# the program is decoded once at load time into a list of (opcode, slot, target)
+# tuples, so the main loop never has to split, match or int() anything.
+# slot is the index of the variable in the register list (the order of %vars),
+# target is the line an if-goto jumps to.
+OP_INC = 0
+OP_DEC = 1
+OP_IF = 2
+OP_SKIP = 3
+OP_EXIT = 4
+# a whole counting loop, executed in one go (see find_loops)
+OP_LOOP = 5
+# intrinsics (see below), slot is (function, prefix, slots) instead of a single slot.
+# a branching intrinsic jumps to target when its function returns true.
+OP_NATIVE = 6
+OP_BRANCH = 7
+# a fused run of straight-line statements, executed in one go (see find_blocks)
+OP_BLOCK = 8
+# calls into subroutines, for programs compiled with precompile.py -shared (see decode_linked)
+OP_CALL = 9
+OP_RET = 10
+# if V not 0 goto a label the subroutine was given, which leaves it
+OP_LEAVE = 11
+
+# intrinsics are stdlib macros which the runtime can run natively
+# instead of as their expanded G code. precompile.py -intrinsics leaves calls
+# to these in the compiled code, e.g. `sum X X2 Y` or `be X X2 12`.
+# prefix -> (number of variable operands, number of label operands)
+# the variable operands always come before the label operands.
+intrinsics = {
+	'zero': (1, 0),
+	'unit': (1, 0),
+	'assign': (2, 0),
+	'sum': (3, 0),
+	'mult': (3, 0),
+	'monus': (3, 0),
+	'lte': (3, 0),
+	'iseven': (2, 0),
+	'goto': (0, 1),
+	'bz': (1, 1),
+	'be': (2, 1),
+	'bne': (2, 1),
+}
+
+# returns python for an intrinsic over the given operands (python expressions for the variables).
+# for the plain ones this is a list of statements, for the branching ones it's a condition
+# which is true when the macro would jump to its label.
+# these have to do exactly what the expanded macro does, including when two operands are
+# the same variable - e.g. assign zeroes dst before copying, so `assign X X` leaves X at 0.
+def intrinsic_code(prefix, ops):
+	if prefix == 'zero':
+		return [ops[0] + " = 0"]
+	if prefix == 'unit':
+		return [ops[0] + " = 1"]
+	if prefix == 'assign':
+		if ops[0] == ops[1]:
+			return [ops[0] + " = 0"]
+		return [ops[0] + " = " + ops[1]]
+	if prefix == 'sum':
+		# assign c a, then add b to c (b is read after the assign)
+		return intrinsic_code('assign', [ops[2], ops[0]]) + [ops[2] + " += " + ops[1]]
+	if prefix == 'mult':
+		# adds a to c, b times over (b is copied first). if a is c, c doubles each time.
+		if ops[0] == ops[2]:
+			return [ops[2] + " <<= " + ops[1]]
+		return [ops[2] + " += " + ops[0] + " * " + ops[1]]
+	if prefix == 'monus':
+		return [ops[2] + " = " + ops[0] + " - " + ops[1] + " if " + ops[0] + " > " + ops[1] + " else 0"]
+	if prefix == 'lte':
+		return [ops[2] + " = 1 if " + ops[0] + " <= " + ops[1] + " else 0"]
+	if prefix == 'iseven':
+		return [ops[1] + " = 1 - (" + ops[0] + " & 1)"]
+	if prefix == 'goto':
+		return "True"
+	if prefix == 'bz':
+		return ops[0] + " == 0"
+	if prefix == 'be':
+		return ops[0] + " == " + ops[1]
+	if prefix == 'bne':
+		return ops[0] + " != " + ops[1]
+
+# builds the function that runs an intrinsic against the register list
+def intrinsic_function(prefix, slots):
+	code = intrinsic_code(prefix, ["r[" + str(s) + "]" for s in slots])
+	if isinstance(code, str):
+		src = "def f(r):\n\treturn " + code + "\n"
+	else:
+		src = "def f(r):\n\t" + "\n\t".join(code) + "\n"
+	scope = {}
+	exec(src, scope)
+	return scope['f']
+
+# the longest loop body find_loops will look at
+max_loop_length = 64
+
+# prints a load-time error for the given (1-based) line and quits.
+def decode_error(line, msg, stmt):
+	print("Error on line "+str(line)+": "+msg)
+	print(stmt)
+	exit(-1)
+
+# decodes the program (list of statements, directives already removed)
+# into a list of (opcode, slot, target) tuples.
+# names is the list of variable names, in slot order.
+# all of the syntax checking that used to happen on every step happens here, once.
+# an extra exit is appended so running off the end of the program terminates it.
+def decode(program, names):
+	# map each variable to its slot in the register list
+	slots = {}
+	for var in names:
+		slots[var] = len(slots)
+	code = []
+	# possible stmt in a program:
+	# V++
+	# V--
+	# if V not 0 goto L
+	# skip
+	# any content after a semicolon ; should be ignored
+	inc_checker = re.compile(r'[A-Za-z]+[0-9]*\+\+$')
+	dec_checker = re.compile(r'[A-Za-z]+[0-9]*\-\-$')
+	line = 1
+	for stmt in program:
+		# tokenize the statement
+		stmt_tokens = stmt.split(' ')
+		stmt_tokens = [token for token in stmt_tokens if token.strip() != ""]
+		# start with the first token in the list.
+		first = stmt_tokens[0]
+		if inc_checker.match(first) or dec_checker.match(first):
+			# match an increment or decrement operation, V++ or V--.
+			# make sure no other tokens exist after first.
+			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
+				decode_error(line, "Too many tokens", stmt)
+			# grab the variable name
+			var = first[:-2]
+			if not var in slots:
+				decode_error(line, "Variable " + var + " is not declared in %vars", stmt)
+			if first.endswith("++"):
+				code.append((OP_INC, slots[var], 0))
+			else:
+				code.append((OP_DEC, slots[var], 0))
+		elif first == "if":
+			# if statement (conditional branch) has a very specific structure.
+			# if V not 0 goto L
+			# check for wrong count of tokens
+			if len(stmt_tokens) < 6:
+				decode_error(line, "Not enough tokens", stmt)
+			# check for too many tokens (not in a comment)
+			if len(stmt_tokens) > 6 and stmt_tokens[6].strip() != ";":
+				decode_error(line, "Too many tokens", stmt)
+			# get the V from the statement
+			var_compare = stmt_tokens[1]
+			# check for bad setup of the rest of the statement
+			if not stmt_tokens[2] == "not" or not stmt_tokens[3] == "0" or not stmt_tokens[4] == "goto":
+				decode_error(line, "if statement missing not 0 goto clause", stmt)
+			if not var_compare in slots:
+				decode_error(line, "Variable " + var_compare + " is not declared in %vars", stmt)
+			# get the L from the statement, this has to be a line number by now.
+			# jumping to one past the last line is allowed, it hits the appended exit.
+			label_compare = stmt_tokens[5]
+			if not label_compare.isdigit() or int(label_compare) > len(program):
+				decode_error(line, "if statement jumps to an invalid line", stmt)
+			code.append((OP_IF, slots[var_compare], int(label_compare)))
+		elif first in intrinsics:
+			# variable operands, then label operands which have to be line numbers by now
+			(var_count, label_count) = intrinsics[first]
+			if len(stmt_tokens) < 1+var_count+label_count:
+				decode_error(line, "Not enough tokens", stmt)
+			if len(stmt_tokens) > 1+var_count+label_count and stmt_tokens[1+var_count+label_count].strip() != ";":
+				decode_error(line, "Too many tokens", stmt)
+			ops = []
+			for var in stmt_tokens[1:1+var_count]:
+				if not var in slots:
+					decode_error(line, "Variable " + var + " is not declared in %vars", stmt)
+				ops.append(slots[var])
+			fn = intrinsic_function(first, ops)
+			if label_count == 0:
+				code.append((OP_NATIVE, (fn, first, tuple(ops)), 0))
+			else:
+				label_compare = stmt_tokens[1+var_count]
+				if not label_compare.isdigit() or int(label_compare) > len(program):
+					decode_error(line, first + " jumps to an invalid line", stmt)
+				code.append((OP_BRANCH, (fn, first, tuple(ops)), int(label_compare)))
+		elif first in ["call", "ret", "sub"]:
+			decode_error(line, "Programs compiled with -shared can only be run by gruntime.py itself", stmt)
+		elif first == "skip" or first == "exit":
+			# skip is always 'naked'
+			# exit isnt part of the formal grammar
+			# but i use it when compiling to just be a straight-up termination statement.
+			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
+				decode_error(line, "Too many tokens", stmt)
+			if first == "skip":
+				code.append((OP_SKIP, 0, 0))
+			else:
+				code.append((OP_EXIT, 0, 0))
+		else:
+			decode_error(line, "Unmatched initial token", stmt)
+		line += 1
+	code.append((OP_EXIT, 0, 0))
+	return code
+
+# checks if a program was compiled with precompile.py -shared, i.e. has subroutines
+def is_linked(program):
+	for stmt in program:
+		if stmt.startswith("sub "):
+			return True
+	return False
+
+# decodes a program compiled with precompile.py -shared (see precompile.link_shared):
+# the program itself, then the body of each macro it uses, each starting with a
+# `sub prefix var_count label_count` line.
+# the operands of a body aren't slots but the subroutine's own numbering: its _V*
+# inputs first, then the other variables it uses in the order they turn up (its _var*s
+# and any of the program's it uses by name), which each call binds to slots (see
+# execute_linked). the labels it can leave by are numbered the same way, its _L* inputs
+# first, then any lines of the program itself it jumps to.
+# a call is (OP_CALL, (entry, inputs, others, number of _var*s, labels, program lines, sub), return).
+# for the operands others are the slots of the program's variables and -1, -2, ... for
+# the _var*s, for the labels a line of the caller is >= 0 and -1, -2, ... are the
+# labels the caller was given itself.
+# returns the code and the subroutine each line is in (None for the program itself),
+# which has the set of operands which are its _var*s as 'own'.
+def decode_linked(program, names):
+	subs = {}
+	for line in range(len(program)):
+		if program[line].startswith("sub "):
+			tokens = program[line].split(" ")
+			if len(tokens) < 4 or not tokens[2].isdigit() or not tokens[3].isdigit():
+				decode_error(line+1, "sub needs a name, a number of variables and a number of labels", program[line])
+			subs[tokens[1]] = {'line': line, 'vars': int(tokens[2]), 'labels': int(tokens[3]), 'others': [], 'locals': 0, 'lines': [], 'own': set()}
+	# each body runs up to the start of the next one
+	bounds = sorted([subs[prefix]['line'] for prefix in subs]) + [len(program)]
+	for prefix in subs:
+		subs[prefix]['end'] = bounds[bounds.index(subs[prefix]['line'])+1]
+	slots = {}
+	for var in names:
+		slots[var] = len(slots)
+	code = []
+	regions = []
+	calls = []
+	sub = None
+	scope = slots
+	labels = {}
+
+	def operand(var, line, stmt):
+		if var in scope:
+			return scope[var]
+		if sub is None or (not var.startswith("_var") and not var in slots):
+			decode_error(line, "Variable " + var + " is not declared in %vars", stmt)
+		if var.startswith("_var"):
+			sub['locals'] += 1
+			sub['others'].append(-sub['locals'])
+			sub['own'].add(len(scope))
+		else:
+			sub['others'].append(slots[var])
+		scope[var] = len(scope)
+		return scope[var]
+
+	# returns (True, line) for a line of the current body (or of the program), or
+	# (False, n) for the nth label the subroutine can leave by
+	def label(l, line, stmt):
+		if l.startswith("_L"):
+			if sub is None or not l in labels:
+				decode_error(line, "Jump to a label which isn't an input", stmt)
+			return (False, labels[l])
+		if not l.isdigit() or int(l) > len(program):
+			decode_error(line, "Jump to an invalid line", stmt)
+		to = int(l)
+		if sub is None or sub['line'] < to < sub['end']:
+			return (True, to)
+		if not to in labels:
+			labels[to] = sub['labels'] + len(sub['lines'])
+			sub['lines'].append((to, 0))
+		return (False, labels[to])
+
+	for line in range(len(program)):
+		stmt = program[line]
+		stmt_tokens = [token for token in stmt.split(' ') if token.strip() != ""]
+		if ";" in stmt_tokens:
+			stmt_tokens = stmt_tokens[:stmt_tokens.index(";")]
+		first = stmt_tokens[0]
+		if first == "sub":
+			sub = subs[stmt_tokens[1]]
+			scope = dict([("_V" + str(k+1), k) for k in range(sub['vars'])])
+			labels = dict([("_L" + str(k+1), k) for k in range(sub['labels'])])
+			# never run, a body is only ever called
+			code.append((OP_EXIT, 0, 0))
+		elif first.endswith("++") or first.endswith("--"):
+			if len(stmt_tokens) > 1:
+				decode_error(line+1, "Too many tokens", stmt)
+			code.append((OP_INC if first.endswith("++") else OP_DEC, operand(first[:-2], line+1, stmt), 0))
+		elif first == "if":
+			if len(stmt_tokens) != 6 or stmt_tokens[2:5] != ["not", "0", "goto"]:
+				decode_error(line+1, "if statement missing not 0 goto clause", stmt)
+			var = operand(stmt_tokens[1], line+1, stmt)
+			(here, to) = label(stmt_tokens[5], line+1, stmt)
+			code.append((OP_IF if here else OP_LEAVE, var, to))
+		elif first == "call":
+			if len(stmt_tokens) < 2 or not stmt_tokens[1] in subs:
+				decode_error(line+1, "Call to a subroutine which isn't in the program", stmt)
+			callee = subs[stmt_tokens[1]]
+			if len(stmt_tokens) != 2 + callee['vars'] + callee['labels']:
+				decode_error(line+1, "Wrong number of operands for " + stmt_tokens[1], stmt)
+			ins = tuple([operand(var, line+1, stmt) for var in stmt_tokens[2:2+callee['vars']]])
+			given = []
+			for l in stmt_tokens[2+callee['vars']:]:
+				(here, to) = label(l, line+1, stmt)
+				given.append(to if here else -to-1)
+			# filled in once every body has been decoded
+			calls.append((len(code), callee, ins, tuple(given)))
+			code.append(None)
+		elif first == "ret" and sub is not None:
+			code.append((OP_RET, 0, 0))
+		elif first == "skip":
+			code.append((OP_SKIP, 0, 0))
+		elif first == "exit":
+			code.append((OP_EXIT, 0, 0))
+		else:
+			decode_error(line+1, "Unmatched initial token", stmt)
+		regions.append(sub)
+	code.append((OP_EXIT, 0, 0))
+	regions.append(None)
+	for (pc, callee, ins, given) in calls:
+		code[pc] = (OP_CALL, (callee['line']+1, ins, tuple(callee['others']), callee['locals'], given, tuple(callee['lines']), callee), pc+1)
+	return (code, regions)
+
+# looks for a counting loop starting at line h of the decoded code.
+# a counting loop is one where every pass takes the same straight path back to h,
+# one counter variable goes down by exactly 1 per pass until it hits 0, and every
+# other variable on the path only ever goes up (or only ever goes down) by a constant.
+# the branches inside the path have to be ones we know are taken, i.e. the goto idiom
+# V++ ; if V not 0 goto L.
+# there are two shapes of these:
+#   the test at the top:    [h] if C not 0 goto b ... (C-- somewhere) ... goto h
+#   the test at the bottom: [h] ... C-- ... if C not 0 goto h
+# returns the arguments for an OP_LOOP instruction, or None if h doesn't start one.
+# the last of these is the lines one pass goes through, which is only used by -profile.
+def counting_loop(code, h):
+	op, slot, target = code[h]
+	known = set()
+	if op == OP_IF:
+		# test at the top, the path starts where the branch goes
+		counter = slot
+		known.add(slot)
+		pc = target
+		length = 1
+		path = [h]
+	else:
+		counter = None
+		pc = h
+		length = 0
+		path = []
+	incs = {}
+	decs = {}
+	while True:
+		if length > max_loop_length:
+			return None
+		op, slot, target = code[pc]
+		length += 1
+		path.append(pc)
+		if op == OP_INC:
+			incs[slot] = incs.get(slot, 0) + 1
+			known.add(slot)
+			pc += 1
+		elif op == OP_DEC:
+			decs[slot] = decs.get(slot, 0) + 1
+			known.discard(slot)
+			pc += 1
+		elif op == OP_SKIP:
+			pc += 1
+		elif op == OP_IF and slot in known:
+			pc = target
+		elif op == OP_IF and counter is None and target == h:
+			# test at the bottom, this closes the loop
+			counter = slot
+			exit_pc = pc+1
+			break
+		else:
+			# exits, or a branch we can't predict
+			return None
+		if pc == h:
+			if counter is None:
+				# a loop with no test at all, this one never ends
+				return None
+			exit_pc = h+1
+			break
+	# the counter must go down exactly once per pass and never up
+	if decs.get(counter) != 1 or counter in incs:
+		return None
+	del decs[counter]
+	# everything else only goes one way, so the clamp at 0 is easy to work out
+	for s in incs:
+		if s in decs:
+			return None
+	adds = tuple(incs.items())
+	subs = tuple(decs.items())
+	if code[h][0] == OP_IF:
+		# C passes, then the final failing test at the top
+		return (0, length, 1, exit_pc, adds, subs, tuple(path))
+	# the body always runs at least once, even when C starts at 0
+	return (1, length, 0, exit_pc, adds, subs, tuple(path))
+
+# finds every counting loop in the decoded code and replaces its first line with an
+# OP_LOOP which applies the net effect of the whole loop at once, so the loop costs
+# O(1) instead of one pass per unit of the counter. this is exact, including the
+# step count and the clamp at 0 of decrements.
+# lines inside the loop are left alone, so jumping into the middle of one still works.
+def find_loops(code):
+	found = {}
+	for h in range(len(code)):
+		loop = counting_loop(code, h)
+		if loop:
+			counter = code[h][1]
+			if code[h][0] != OP_IF:
+				# test at the bottom, the counter is whatever the closing branch tests
+				counter = code[loop[3]-1][1]
+			found[h] = (OP_LOOP, counter, loop)
+	for h in found:
+		code[h] = found[h]
+	return len(found)
+
+# returns the set of lines that something can jump to, these start a new basic block.
+def jump_targets(code):
+	targets = set()
+	for (op, slot, target) in code:
+		if op == OP_IF or op == OP_BRANCH:
+			targets.add(target)
+		elif op == OP_LOOP:
+			targets.add(target[3])
+		elif op == OP_CALL:
+			# where it returns to, and the labels it gives the subroutine
+			targets.add(target)
+			targets.update([a for a in slot[4] if a >= 0])
+			targets.update([p for (p, d) in slot[5]])
+	return targets
+
+# splits the decoded code into basic blocks and replaces the first line of each run of
+# 2 or more straight-line statements (++, -- and skip, plus the if-goto ending the run
+# if there is one) with an OP_BLOCK which does the whole run in one dispatch.
+# each variable the run touches ends up as v = max(v + add, low): a ++ is (1, 1) and a
+# -- is (-1, 0), and putting (a1, b1) then (a2, b2) together gives (a1+a2, max(b1+a2, b2)),
+# so the clamp at 0 comes out exactly the same as doing the statements one at a time.
+# like find_loops, the lines inside the run are left alone so jumps into them still work,
+# and this runs after find_loops so it never swallows the start of a counting loop.
+def find_blocks(code):
+	targets = jump_targets(code)
+	found = {}
+	pc = 0
+	while pc < len(code):
+		start = pc
+		deltas = {}
+		while code[pc][0] in (OP_INC, OP_DEC, OP_SKIP) and (pc == start or not pc in targets):
+			op, slot, target = code[pc]
+			if op != OP_SKIP:
+				(a, b) = deltas.get(slot, (0, 0))
+				if op == OP_INC:
+					deltas[slot] = (a+1, max(b+1, 1))
+				else:
+					deltas[slot] = (a-1, max(b-1, 0))
+			pc += 1
+		# the if-goto ending the run, -1 when the run just falls through
+		branch = (-1, 0)
+		if code[pc][0] == OP_IF and pc > start and not pc in targets:
+			branch = (code[pc][1], code[pc][2])
+			pc += 1
+		if pc - start >= 2:
+			fused = tuple((s, a, b) for (s, (a, b)) in deltas.items())
+			found[start] = (OP_BLOCK, fused, branch + (pc, pc - start))
+		if pc == start:
+			pc += 1
+	for start in found:
+		code[start] = found[start]
+	return len(found)
+
+# find_loops and find_blocks for a linked program (see decode_linked). two operands of a
+# subroutine can be bound to the same variable (e.g. `assign X X`), which the shortcuts
+# don't allow for, so in a subroutine they're only kept when at most one of the
+# variables they touch isn't one of its own _var*s, which are never shared.
+def find_linked_shortcuts(code, regions):
+	original = list(code)
+	def unshared():
+		for pc in range(len(code)):
+			if code[pc] is original[pc] or regions[pc] is None:
+				continue
+			op, slot, target = code[pc]
+			if op == OP_LOOP:
+				used = set([slot] + [s for (s, k) in target[4] + target[5]])
+			else:
+				# (the test comes after everything else, so it can be anything)
+				used = set([s for (s, a, b) in slot])
+			if len(used - regions[pc]['own']) > 1:
+				code[pc] = original[pc]
+	if loops:
+		find_loops(code)
+		unshared()
+	if fuse:
+		find_blocks(code)
+		unshared()
+
+# when the next check of a run is due, gc is the step count of the current check.
+# checks happen at the first jump taken once gc gets there, so the state at one
+# check decides exactly where the next one is, which is what check needs for
+# finding cycles. with no time limit and no cycle detection the only check is
+# the step limit itself.
+def next_check(gc):
+	limit = max_steps
+	if pause_at is not None and (limit is None or pause_at < limit):
+		limit = pause_at
+	if max_seconds is None and not detect_cycles and checkpoint is None:
+		if limit is None:
+			return float('inf')
+		return limit
+	n = gc + check_interval
+	if limit is not None and limit < n:
+		n = limit
+	return n
+
+# returns the slots of the variables which can only ever go up and are only ever
+# tested against 0, like the variable of the goto idiom. once one of these is
+# non-zero it stays non-zero and every test of it goes the same way, so for deciding
+# where the program goes next only whether it is 0 matters, not its value.
+def monotone_slots(code):
+	slots = set()
+	others = set()
+	for (op, slot, target) in code:
+		if op == OP_INC or op == OP_IF:
+			slots.add(slot)
+		elif op == OP_DEC:
+			others.add(slot)
+		elif op == OP_BLOCK:
+			for (s, a, b) in slot:
+				if a < 0:
+					others.add(s)
+				else:
+					slots.add(s)
+		elif op == OP_LOOP:
+			# the counter's value matters and it's set to 0 at the end
+			others.add(slot)
+			others.update([s for (s, k) in target[5]])
+		elif op == OP_NATIVE or op == OP_BRANCH:
+			# intrinsics use the actual values
+			others.update(slot[2])
+	return sorted(slots - others)
+
+# monotone_slots for a linked program (see decode_linked): returns the slots of the
+# program's variables which only ever go up and are only tested against 0, and puts
+# the operands of each subroutine's _var*s which do the same in its 'monotone'.
+# what a subroutine does with its inputs counts for whatever each call gives it.
+def linked_monotone(code, regions):
+	ups = set()
+	others = set()
+	# (operand of the caller, input of the subroutine) for every call
+	passes = []
+	# operands as (line of the subroutine, operand), with the program's variables as
+	# (None, slot) wherever they're used
+	def operand(sub, s):
+		if sub is None:
+			return (None, s)
+		if s >= sub['vars'] and sub['others'][s - sub['vars']] >= 0:
+			return (None, sub['others'][s - sub['vars']])
+		return (sub['line'], s)
+	for pc in range(len(code)):
+		op, slot, target = code[pc]
+		sub = regions[pc]
+		if op == OP_INC or op == OP_IF or op == OP_LEAVE:
+			ups.add(operand(sub, slot))
+		elif op == OP_DEC:
+			others.add(operand(sub, slot))
+		elif op == OP_BLOCK:
+			for (s, a, b) in slot:
+				if a < 0:
+					others.add(operand(sub, s))
+				else:
+					ups.add(operand(sub, s))
+		elif op == OP_LOOP:
+			others.add(operand(sub, slot))
+			others.update([operand(sub, s) for (s, k) in target[5]])
+		elif op == OP_CALL:
+			for i in range(len(slot[1])):
+				passes.append((operand(sub, slot[1][i]), (slot[6]['line'], i)))
+	changed = True
+	while changed:
+		changed = False
+		for (given, taken) in passes:
+			for kind in [ups, others]:
+				if taken in kind and not given in kind:
+					kind.add(given)
+					changed = True
+	monotone = ups - others
+	for sub in regions:
+		if sub is not None:
+			sub['monotone'] = [s for s in sub['own'] if (sub['line'], s) in monotone]
+	return sorted([s for (line, s) in monotone if line is None])
+
+# checks a run against the limits, returns why it should stop or None to keep going.
+# watch holds what check knows about the run so far (see execute).
+# cycles are found with brent's method on the states seen at each check: a state
+# is kept at every power of 2 checks and the states after it are compared to it.
+# if the program is in a loop it comes back to the kept state within a couple of passes
+# of the loop, however the loop was entered. the monotone variables (see monotone_slots)
+# only count as 0 or 1 in the state, so the loops G uses for goto, which count one of
+# these up forever, are still found.
+# a program which keeps counting up something else forever never repeats, the limits
+# stop that.
+# checkpoints are saved here too, every so many steps and whenever a limit or a signal
+# stops the run, so the run can be carried on with -resume.
+def check(watch, code, pc, regs, gc):
+	global stopped_pc
+	stop = None
+	if max_steps is not None and gc >= max_steps:
+		stop = "step limit"
+	elif max_seconds is not None and time.monotonic() - watch['start'] >= max_seconds:
+		stop = "time limit"
+	elif interrupted:
+		stop = "interrupted"
+	if checkpoint is not None:
+		every = checkpoint['every']
+		if stop or (every and gc - watch['saved_at'] >= every):
+			save_checkpoint(pc, regs, gc, time.monotonic() - watch['start'])
+			watch['saved_at'] = gc
+	if stop:
+		stopped_pc = pc
+		return stop
+	if detect_cycles:
+		if watch['monotone'] is None:
+			watch['monotone'] = monotone_slots(code)
+		state = list(regs)
+		for s in watch['monotone']:
+			if state[s]:
+				state[s] = 1
+		state = (pc, tuple(state))
+		if state == watch['saved']:
+			return "diverges"
+		watch['count'] += 1
+		if watch['count'] == watch['power']:
+			watch['saved'] = state
+			watch['power'] *= 2
+			watch['count'] = 0
+	if pause_at is not None and gc >= pause_at:
+		stopped_pc = pc
+		return "paused"
+	return None
+
+# runs decoded code against the registers.
+# returns the number of steps executed and how the run ended: "halted", or why it was
+# stopped (see check).
+# this is the hot loop so it does as little as possible per statement. a program can
+# only run forever by jumping, so the limits are only looked at when a jump is taken.
+# a run resumed from a checkpoint starts at its pc, step count and time taken so far.
+# watch is given when carrying on a run something else has been checking (see gvector),
+# with the step of the next check as watch['check_at'].
+def execute(code, regs, pc=0, gc=0, seconds=0.0, watch=None):
+	if watch is None:
+		watch = {'start': time.monotonic() - seconds, 'monotone': None, 'saved': None, 'power': 1, 'count': 0, 'saved_at': gc}
+		check_at = next_check(gc)
+	else:
+		check_at = watch['check_at']
+	while True:
+		op, slot, target = code[pc]
+		if op == OP_BLOCK:
+			# run a whole basic block at once, see find_blocks
+			for s, a, b in slot:
+				v = regs[s] + a
+				if v > b:
+					regs[s] = v
+				else:
+					regs[s] = b
+			test, jump, pc, length = target
+			gc += length
+			if test >= 0 and regs[test]:
+				pc = jump
+				if gc >= check_at:
+					stop = check(watch, code, pc, regs, gc)
+					if stop:
+						return (gc, stop)
+					check_at = next_check(gc)
+			continue
+		elif op == OP_IF:
+			if regs[slot]:
+				pc = target
+				gc += 1
+				if gc >= check_at:
+					stop = check(watch, code, pc, regs, gc)
+					if stop:
+						return (gc, stop)
+					check_at = next_check(gc)
+				continue
+			pc += 1
+		elif op == OP_INC:
+			regs[slot] += 1
+			pc += 1
+		elif op == OP_DEC:
+			# decrement the variable, clamped to 0
+			if regs[slot]:
+				regs[slot] -= 1
+			pc += 1
+		elif op == OP_SKIP:
+			pc += 1
+		elif op == OP_NATIVE:
+			slot[0](regs)
+			pc += 1
+		elif op == OP_BRANCH:
+			if slot[0](regs):
+				pc = target
+				gc += 1
+				if gc >= check_at:
+					stop = check(watch, code, pc, regs, gc)
+					if stop:
+						return (gc, stop)
+					check_at = next_check(gc)
+				continue
+			pc += 1
+		elif op == OP_LOOP:
+			# run the whole counting loop at once, see find_loops
+			min_count, length, extra, exit_pc, adds, subs, path = target
+			n = regs[slot]
+			if n < min_count:
+				n = min_count
+			for s, k in adds:
+				regs[s] += k*n
+			for s, k in subs:
+				v = regs[s] - k*n
+				if v > 0:
+					regs[s] = v
+				else:
+					regs[s] = 0
+			regs[slot] = 0
+			gc += n*length + extra
+			pc = exit_pc
+			continue
+		else:
+			return (gc, "halted")
+		gc += 1
+
+# same as execute for a linked program (see decode_linked). regs starts with the
+# program's variables and grows by the _var*s of each call the first time it's made.
+# like the copies of an expansion, each call (from a given line of a given call) has
+# _var*s of its own which start at 0 and keep their values from one time it's made to
+# the next, so a macro which leaves something in a _var* finds it there again.
+# bind is where each operand of the code being run is in regs, and labels where each of
+# the labels it can leave by is, as (line, depth), depth being how many calls deep that
+# line runs. a call saves the caller's and a ret or leaving puts it back.
+# a call takes no steps and the ret takes one, which is what the expanded macro's code
+# would have taken with its skip at the end. the state check compares includes the
+# lines calls return to, since the same line in a different call is a different state,
+# and the monotone variables (see linked_monotone) of every call made so far.
+# regions is the subroutine each line is in, from decode_linked.
+def execute_linked(code, regs, regions):
+	bind = list(range(len(regs)))
+	labels = []
+	# the subroutine being run, and which call it is (0 for the program itself)
+	sub = None
+	instance = 0
+	# (call, line of the call) -> (the call it makes, where its _var*s are in regs)
+	homes = {}
+	stack = []
+	gc = 0
+	pc = 0
+	watch = {'start': time.monotonic(), 'monotone': None, 'saved': None, 'power': 1, 'count': 0, 'saved_at': 0}
+	if detect_cycles:
+		watch['monotone'] = linked_monotone(code, regions)
+	check_at = next_check(0)
+	while True:
+		op, slot, target = code[pc]
+		if op == OP_BLOCK:
+			for s, a, b in slot:
+				v = regs[bind[s]] + a
+				if v > b:
+					regs[bind[s]] = v
+				else:
+					regs[bind[s]] = b
+			test, jump, pc, length = target
+			gc += length
+			if test < 0 or not regs[bind[test]]:
+				continue
+			pc = jump
+		elif op == OP_IF:
+			gc += 1
+			if not regs[bind[slot]]:
+				pc += 1
+				continue
+			pc = target
+		elif op == OP_INC:
+			regs[bind[slot]] += 1
+			pc += 1
+			gc += 1
+			continue
+		elif op == OP_DEC:
+			if regs[bind[slot]]:
+				regs[bind[slot]] -= 1
+			pc += 1
+			gc += 1
+			continue
+		elif op == OP_SKIP:
+			pc += 1
+			gc += 1
+			continue
+		elif op == OP_CALL:
+			(entry, ins, others, count, given, lines, called_sub) = slot
+			home = homes.get((instance, pc))
+			first = home is None
+			if first:
+				home = (len(homes) + 1, len(regs))
+				homes[(instance, pc)] = home
+				regs.extend([0] * count)
+			top = home[1]
+			called = [bind[s] for s in ins]
+			for s in others:
+				if s < 0:
+					called.append(top - s - 1)
+				else:
+					called.append(s)
+			if first and detect_cycles:
+				watch['monotone'] += [called[s] for s in called_sub['monotone']]
+			depth = len(stack)
+			passed = []
+			for l in given:
+				if l >= 0:
+					passed.append((l, depth))
+				else:
+					passed.append(labels[-l-1])
+			stack.append((target, bind, labels, instance, sub))
+			bind = called
+			labels = passed + list(lines)
+			instance = home[0]
+			sub = called_sub
+			pc = entry
+			continue
+		elif op == OP_RET:
+			(pc, bind, labels, instance, sub) = stack.pop()
+			gc += 1
+			continue
+		elif op == OP_LEAVE:
+			gc += 1
+			if not regs[bind[slot]]:
+				pc += 1
+				continue
+			(pc, depth) = labels[target]
+			if depth < len(stack):
+				(back, bind, labels, instance, sub) = stack[depth]
+				del stack[depth:]
+		elif op == OP_LOOP:
+			min_count, length, extra, exit_pc, adds, subs, path = target
+			n = regs[bind[slot]]
+			if n < min_count:
+				n = min_count
+			for s, k in adds:
+				regs[bind[s]] += k*n
+			for s, k in subs:
+				v = regs[bind[s]] - k*n
+				if v > 0:
+					regs[bind[s]] = v
+				else:
+					regs[bind[s]] = 0
+			regs[bind[slot]] = 0
+			gc += n*length + extra
+			pc = exit_pc
+			continue
+		else:
+			return (gc, "halted")
+		# a jump was taken
+		if gc >= check_at:
+			where = (pc,) + tuple([frame[0] for frame in stack])
+			stop = check(watch, code, where, regs, gc)
+			if stop:
+				return (gc, stop)
+			check_at = next_check(gc)
+
+# same as execute but counts how many times each instruction is dispatched for -profile.
+# counts[pc] goes up by one every time the instruction at pc runs, and passes[pc] by the
+# number of passes of the loop every time the OP_LOOP at pc runs (see line_counts).
+# apart from those two lines this has to stay the same as execute (test_gruntime.py
+# checks the two run programs the same way).
+def execute_profile(code, regs, counts, passes, pc=0, gc=0, seconds=0.0, watch=None):
+	if watch is None:
+		watch = {'start': time.monotonic() - seconds, 'monotone': None, 'saved': None, 'power': 1, 'count': 0, 'saved_at': gc}
+		check_at = next_check(gc)
+	else:
+		check_at = watch['check_at']
+	while True:
+		op, slot, target = code[pc]
+		counts[pc] += 1
+		if op == OP_BLOCK:
+			# run a whole basic block at once, see find_blocks
+			for s, a, b in slot:
+				v = regs[s] + a
+				if v > b:
+					regs[s] = v
+				else:
+					regs[s] = b
+			test, jump, pc, length = target
+			gc += length
+			if test >= 0 and regs[test]:
+				pc = jump
+				if gc >= check_at:
+					stop = check(watch, code, pc, regs, gc)
+					if stop:
+						return (gc, stop)
+					check_at = next_check(gc)
+			continue
+		elif op == OP_IF:
+			if regs[slot]:
+				pc = target
+				gc += 1
+				if gc >= check_at:
+					stop = check(watch, code, pc, regs, gc)
+					if stop:
+						return (gc, stop)
+					check_at = next_check(gc)
+				continue
+			pc += 1
+		elif op == OP_INC:
+			regs[slot] += 1
+			pc += 1
+		elif op == OP_DEC:
+			# decrement the variable, clamped to 0
+			if regs[slot]:
+				regs[slot] -= 1
+			pc += 1
+		elif op == OP_SKIP:
+			pc += 1
+		elif op == OP_NATIVE:
+			slot[0](regs)
+			pc += 1
+		elif op == OP_BRANCH:
+			if slot[0](regs):
+				pc = target
+				gc += 1
+				if gc >= check_at:
+					stop = check(watch, code, pc, regs, gc)
+					if stop:
+						return (gc, stop)
+					check_at = next_check(gc)
+				continue
+			pc += 1
+		elif op == OP_LOOP:
+			# run the whole counting loop at once, see find_loops
+			min_count, length, extra, exit_pc, adds, subs, path = target
+			n = regs[slot]
+			if n < min_count:
+				n = min_count
+			for s, k in adds:
+				regs[s] += k*n
+			for s, k in subs:
+				v = regs[s] - k*n
+				if v > 0:
+					regs[s] = v
+				else:
+					regs[s] = 0
+			regs[slot] = 0
+			passes[pc] += n
+			gc += n*length + extra
+			pc = exit_pc
+			continue
+		else:
+			return (gc, "halted")
+		gc += 1
+
+# works out how many times each line of the program ran from the counts of
+# execute_profile, by spreading the counts of fused blocks and whole loops back out
+# over the lines they stand for.
+def line_counts(code, counts, passes):
+	lines = [0] * len(code)
+	for pc in range(len(code)):
+		op, slot, target = code[pc]
+		if op == OP_BLOCK:
+			for i in range(pc, pc + target[3]):
+				lines[i] += counts[pc]
+		elif op == OP_LOOP:
+			(min_count, length, extra, exit_pc, adds, subs, path) = target
+			for i in path:
+				lines[i] += passes[pc]
+			# the final failing test of a loop with the test at the top
+			lines[pc] += counts[pc] * extra
+		elif op != OP_EXIT:
+			# exit isn't a step
+			lines[pc] += counts[pc]
+	return lines
+
+# same as execute but prints the state before every statement for -debug/-step.
+# program is only used to show the original text of each statement.
+def execute_debug(code, regs, program):
+	names = list(variables)
+	gc = 0
+	pc = 0
+	while True:
+		op, slot, target = code[pc]
+		if pc < len(program):
+			stmt = program[pc]
+		else:
+			stmt = "exit"
+		if debug:
+			print(dict(zip(names, regs)))
+			print(str(gc) + ": (pc " + str(pc) + ") - " + stmt)
+			print()
+		if step:
+			print("State: " + str(dict(zip(names, regs))))
+			print("Next instruction: " + stmt)
+			input("Enter to proceed")
+			print()
+		if op == OP_IF:
+			if regs[slot]:
+				pc = target
+				gc += 1
+				continue
+		elif op == OP_INC:
+			regs[slot] += 1
+		elif op == OP_DEC:
+			regs[slot] = max(0, regs[slot]-1)
+		elif op == OP_NATIVE:
+			slot[0](regs)
+		elif op == OP_BRANCH:
+			if slot[0](regs):
+				pc = target
+				gc += 1
+				continue
+		elif op == OP_EXIT:
+			return gc
+		pc += 1
+		gc += 1
+
+# runs a program, code is its decoded form if that's already known (e.g. from a .gb file).
+# returns the number of steps and how the run ended (see execute).
+# resume is the checkpoint to carry on from, if there is one.
+def run_program(program, code=None, resume=None):
+	global variables
+	global profiled
+	# decode everything up front, then run on a plain list of registers
+	if code is None and is_linked(program):
+		# compiled with -shared
+		(code, regions) = decode_linked(program, list(variables))
+		find_linked_shortcuts(code, regions)
+		regs = list(variables.values())
+		result = execute_linked(code, regs, regions)
+		variables = dict(zip(variables, regs))
+		return result
+	if code is None:
+		code = decode(program, list(variables))
+	regs = list(variables.values())
+	if debug or step:
+		result = (execute_debug(code, regs, program), "halted")
+	elif trace is not None:
+		# every step is traced, so no loops or blocks
+		import gtrace
+		result = gtrace.execute(code, regs, trace)
+	else:
+		if loops:
+			find_loops(code)
+		if fuse:
+			find_blocks(code)
+		if profile:
+			counts = [0] * len(code)
+			passes = [0] * len(code)
+			result = execute_profile(code, regs, counts, passes)
+			profiled = line_counts(code, counts, passes)
+		elif jit:
+			import gjit
+			result = gjit.execute(code, regs)
+		elif resume is not None:
+			result = execute(code, regs, resume['pc'], resume['steps'], resume['seconds'])
+		else:
+			result = execute(code, regs)
+	# write the registers back so the final state can be reported by name
+	variables = dict(zip(variables, regs))
+	return result
+
+# reads -maxsteps N, -timeout S and -nocycles from the arguments
+def read_limits():
+	global max_steps
+	global max_seconds
+	global detect_cycles
+	for i in range(1, len(sys.argv)):
+		arg = sys.argv[i]
+		if arg == '-maxsteps' or arg == '-timeout':
+			if i+1 == len(sys.argv):
+				print("Runtime error, " + arg + " needs a value")
+				exit(-1)
+			val = sys.argv[i+1]
+			if arg == '-maxsteps':
+				if not val.isdigit():
+					print("Runtime error, -maxsteps takes a number of steps")
+					print(val)
+					exit(-1)
+				max_steps = int(val)
+			else:
+				try:
+					max_seconds = float(val)
+				except ValueError:
+					print("Runtime error, -timeout takes a number of seconds")
+					print(val)
+					exit(-1)
+	if '-nocycles' in sys.argv:
+		detect_cycles = False
+
+# reads -trace N, -tracesample K, -tracefrom STEP and -traceout FILE from the arguments
+def read_trace(file):
+	global trace
+	if not '-trace' in sys.argv:
+		return
+	trace = {'size': None, 'sample': 1, 'start': 0, 'out': os.path.splitext(file)[0] + ".gtrace"}
+	for i in range(1, len(sys.argv)):
+		(arg, val) = (sys.argv[i-1], sys.argv[i])
+		if arg == '-traceout':
+			trace['out'] = val
+		elif arg in ['-trace', '-tracesample', '-tracefrom']:
+			if not val.isdigit() or (arg != '-tracefrom' and int(val) == 0):
+				print("Runtime error, " + arg + " takes a number")
+				print(val)
+				exit(-1)
+			trace[{'-trace': 'size', '-tracesample': 'sample', '-tracefrom': 'start'}[arg]] = int(val)
+	if trace['size'] is None:
+		print("Runtime error, -trace needs the number of steps to keep")
+		exit(-1)
+
+def checkpoint_path(file):
+	return os.path.splitext(file)[0] + ".gcheckpoint"
+
+def file_hash(path):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def interrupt(signum, frame):
+	global interrupted
+	interrupted = True
+
+# reads -checkpoint N and -checkpointfile FILE from the arguments.
+# a checkpoint is the program's hash, the pc, the step count, the time taken and the
+# values of all the variables, saved every N steps (at the first check after, see
+# next_check) and when the run is stopped by a limit or by SIGTERM/SIGINT.
+# -checkpoint 0 (or just -resume) only saves when the run is stopped.
+def read_checkpoint(file):
+	global checkpoint
+	if not '-checkpoint' in sys.argv and not '-resume' in sys.argv:
+		return
+	checkpoint = {'every': None, 'file': checkpoint_path(file), 'hash': file_hash(file)}
+	for i in range(1, len(sys.argv)):
+		(arg, val) = (sys.argv[i-1], sys.argv[i])
+		if arg == '-checkpointfile':
+			checkpoint['file'] = val
+		elif arg == '-checkpoint':
+			if not val.isdigit():
+				print("Runtime error, -checkpoint takes a number of steps")
+				print(val)
+				exit(-1)
+			checkpoint['every'] = int(val) or None
+	if '-checkpoint' == sys.argv[-1]:
+		print("Runtime error, -checkpoint needs a number of steps")
+		exit(-1)
+	if debug or step or profile or trace is not None or jit or '-native' in sys.argv:
+		print("Runtime error, checkpoints can't be used with -debug, -step, -profile, -trace, -jit or -native")
+		exit(-1)
+	signal.signal(signal.SIGTERM, interrupt)
+	signal.signal(signal.SIGINT, interrupt)
+
+# writes a checkpoint to a temporary file first so a half-written one is never read
+def save_checkpoint(pc, regs, gc, seconds):
+	path = checkpoint['file']
+	try:
+		with open(path + ".tmp", "w") as f:
+			json.dump({
+				'version': 1,
+				'hash': checkpoint['hash'],
+				'pc': pc,
+				'steps': gc,
+				'seconds': seconds,
+				'variables': dict(zip(variables, regs)),
+			}, f)
+		os.replace(path + ".tmp", path)
+	except OSError:
+		print("Could not write checkpoint " + path)
+
+# reads the checkpoint for -resume and puts its variable values in place.
+# returns the checkpoint.
+def load_checkpoint(file):
+	global variables
+	path = checkpoint['file']
+	try:
+		with open(path) as f:
+			saved = json.load(f)
+	except (OSError, ValueError):
+		print("Runtime error, could not read a checkpoint to resume from")
+		print(path)
+		exit(-1)
+	if saved.get('version') != 1 or saved.get('hash') != checkpoint['hash']:
+		print("Runtime error, the checkpoint is for a different program (or an older version of this one)")
+		print(path)
+		exit(-1)
+	if list(saved['variables']) != list(variables):
+		print("Runtime error, the checkpoint has different variables to the program")
+		print(path)
+		exit(-1)
+	variables = saved['variables']
+	return saved
+
+# what a run which didn't halt is reported as
+stop_reasons = {
+	"step limit": "the step limit was reached",
+	"time limit": "the time limit was reached",
+	"diverges": "the program diverges (it came back to the same state)",
+	"interrupted": "it was interrupted",
+}
+
+# reads the source map precompile.py -map writes next to a compiled file.
+# returns the (line of the .gc file, macro stack) each line of the program came from,
+# with the .gc file name, or None if there isn't an up to date one.
+def load_source_map(file, length):
+	path = os.path.splitext(file)[0] + ".gmap"
+	try:
+		with open(path) as f:
+			smap = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if smap.get('version') != 1 or len(smap['lines']) != length:
+		print("Ignoring " + path + ", it doesn't match the program (compile it again with -map)")
+		return None
+	return smap
+
+# prints where the steps of a -profile run went.
+# with a source map the lines are added up by the line of the .gc file they came from
+# and by macro, where a macro's total includes the macros it calls and self is only
+# its own lines. collapsed is a file to write the stacks to for flame graph tools.
+def profile_report(file, program, counts, collapsed=None):
+	total = sum(counts)
+	smap = load_source_map(file, len(counts)-1)
+	origins = []
+	source = []
+	name = os.path.basename(file)
+	if smap:
+		origins = smap['lines']
+		name = smap['source']
+		try:
+			with open(os.path.join(os.path.dirname(file), name)) as f:
+				source = [l.replace('\r', '').strip() for l in f.read().split('\n')]
+		except OSError:
+			pass
+	# the exit decode adds on the end has no line of its own
+	origins = origins + [None] * (len(counts) - len(origins))
+	by_line = {}
+	by_macro = {}
+	stacks = {}
+	for pc in range(len(counts)):
+		if counts[pc] == 0:
+			continue
+		if origins[pc] is None:
+			(line, stack) = (None, [])
+			frames = [name + ":" + str(pc) if not smap else name]
+		else:
+			(line, stack) = origins[pc]
+			stack = stack.split(">") if stack else []
+			frames = [name + ":" + str(line)] + stack
+		by_line[line] = by_line.get(line, 0) + counts[pc]
+		for i in range(len(stack)):
+			# a macro which calls itself only counts once
+			if not stack[i] in stack[:i]:
+				(t, own) = by_macro.get(stack[i], (0, 0))
+				by_macro[stack[i]] = (t + counts[pc], own)
+		if stack:
+			(t, own) = by_macro[stack[-1]]
+			by_macro[stack[-1]] = (t, own + counts[pc])
+		stacks[";".join(frames)] = stacks.get(";".join(frames), 0) + counts[pc]
+	def percent(n):
+		return "%6.2f%%" % (100.0 * n / max(total, 1))
+	print("Profile: " + str(total) + " steps")
+	if smap:
+		print("By line of " + name + ":")
+		for line in sorted(by_line, key=lambda l: -by_line[l]):
+			text = "(made by the compiler)"
+			if line is not None:
+				text = str(line) + ": "
+				if line-1 < len(source):
+					text += source[line-1]
+			print("%12d %s  %s" % (by_line[line], percent(by_line[line]), text))
+		if by_macro:
+			print("By macro (total, self):")
+			for macro in sorted(by_macro, key=lambda m: -by_macro[m][0]):
+				(t, own) = by_macro[macro]
+				print("%12d %s %12d %s  %s" % (t, percent(t), own, percent(own), macro))
+	print("Hottest lines of " + os.path.basename(file) + ":")
+	for pc in sorted(range(len(counts)), key=lambda pc: -counts[pc])[:10]:
+		if counts[pc] == 0:
+			break
+		text = "exit"
+		if pc < len(program):
+			text = program[pc]
+		where = ""
+		if origins[pc] is not None:
+			where = "  (" + name + ":" + str(origins[pc][0])
+			if origins[pc][1]:
+				where += " " + origins[pc][1].replace(">", " > ")
+			where += ")"
+		print("%12d %s  %d: %s%s" % (counts[pc], percent(counts[pc]), pc, text, where))
+	if collapsed is not None:
+		with open(collapsed, "w") as f:
+			for frames in sorted(stacks):
+				f.write(frames + " " + str(stacks[frames]) + "\n")
+		print("Wrote collapsed stacks to " + collapsed)
+
+# definition for %specvar directive
+# %specvar provides an initialization value for a variable,
+# e.g. %specvar X 4 means X <- 4.
+def specvar(l):
+	global variables
+	# confirm the correct format
+	if not len(l.split(" ")) == 3:
+		print("Runtime error, %specvar has incorrect argument count")
+		print(l)
+		exit(-1)
+	var = l.split(" ")[1]
+	if not var in variables:
+		print("Runtime error, %specvar specifies a non-existent variable")
+		print(l)
+		exit(-1)
+	val = l.split(" ")[2]
+	if not val.isdigit():
+		print("Runtime error, %specvar assigns a non-numeric value to a variable")
+		print(l)
+		exit(-1)
+	# assign the value to the variable
+	variables[var] = int(val)
+
+# reads a compiled .g file, sets up variables from the %vars/%specvar directives
+# and returns the list of statements with the directives cut off.
+def load(file):
+	global variables
+	variables = {}
+	program = []
+	# open the input file
+	with open(file) as f:
+		# load all lines into program
+		program = f.readlines()
+	# replace all newlines with blank and trim
+	# I also do a replacement from ';' -> ' ; ' to avoid difficulty tokenizing comments
+	program = [l.replace('\n', '').replace(';', ' ; ').strip() for l in program]
+	# remove any blank lines
+	program = [l for l in program if l != ""]
+	# remove any lines starting with ;
+	# to not have to tokenize
+	program = [l for l in program if not l.startswith(';')]
+	# check for a leading '%vars' directive
+	# the %vars directive will always, always be line 0
+	if program[0].startswith("%vars"):
+		# load the list of vars
+		vars_ = program[0].split(" ")
+		if not len(vars_) == 2:
+			print("Runtime error, %vars malformed")
+			print(program[0])
+			exit(-1)
+		vars = vars_[1].split(',')
+		for var in vars:
+			variables[var] = 0
+		# now remove the leading %vars directive
+		program = program[1:]
+	# check for any other % directives
+	# some will be processed but the rest will be ignored
+	line = 0
+	l = program[line]
+	while (l.startswith("%")):
+		# %specvar V i fills variable V with integer i initially.
+		if l.startswith("%specvar"):
+			# offloaded
+			specvar(l)
+		line += 1
+		l = program[line]
+	# this cuts off all the % directives
+	return program[line:]
+
+def gruntime(file):
+	global variables
+	global debug
+	global step
+	global loops
+	global fuse
+	global profile
+	global jit
+	if '-debug' in sys.argv:
+		debug = True
+	if '-step' in sys.argv:
+		step = True
+	if '-noloops' in sys.argv:
+		loops = False
+	if '-nofuse' in sys.argv:
+		fuse = False
+	collapsed = None
+	if '-collapsed' in sys.argv and sys.argv.index('-collapsed')+1 < len(sys.argv):
+		collapsed = sys.argv[sys.argv.index('-collapsed')+1]
+	if '-profile' in sys.argv or collapsed is not None:
+		profile = True
+	if '-jit' in sys.argv:
+		jit = True
+	read_limits()
+	read_trace(file)
+	read_checkpoint(file)
+	code = None
+	if file.endswith('.gb'):
+		# a compiled binary, which is already decoded
+		import gbinary
+		(variables, code) = gbinary.load(file)
+		program = None
+		if debug or step or profile or '-native' in sys.argv:
+			# these work from the statements
+			program = gbinary.statements(code[:-1], list(variables))
+			if not profile:
+				code = None
+	else:
+		program = load(file)
+		if is_linked(program) and (debug or step or profile or trace is not None or jit or checkpoint is not None or '-native' in sys.argv):
+			print("Runtime error, programs compiled with -shared can't be run with -debug, -step, -profile, -trace, -jit, -native or checkpoints")
+			exit(-1)
+	resume = None
+	if '-resume' in sys.argv:
+		resume = load_checkpoint(file)
+	# now we want to actually run the program.
+	if '-native' in sys.argv:
+		# translate the program to python and run that instead of interpreting it
+		import gcodegen
+		run = gcodegen.load(file, program, list(variables))
+		regs = list(variables.values())
+		run(regs)
+		variables = dict(zip(variables, regs))
+	else:
+		(gc, stop) = run_program(program, code, resume)
+		if trace is not None and 'columns' in trace:
+			import gtrace
+			gtrace.write(trace['out'], trace, list(variables), list(variables.values()), file)
+		if profiled is not None:
+			profile_report(file, program, profiled, collapsed)
+		elif jit and not debug and not step and trace is None:
+			import gjit
+			gjit.report()
+		if stop != "halted":
+			print("Runtime stopped, " + stop_reasons[stop] + " after " + str(gc) + " steps")
+			if checkpoint is not None and stop != "diverges":
+				print("Saved a checkpoint to " + checkpoint['file'] + ", carry on with -resume")
+			print("final state: " + str(variables))
+			return
+		if checkpoint is not None and os.path.exists(checkpoint['file']):
+			# the run is over, so there's nothing to carry on from
+			os.remove(checkpoint['file'])
+	# print the return value of the program
+	print("out: " + str(variables['Y']))
+	print("final state: " + str(variables))
+
+if __name__ == '__main__':
+	# gtrace.py, gjit.py etc. import gruntime for its settings, which have to be these
+	# ones rather than those of a fresh copy of the module
+	sys.modules['gruntime'] = sys.modules['__main__']
+	if len(sys.argv) < 2:
+		print("Please provide at least 1 argument, the path to a compiled G file, and optionally additional -flags after this.")
+		exit(-1)
+	gruntime(sys.argv[1])
@@ -0,0 +1,315 @@
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+import gapi
+import gruntime
+import precompile
+
+# a long running service which keeps the macro libraries and compiled programs loaded,
+# so each job doesn't pay for starting python, loading macros and decoding the program.
+#   python gservice.py [-socket FILE] [-jobs N] [-slice STEPS] [compiler and runtime flags]
+# requests are json objects, one per line, read from stdin (with the responses written
+# to stdout) or from any number of connections to a unix socket with -socket (see
+# gclient.py). every request has an "op" and optionally an "id", which is copied into
+# its response. the responses are {"id": ..., "ok": true, ...} or
+# {"id": ..., "ok": false, "error": message}:
+#   {"op": "compile", "file": "lte.gc"} or {"op": "compile", "source": "..."}
+#       compiles a program and keeps it, under "name" if given (otherwise the name of
+#       the file, or "program"). responds with the name, lines and variables.
+#   {"op": "load", "file": "lte.g"}         keeps an already compiled .g or .gb file
+#   {"op": "run", "program": "lte", "inputs": {"X": 3}, "max_steps": N, "timeout": S, "state": true}
+#       runs a kept program, responding with Y, steps and status (and the final value of
+#       every variable with "state"). max_steps and timeout default to -maxsteps and
+#       -timeout.
+#   {"op": "programs"}   the names of the kept programs
+#   {"op": "drop", "program": "lte"}
+#   {"op": "shutdown"}   stops the service once the runs in progress are done
+# compiling and loading happen straight away. runs go to a pool of worker processes
+# (one per cpu, or -jobs N), a slice of -slice steps at a time: a run which isn't done
+# after its slice goes to the back of the queue and carries on from where it was when
+# it comes round again, so short runs are never stuck behind long (or diverging) ones.
+# the responses to runs come back in the order the runs finish, not the order they
+# were asked for.
+# the end of a slice is checked after the limits and cycles (see gruntime.pause_at), and
+# what the cycle check knows is carried from one slice to the next, so the timeout and
+# cycles stop a run however short the slices are.
+
+# steps a run gets before it goes to the back of the queue
+slice_steps = 1000000
+# the runtime settings workers use, see worker_setup
+settings = ['loops', 'fuse', 'detect_cycles']
+# how many decoded programs each worker keeps
+worker_cache_size = 64
+
+# the programs a worker has decoded, by key
+cache = {}
+
+def worker_setup(runtime):
+	for name in runtime:
+		setattr(gruntime, name, runtime[name])
+
+# runs one slice of a run in a worker.
+# program is (key, statements, names), state is (regs, pc, steps, seconds, cycles),
+# cycles being what the cycle check had got to (None to start with). the slice is
+# paused at step until, and the run stops at step budget or after timeout seconds of
+# running in total.
+# returns how the slice ended ("paused" if it's to carry on) and the state after it.
+def run_slice(program, state, until, budget, timeout):
+	(key, statements, names) = program
+	if not key in cache:
+		if len(cache) >= worker_cache_size:
+			cache.clear()
+		cache[key] = gapi.Program(statements, dict.fromkeys(names, 0), loops=gruntime.loops, fuse=gruntime.fuse)
+	(regs, pc, steps, seconds, cycles) = state
+	gruntime.max_steps = budget
+	gruntime.max_seconds = timeout
+	gruntime.pause_at = until
+	start = time.monotonic()
+	watch = {'start': start - seconds, 'monotone': None, 'saved': None, 'power': 1, 'count': 0, 'saved_at': steps, 'check_at': gruntime.next_check(steps)}
+	if cycles is not None:
+		(watch['saved'], watch['power'], watch['count']) = cycles
+	(steps, status) = gruntime.execute(cache[key].code, regs, pc, steps, watch=watch)
+	seconds += time.monotonic() - start
+	if status == "halted" or status == "diverges":
+		pc = None
+	else:
+		pc = gruntime.stopped_pc
+	return (status, (regs, pc, steps, seconds, (watch['saved'], watch['power'], watch['count'])))
+
+class Service:
+	def __init__(self, compiler, jobs, runtime):
+		self.compiler = compiler
+		self.runtime = runtime
+		self.jobs = jobs
+		self.pool = multiprocessing.Pool(jobs, worker_setup, (dict([(name, runtime[name]) for name in settings]),))
+		# everything that happens comes through here: requests, closed connections and
+		# finished slices, so only the main thread touches the state below
+		self.events = queue.Queue()
+		self.programs = {}
+		self.versions = 0
+		self.waiting = collections.deque()
+		self.running = 0
+		self.stopping = False
+
+	def respond(self, conn, request, response):
+		if isinstance(request, dict) and 'id' in request:
+			response['id'] = request['id']
+		try:
+			conn.write(json.dumps(response) + "\n")
+			conn.flush()
+		except (OSError, ValueError):
+			# the other end has gone
+			pass
+
+	def fail(self, conn, request, msg):
+		self.respond(conn, request, {'ok': False, 'error': msg})
+
+	# reads requests from a connection until it closes
+	def read(self, conn, reader):
+		try:
+			for line in reader:
+				if line.strip() != "":
+					self.events.put(('request', conn, line))
+		except (OSError, ValueError):
+			pass
+		self.events.put(('closed', conn, None))
+
+	def keep(self, name, program):
+		self.versions += 1
+		self.programs[name] = (str(self.versions), program)
+
+	def handle(self, conn, line):
+		try:
+			request = json.loads(line)
+		except ValueError:
+			return self.fail(conn, None, "Requests must be json objects, one per line")
+		if not isinstance(request, dict):
+			return self.fail(conn, None, "Requests must be json objects, one per line")
+		for field in ['op', 'name', 'program', 'file', 'source']:
+			if field in request and not isinstance(request[field], str):
+				return self.fail(conn, request, field + " must be a string")
+		op = request.get('op')
+		try:
+			if op == 'compile':
+				if 'source' in request:
+					program = self.compiler.compile(request['source'], self.runtime['loops'], self.runtime['fuse'])
+					name = request.get('name', "program")
+				elif 'file' in request:
+					program = self.compiler.compile_file(request['file'], self.runtime['loops'], self.runtime['fuse'])
+					name = request.get('name', os.path.splitext(os.path.basename(request['file']))[0])
+				else:
+					return self.fail(conn, request, "compile needs a file or source")
+				self.keep(name, program)
+				self.respond(conn, request, {'ok': True, 'program': name, 'lines': len(program.statements), 'variables': program.names})
+			elif op == 'load':
+				if not 'file' in request:
+					return self.fail(conn, request, "load needs a file")
+				program = gapi.Program.load(request['file'], self.runtime['loops'], self.runtime['fuse'])
+				name = request.get('name', os.path.splitext(os.path.basename(request['file']))[0])
+				self.keep(name, program)
+				self.respond(conn, request, {'ok': True, 'program': name, 'lines': len(program.statements), 'variables': program.names})
+			elif op == 'run':
+				self.start(conn, request)
+			elif op == 'programs':
+				self.respond(conn, request, {'ok': True, 'programs': sorted(self.programs)})
+			elif op == 'drop':
+				if not request.get('program') in self.programs:
+					return self.fail(conn, request, "There is no program called " + str(request.get('program')))
+				del self.programs[request['program']]
+				self.respond(conn, request, {'ok': True})
+			elif op == 'shutdown':
+				self.stopping = True
+				self.respond(conn, request, {'ok': True})
+			else:
+				self.fail(conn, request, "Unknown op " + str(op))
+		except gapi.GError as e:
+			self.fail(conn, request, str(e))
+
+	# queues a run
+	def start(self, conn, request):
+		name = request.get('program')
+		if not name in self.programs:
+			return self.fail(conn, request, "There is no program called " + str(name))
+		inputs = request.get('inputs', {})
+		if not isinstance(inputs, dict):
+			return self.fail(conn, request, "inputs must be an object of variable -> value")
+		budget = request.get('max_steps', self.runtime['max_steps'])
+		timeout = request.get('timeout', self.runtime['max_seconds'])
+		if budget is not None and (not isinstance(budget, int) or budget < 0):
+			return self.fail(conn, request, "max_steps must be a number of steps")
+		if timeout is not None and not isinstance(timeout, (int, float)):
+			return self.fail(conn, request, "timeout must be a number of seconds")
+		(key, program) = self.programs[name]
+		regs = program.registers(inputs)
+		self.waiting.append({
+			'conn': conn,
+			'request': request,
+			'program': (name + "#" + key, program.statements, program.names),
+			'names': program.names,
+			'budget': budget,
+			'timeout': timeout,
+			'state': (regs, 0, 0, 0.0, None),
+		})
+
+	# sends runs from the queue to the workers while there are workers free
+	def dispatch(self):
+		while self.waiting and self.running < self.jobs:
+			job = self.waiting.popleft()
+			steps = job['state'][2]
+			self.running += 1
+			self.pool.apply_async(run_slice, (job['program'], job['state'], steps + slice_steps, job['budget'], job['timeout']),
+				callback=lambda result, job=job: self.events.put(('slice', job, result)),
+				error_callback=lambda e, job=job: self.events.put(('slice', job, e)))
+
+	# a slice of a run is done, either the run is over or it goes to the back of the queue
+	def finished(self, job, result):
+		self.running -= 1
+		if isinstance(result, Exception):
+			return self.fail(job['conn'], job['request'], "The run failed: " + repr(result))
+		(status, state) = result
+		(regs, pc, steps, seconds, cycles) = state
+		if status == "paused":
+			job['state'] = state
+			self.waiting.append(job)
+			return
+		response = {'ok': True, 'Y': regs[job['names'].index('Y')], 'steps': steps, 'status': status, 'seconds': seconds}
+		if job['request'].get('state'):
+			response['variables'] = dict(zip(job['names'], regs))
+		self.respond(job['conn'], job['request'], response)
+
+	# handles events until the service is shut down (or stdin closes) and the runs in
+	# progress are done
+	def serve(self, connections):
+		while connections or self.running or self.waiting:
+			if self.stopping and not self.running and not self.waiting:
+				break
+			(kind, a, b) = self.events.get()
+			if kind == 'request':
+				if self.stopping:
+					self.fail(a, None, "The service is shutting down")
+				else:
+					try:
+						self.handle(a, b)
+					except Exception as e:
+						# whatever was wrong with it, the other requests carry on
+						self.fail(a, None, "The request failed: " + repr(e))
+			elif kind == 'slice':
+				self.finished(a, b)
+			elif kind == 'closed':
+				connections.discard(a)
+				if a is not sys.stdout:
+					a.close()
+			self.dispatch()
+		self.pool.close()
+		self.pool.join()
+
+	# accepts connections to a unix socket, each read by a thread of its own
+	def listen(self, path, connections):
+		if os.path.exists(path):
+			os.remove(path)
+		server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		server.bind(path)
+		server.listen()
+		def accept():
+			while True:
+				(sock, address) = server.accept()
+				conn = sock.makefile('rw')
+				threading.Thread(target=self.read, args=(conn, conn), daemon=True).start()
+		threading.Thread(target=accept, daemon=True).start()
+		return server
+
+def service_error(msg, arg):
+	print("Service error, " + msg)
+	print(arg)
+	exit(-1)
+
+def main():
+	global slice_steps
+	path = None
+	jobs = os.cpu_count() or 1
+	for i in range(1, len(sys.argv)-1):
+		(arg, val) = (sys.argv[i], sys.argv[i+1])
+		if arg == '-socket':
+			path = val
+		elif arg == '-jobs' or arg == '-slice':
+			if not val.isdigit() or int(val) < 1:
+				service_error(arg + " takes a number", val)
+			if arg == '-jobs':
+				jobs = int(val)
+			else:
+				slice_steps = int(val)
+	folders = precompile.linked_folders()
+	try:
+		compiler = gapi.Compiler(folders[1:], '-O' in sys.argv, '-dce' in sys.argv, '-intrinsics' in sys.argv)
+	except gapi.GError as e:
+		service_error("the macro libraries did not load", str(e))
+	gruntime.loops = not '-noloops' in sys.argv
+	gruntime.fuse = not '-nofuse' in sys.argv
+	gruntime.read_limits()
+	runtime = dict([(name, getattr(gruntime, name)) for name in settings + ['max_steps', 'max_seconds']])
+	service = Service(compiler, jobs, runtime)
+	server = None
+	if path is None:
+		connections = set([sys.stdout])
+		threading.Thread(target=service.read, args=(sys.stdout, sys.stdin), daemon=True).start()
+	else:
+		# the socket service runs until it's told to shut down
+		connections = set([None])
+		server = service.listen(path, connections)
+		print("Listening on " + path, file=sys.stderr)
+	try:
+		service.serve(connections)
+	finally:
+		if server is not None:
+			server.close()
+			os.remove(path)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,261 @@
+import array
+import os
+import struct
+import sys
+import time
+
+import gruntime
+
+# execution traces (.gtrace files), recorded by gruntime.py -trace and read by this
+# file's viewer:
+#   python gruntime.py my_program.g -trace 1000000 [-tracesample K] [-tracefrom STEP] [-traceout FILE]
+#   python gtrace.py my_program.gtrace [-var V] [-pc a..b] [-steps a..b] [-last N] [-replay]
+# every step recorded is (step, pc, the variable it changed, the new value of it).
+# the records go into a fixed size ring buffer in memory, so only the last N are kept
+# and recording costs the same however long the program runs, and the buffer is
+# written out once the run is over. -tracesample K only records every Kth step, and
+# -tracefrom STEP starts recording at that step.
+# layout of the file (all little endian):
+# - header: magic, format version, variable count, flags, records kept, records made,
+#   sample interval, first step recorded
+# - the path of the program and the variable names, separated by newlines
+# - the values of the variables at the start and at the end of the run (8 bytes each)
+# - the records, oldest first, a column at a time: all the steps (8 bytes each), pcs
+#   (4 bytes), variables (4 bytes) then values (8 bytes)
+# values which don't fit in 8 bytes are saved as the largest value that does.
+
+magic = b'GTRC'
+version = 1
+header = struct.Struct('<4sHHIQQQQ')
+value = struct.Struct('<Q')
+# the type codes of the columns of the records
+columns = ['Q', 'I', 'I', 'Q']
+# the variable of a record for a step which didn't change one
+no_slot = 0xFFFFFFFF
+largest = 2**64 - 1
+
+# set in the header when the buffer went all the way round, so the start of the run
+# isn't in it
+WRAPPED = 1
+
+# runs decoded code (without find_loops/find_blocks, so every step is a single statement)
+# recording the steps into trace, which has the settings (size, sample, start) and gets
+# the recording (the columns, pos, count, initial) added to it.
+# returns the same as gruntime.execute.
+def execute(code, regs, trace):
+	size = trace['size']
+	sample = trace['sample']
+	steps = array.array('Q', [0]) * size
+	pcs = array.array('I', [0]) * size
+	slots = array.array('I', [0]) * size
+	values = array.array('Q', [0]) * size
+	trace['initial'] = list(regs)
+	pos = 0
+	count = 0
+	# steps to go before the next one is recorded
+	wait = trace['start']
+	gc = 0
+	pc = 0
+	watch = {'start': time.monotonic(), 'monotone': None, 'saved': None, 'power': 1, 'count': 0, 'saved_at': 0}
+	check_at = gruntime.next_check(0)
+	while True:
+		op, slot, target = code[pc]
+		at = pc
+		changed = no_slot
+		jumped = False
+		pc += 1
+		if op == gruntime.OP_IF:
+			if regs[slot]:
+				pc = target
+				jumped = True
+		elif op == gruntime.OP_INC:
+			regs[slot] += 1
+			changed = slot
+		elif op == gruntime.OP_DEC:
+			if regs[slot]:
+				regs[slot] -= 1
+			changed = slot
+		elif op == gruntime.OP_NATIVE:
+			before = [regs[s] for s in slot[2]]
+			slot[0](regs)
+			for i in range(len(before)):
+				if regs[slot[2][i]] != before[i]:
+					changed = slot[2][i]
+					break
+		elif op == gruntime.OP_BRANCH:
+			if slot[0](regs):
+				pc = target
+				jumped = True
+		elif op == gruntime.OP_EXIT:
+			break
+		if wait:
+			wait -= 1
+		else:
+			wait = sample - 1
+			steps[pos] = gc
+			pcs[pos] = at
+			slots[pos] = changed
+			if changed != no_slot:
+				values[pos] = min(regs[changed], largest)
+			else:
+				values[pos] = 0
+			pos += 1
+			count += 1
+			if pos == size:
+				pos = 0
+		gc += 1
+		if jumped and gc >= check_at:
+			# a jump was taken, see gruntime.execute for the checks
+			stop = gruntime.check(watch, code, pc, regs, gc)
+			if stop:
+				trace.update({'columns': [steps, pcs, slots, values], 'pos': pos, 'count': count})
+				return (gc, stop)
+			check_at = gruntime.next_check(gc)
+	trace.update({'columns': [steps, pcs, slots, values], 'pos': pos, 'count': count})
+	return (gc, "halted")
+
+# writes a recorded trace to a file
+def write(path, trace, names, final, program_file):
+	size = trace['size']
+	(pos, count) = (trace['pos'], trace['count'])
+	kept = min(count, size)
+	flags = 0
+	records = []
+	for column in trace['columns']:
+		if count > size:
+			flags |= WRAPPED
+			# oldest first
+			column = column[pos:] + column[:pos]
+		else:
+			column = column[:kept]
+		if sys.byteorder == 'big':
+			column.byteswap()
+		records.append(column.tobytes())
+	text = "\n".join([program_file] + list(names)).encode()
+	with open(path, "wb") as f:
+		f.write(header.pack(magic, version, len(names), flags, kept, count, trace['sample'], trace['start']))
+		f.write(value.pack(len(text)))
+		f.write(text)
+		for v in list(trace['initial']) + list(final):
+			f.write(value.pack(min(v, largest)))
+		f.write(b''.join(records))
+	print("Wrote trace of " + str(kept) + " steps to " + path)
+
+def trace_error(msg, arg):
+	print("Trace error, " + msg)
+	print(arg)
+	exit(-1)
+
+# reads a .gtrace file, returns (info, names, initial, final, records) where info has the
+# header fields and records is a list of (step, pc, slot, value) tuples
+def load(file):
+	try:
+		with open(file, 'rb') as f:
+			data = f.read()
+	except OSError:
+		trace_error("could not read a trace file", file)
+	if len(data) < header.size + value.size:
+		trace_error("this is not a trace file", file)
+	(mg, ver, nvars, flags, kept, count, sample, start) = header.unpack_from(data, 0)
+	if mg != magic or ver != version:
+		trace_error("this is not a trace file or is from a different version", file)
+	offset = header.size
+	(length,) = value.unpack_from(data, offset)
+	offset += value.size
+	text = data[offset:offset+length].decode().split("\n")
+	offset += length
+	values = [value.unpack_from(data, offset + i * value.size)[0] for i in range(2 * nvars)]
+	offset += 2 * nvars * value.size
+	records = []
+	for code in columns:
+		column = array.array(code)
+		end = offset + kept * column.itemsize
+		if len(data) < end:
+			trace_error("the trace file is truncated", file)
+		column.frombytes(data[offset:end])
+		if sys.byteorder == 'big':
+			column.byteswap()
+		records.append(column)
+		offset = end
+	records = list(zip(*records))
+	info = {'program': text[0], 'wrapped': bool(flags & WRAPPED), 'kept': kept, 'count': count, 'sample': sample, 'start': start}
+	return (info, text[1:1+nvars], values[:nvars], values[nvars:], records)
+
+# reads a range argument, a or a..b
+def span(arg, flag):
+	(lo, sep, hi) = arg.partition('..')
+	if not lo.isdigit() or (sep and not hi.isdigit()):
+		trace_error(flag + " takes a number or a range a..b", arg)
+	if not sep:
+		hi = lo
+	return (int(lo), int(hi))
+
+# prints the records of a trace, filtered by the arguments.
+# with -replay the state after each record is shown too. that's only the whole state
+# when the trace has every step from the start, otherwise it's just the variables the
+# trace has seen so far.
+def view(file):
+	(info, names, initial, final, records) = load(file)
+	var = None
+	pcs = None
+	steps = None
+	last = None
+	program = None
+	for i in range(2, len(sys.argv)):
+		(prev, arg) = (sys.argv[i-1], sys.argv[i])
+		if prev == '-var':
+			if not arg in names:
+				trace_error("the program has no variable", arg)
+			var = names.index(arg)
+		elif prev == '-pc':
+			pcs = span(arg, prev)
+		elif prev == '-steps':
+			steps = span(arg, prev)
+		elif prev == '-last':
+			if not arg.isdigit():
+				trace_error("-last takes a number of records", arg)
+			last = int(arg)
+		elif prev == '-program':
+			program = arg
+	if program is None:
+		program = os.path.join(os.path.dirname(file), os.path.basename(info['program']))
+	statements = []
+	if os.path.exists(program):
+		statements = gruntime.load(program)
+	complete = not info['wrapped'] and info['sample'] == 1 and info['start'] == 0
+	print("Trace of " + info['program'] + ": " + str(info['kept']) + " steps kept of " + str(info['count']) + " recorded"
+		+ (", every " + str(info['sample']) + " steps" if info['sample'] > 1 else "")
+		+ (", from step " + str(info['start']) if info['start'] else ""))
+	if records:
+		print("Steps " + str(records[0][0]) + " to " + str(records[-1][0]))
+	state = {}
+	if complete:
+		state = dict(zip(names, initial))
+	shown = []
+	for (step, pc, slot, val) in records:
+		if slot != no_slot:
+			state[names[slot]] = val
+		if var is not None and slot != var:
+			continue
+		if pcs is not None and not (pcs[0] <= pc <= pcs[1]):
+			continue
+		if steps is not None and not (steps[0] <= step <= steps[1]):
+			continue
+		shown.append((step, pc, slot, val, dict(state) if '-replay' in sys.argv else None))
+	if last is not None:
+		shown = shown[-last:] if last else []
+	for (step, pc, slot, val, after) in shown:
+		stmt = statements[pc] if pc < len(statements) else ""
+		line = "%10d  pc %-6d %-32s" % (step, pc, stmt)
+		if slot != no_slot:
+			line += " " + names[slot] + " = " + str(val)
+		print(line)
+		if after is not None:
+			print("            " + str(after))
+	print("Final state: " + str(dict(zip(names, final))))
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print("Please provide at least 1 argument, the path to a .gtrace file.")
+		exit(-1)
+	view(sys.argv[1])
@@ -0,0 +1,253 @@
+import time
+
+import numpy as np
+
+import gruntime
+
+# runs one program over a whole batch of inputs at once with numpy, for gbatch.py -vector.
+# the variables of every run (lane) are held in one 2-d array, a row per variable slot
+# and a column per lane (so each variable's values are together in memory), and every
+# lane has its own pc and step count. each round the lanes are grouped by pc and each
+# group does its instruction in bulk: ++, clamped --, if-gotos, and the fused blocks
+# and counting loops from find_blocks/find_loops too, which is where most of the work
+# goes. lanes which reach the exit are retired.
+# the results are exactly those of gruntime.execute: each lane is checked at the same
+# taken jumps execute would check it at, in the same way as gruntime.check (which keeps
+# its state for brent's method in arrays here, a column per lane), so the limits and
+# cycles stop it at the same step. once there are only a few lanes left they are
+# finished by gruntime.execute from where they got to, with the state of their checks.
+# intrinsics are run a lane at a time, and a lane whose values or step count would get
+# too big for 64 bits is handed off too, before the instruction that would do it.
+
+# lanes left at which the rest are finished by gruntime.execute
+min_lanes = 16
+# the largest value a lane can hold (with room to add to it)
+largest = 1 << 62
+
+# runs the program (decoded code) from initial (a value per slot) for each set of inputs
+# (a list of (variable, value) pairs), slots being the slot of each variable.
+# returns (Y, steps, status) for each set of inputs, in order.
+def run(code, initial, slots, inputs):
+	lanes = len(inputs)
+	y = slots['Y']
+	results = [None] * lanes
+	regs = np.empty((len(initial), lanes), np.int64)
+	fits = np.ones(lanes, bool)
+	for s in range(len(initial)):
+		if initial[s] >= largest:
+			# none of it fits
+			return [finish(code, initial, slots, inputs[lane]) for lane in range(lanes)]
+		regs[s, :] = initial[s]
+	for lane in range(lanes):
+		for (var, val) in inputs[lane]:
+			if val >= largest:
+				fits[lane] = False
+			else:
+				regs[slots[var], lane] = val
+	for lane in np.flatnonzero(~fits):
+		results[lane] = finish(code, initial, slots, inputs[lane])
+	pc = np.zeros(lanes, np.int64)
+	gc = np.zeros(lanes, np.int64)
+	check_at = np.full(lanes, min(gruntime.next_check(0), largest), np.int64)
+	start = time.monotonic()
+	# what gruntime.check keeps in its watch for each lane: the saved state (pc -1 when
+	# there isn't one yet) and the count and power of 2 it's counting to
+	monotone = np.array(gruntime.monotone_slots(code), np.int64)
+	saved = np.zeros_like(regs)
+	saved_pc = np.full(lanes, -1, np.int64)
+	count = np.zeros(lanes, np.int64)
+	power = np.ones(lanes, np.int64)
+	live = np.flatnonzero(fits)
+
+	# the watch gruntime.check would have for a lane
+	def watch(lane):
+		state = None
+		if saved_pc[lane] >= 0:
+			state = (int(saved_pc[lane]), tuple(saved[:, lane].tolist()))
+		return {'start': start, 'monotone': monotone, 'saved': state, 'power': int(power[lane]),
+			'count': int(count[lane]), 'saved_at': 0, 'check_at': int(check_at[lane])}
+
+	# hands a lane over to gruntime.execute, row being its values if they've already
+	# been taken out of regs
+	def hand_off(lane, row=None, w=None):
+		if row is None:
+			row = regs[:, lane].tolist()
+		if w is None:
+			w = watch(lane)
+		(steps, status) = gruntime.execute(code, row, int(pc[lane]), int(gc[lane]), watch=w)
+		results[lane] = (row[y], steps, status)
+
+	# gruntime.check for the lanes in due, which have just taken a jump.
+	# returns which of them stopped.
+	def check(due):
+		steps = gc[due]
+		stop = np.zeros(due.size, bool)
+		if gruntime.max_steps is not None:
+			stop = steps >= gruntime.max_steps
+			for lane in due[stop]:
+				results[lane] = (int(regs[y, lane]), int(gc[lane]), "step limit")
+		if gruntime.max_seconds is not None and time.monotonic() - start >= gruntime.max_seconds:
+			for lane in due[~stop]:
+				results[lane] = (int(regs[y, lane]), int(gc[lane]), "time limit")
+			stop[:] = True
+		if gruntime.detect_cycles:
+			going = np.flatnonzero(~stop)
+			lanes = due[going]
+			state = regs[:, lanes]
+			state[monotone] = np.minimum(state[monotone], 1)
+			same = (saved_pc[lanes] == pc[lanes]) & (saved[:, lanes] == state).all(axis=0)
+			for lane in lanes[same]:
+				results[lane] = (int(regs[y, lane]), int(gc[lane]), "diverges")
+			stop[going[same]] = True
+			lanes = lanes[~same]
+			state = state[:, ~same]
+			count[lanes] += 1
+			kept = count[lanes] == power[lanes]
+			lanes = lanes[kept]
+			saved[:, lanes] = state[:, kept]
+			saved_pc[lanes] = pc[lanes]
+			power[lanes] *= 2
+			count[lanes] = 0
+		# and gruntime.next_check for the rest
+		lanes = due[~stop]
+		if gruntime.max_seconds is None and not gruntime.detect_cycles:
+			check_at[lanes] = largest if gruntime.max_steps is None else gruntime.max_steps
+		else:
+			n = gc[lanes] + gruntime.check_interval
+			if gruntime.max_steps is not None:
+				n = np.minimum(n, gruntime.max_steps)
+			check_at[lanes] = n
+		return stop
+
+	# which of the lanes at pc would go past largest doing the instruction there, or None
+	# if it can't (only a counting loop can add much to the step count)
+	def too_big(at, lanes):
+		op, slot, target = code[at]
+		if op == gruntime.OP_INC:
+			return regs[slot, lanes] >= largest
+		if op == gruntime.OP_BLOCK:
+			big = np.zeros(lanes.size, bool)
+			for s, add, low in slot:
+				if add > 0:
+					big |= regs[s, lanes] > largest - add
+			return big
+		if op == gruntime.OP_LOOP:
+			min_count, length, extra, exit_pc, adds, subs, path = target
+			n = np.maximum(regs[slot, lanes], min_count)
+			big = n > (largest - extra - gc[lanes]) // max(length, 1)
+			for s, k in adds:
+				big |= n > (largest - regs[s, lanes]) // k
+			return big
+		return None
+
+	while live.size:
+		if live.size < min_lanes:
+			for lane in live:
+				hand_off(lane)
+			break
+		# group the lanes by pc
+		p = pc[live]
+		order = np.argsort(p, kind='stable')
+		live = live[order]
+		p = p[order]
+		bounds = (np.flatnonzero(p[1:] != p[:-1]) + 1).tolist()
+		alive = np.ones(live.size, bool)
+		for (a, b) in zip([0] + bounds, bounds + [live.size]):
+			at = int(p[a])
+			lanes = live[a:b]
+			# where each lane is in live
+			where = np.arange(a, b)
+			big = too_big(at, lanes)
+			if big is not None and big.any():
+				for i in np.flatnonzero(big):
+					hand_off(lanes[i])
+					alive[a+i] = False
+				lanes = lanes[~big]
+				where = where[~big]
+				if lanes.size == 0:
+					continue
+			op, slot, target = code[at]
+			taken = None
+			if op == gruntime.OP_BLOCK:
+				for s, add, low in slot:
+					regs[s, lanes] = np.maximum(regs[s, lanes] + add, low)
+				test, jump, next_pc, length = target
+				gc[lanes] += length
+				if test >= 0:
+					taken = regs[test, lanes] != 0
+					pc[lanes] = np.where(taken, jump, next_pc)
+				else:
+					pc[lanes] = next_pc
+			elif op == gruntime.OP_IF:
+				taken = regs[slot, lanes] != 0
+				pc[lanes] = np.where(taken, target, at + 1)
+				gc[lanes] += 1
+			elif op == gruntime.OP_INC:
+				regs[slot, lanes] += 1
+				pc[lanes] = at + 1
+				gc[lanes] += 1
+			elif op == gruntime.OP_DEC:
+				regs[slot, lanes] = np.maximum(regs[slot, lanes] - 1, 0)
+				pc[lanes] = at + 1
+				gc[lanes] += 1
+			elif op == gruntime.OP_SKIP:
+				pc[lanes] = at + 1
+				gc[lanes] += 1
+			elif op == gruntime.OP_LOOP:
+				min_count, length, extra, exit_pc, adds, subs, path = target
+				n = np.maximum(regs[slot, lanes], min_count)
+				for s, k in adds:
+					regs[s, lanes] += k * n
+				for s, k in subs:
+					regs[s, lanes] = np.maximum(regs[s, lanes] - k * n, 0)
+				regs[slot, lanes] = 0
+				gc[lanes] += n * length + extra
+				pc[lanes] = exit_pc
+			elif op == gruntime.OP_NATIVE or op == gruntime.OP_BRANCH:
+				# intrinsics work on lists of python ints, so these go a lane at a time
+				taken = np.zeros(lanes.size, bool)
+				for i in range(lanes.size):
+					lane = lanes[i]
+					row = regs[:, lane].tolist()
+					jumps = slot[0](row)
+					if op == gruntime.OP_BRANCH and jumps:
+						taken[i] = True
+						pc[lane] = target
+					else:
+						pc[lane] = at + 1
+					gc[lane] += 1
+					if max(row) < largest:
+						regs[:, lane] = row
+						continue
+					# too big for regs, the check for this jump happens in python
+					taken[i] = False
+					alive[where[i]] = False
+					w = watch(lane)
+					if op == gruntime.OP_BRANCH and jumps and gc[lane] >= check_at[lane]:
+						stop = gruntime.check(w, code, int(pc[lane]), row, int(gc[lane]))
+						if stop:
+							results[lane] = (row[y], int(gc[lane]), stop)
+							continue
+						w['check_at'] = gruntime.next_check(int(gc[lane]))
+					hand_off(lane, row, w)
+			else:
+				for lane in lanes:
+					results[lane] = (int(regs[y, lane]), int(gc[lane]), "halted")
+				alive[where] = False
+				continue
+			if taken is None:
+				continue
+			# the same checks gruntime.execute does on a taken jump
+			due = np.flatnonzero(taken & (gc[lanes] >= check_at[lanes]))
+			if due.size:
+				alive[where[due]] &= ~check(lanes[due])
+		live = live[alive]
+	return results
+
+# runs one set of inputs with gruntime.execute alone
+def finish(code, initial, slots, inputs):
+	regs = list(initial)
+	for (var, val) in inputs:
+		regs[slots[var]] = val
+	(steps, status) = gruntime.execute(code, regs)
+	return (regs[slots['Y']], steps, status)
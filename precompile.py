@@ -1,763 +1,1581 @@
-import re
-import os
-import sys
-
-# main steps for compilation:
-# 1. syntax evaluation, macro loading
-# 2. identify list of used variables and labels
-# 3. macro expansion
-# 4. label replacement
-# 5. E insertion
-# outputs code that can be run
-
-macros = {}
-debug = False
-debug_extreme = False
-
-# handles the %prefix macro
-# the minimum definition of a macro has a
-# %prefix directive to indicate how it's supposed to be used.
-# e.g. %prefix zero
-def macro_prefix(mc_struct, l):
-	if debug:
-		print("Handle macro prefix for macro " + mc_struct['name'])
-	mc_def = l.split(" ")
-	if not len(mc_def) == 2:
-		print("Macro compilation error, macro " + mc_struct['name'] + " has incorrect argument count for prefix directive")
-		exit(-1)
-	# get the prefix
-	pref = mc_def[1]
-	# check if the prefix has already been used
-	if pref in macros:
-		print("Macro compilation error, macro " + mc_struct['name'] + " duplicates prefix with " + macros[pref]['name'])
-		exit(-1)
-	# store the prefix into mc_struct
-	mc_struct['prefix'] = pref
-	if debug:
-		print("Prefix " + pref + " assigned")
-		print()
-
-# handles the %input macro
-# e.g. %input 1 variable 1 label
-def macro_input(mc_struct, l):
-	if debug:
-		print("Handle macro input for macro " + mc_struct['name'])
-	mc_def = l.split(" ")
-	if not len(mc_def) == 5:
-		print("Macro compilation error, macro " + mc_struct['name'] + " has incorrect argument count for input directive")
-		exit(-1)
-	# check the right values are being passed
-	if not mc_def[1].isdigit() or not mc_def[3].isdigit():
-		print("Macro compilation error, macro " + mc_struct['name'] + " does not provide integer values for input directive")
-		exit(-1)
-	# get the number of variables and labels
-	var_count = int(mc_def[1])
-	label_count = int(mc_def[3])
-	if var_count < 0 or label_count < 0:
-		print("Macro compilation error, macro " + mc_struct['name'] + " defines negative label or variable counts")
-		exit(-1)
-	# put it into mc_struct
-	mc_struct['var_count'] = var_count
-	mc_struct['label_count'] = label_count
-	if debug:
-		print(str(var_count) + " in vars assigned for macro")
-		print(str(label_count) + " in labels assigned for macro")
-		print()
-
-def macro_require(mc_struct, l):
-	if debug:
-		print("Handle macro require for macro " + mc_struct['name'])
-	mc_def = l.split(" ")
-	if not len(mc_def) == 2:
-		print("Macro compilation error, macro " + mc_struct['name'] + " has incorrect argument count for require directive")
-		exit(-1)
-	prefreq = mc_def[1]
-	if not 'requires' in mc_struct:
-		mc_struct['requires'] = [prefreq]
-	else:
-		mc_struct['requires'].append(prefreq)
-	if debug:
-		print("Added macro requirement " + prefreq)
-
-def macro_loading(macro_folders):
-	if debug:
-		print("Start processing macros")
-	global macros
-	for folder in macro_folders:
-		if debug:
-			print("Start processing macros from library " + folder)
-		if not os.path.exists('macro/' + folder):
-			print("No macro folder found for linked folder " + folder + ", skipping")
-			continue
-		for filename in os.listdir('macro/' + folder):
-			if filename.endswith('.gmacro'):
-				with open(os.path.join('macro/' + folder, filename)) as macro:
-					if debug:
-						print ("Start processing macro " + filename.replace(".gmacro", ""))
-					mc = macro.readlines()
-					mc = [l.replace('\n', '').replace(';', ' ; ').strip() for l in mc]
-					# remove any blank lines
-					mc = [l for l in mc if l is not ""]
-					# remove any lines starting with ;
-					# to not have to tokenize
-					mc = [l for l in mc if not l.startswith(';')]
-					# now we process % directives
-					# some will be processed but the rest will be ignored
-					mc_struct = {'name': filename.replace('.gmacro', ''), 'requires': [], 'label_count': 0, 'var_count': 0}
-					line = 0
-					l = mc[line]
-					while (l.startswith("%")):
-						if l.startswith("%input"):
-							macro_input(mc_struct, l)
-						elif l.startswith("%prefix"):
-							macro_prefix(mc_struct, l)
-						elif l.startswith("%require"):
-							macro_require(mc_struct, l)
-						line += 1
-						l = mc[line]
-					# this cuts off all the % directives
-					mc = mc[line:]
-					# confirm that the macro contained at a minimum the %prefix directive
-					if not 'prefix' in mc_struct:
-						print("Macro compilation error, macro " + mc_struct['name'] + " does not define a prefix operator")
-						exit(-1)
-					# store code into mc_struct
-					mc_struct['code'] = mc
-					# and push the struct into macros
-					macros[mc_struct['prefix']] = mc_struct
-					if debug:
-						print("Finish processing macro")
-						print()
-	if debug:
-		print("All macros finished processing")
-		print("Macro definitions: " + str(macros))
-		print()
-
-# checks that all macros have their requirements met.
-# will unload any macros with a missing requirement.
-def macro_requirement_checking():
-	global macros
-	if debug:
-		print("Checking macro requirements")
-	should_unload = []
-	for m in macros:
-		macro = macros[m]
-		reqs = macro['requires']
-		for req in reqs:
-			if not req in macros:
-				if debug:
-					print("Macro " + macro['name'] + " is missing requirement " + req)
-					print("Unloading")
-				should_unload.append(m)
-				break
-	for m in should_unload:
-		del macros[m]
-	if debug:
-		print("Macro requirements checked")
-
-# checks syntax on an input program (list of statements)
-# it will also produce a list of variables and labels used in the program
-# and return a tuple (vars, labels).
-def syntax_check(program):
-	if debug:
-		print("syntax checking program")
-	# list of vars, labels
-	vars = ['Y']
-	labels = []
-	# line count
-	line = 1
-	# this is used to continually re-load/re-check until all macros are expanded
-	# this allows macros to use other macros themselves.
-	has_macro = False
-	# possible stmt in a program:
-	# V++
-	# V--
-	# if V not 0 goto L
-	# skip
-	# any content after a semicolon ; should be ignored
-	# any statement can have a [L] before it to indicate a label
-	# due to the above 2 requirements we must tokenize
-	label_checker = re.compile(r'\[[A-Za-z]+[0-9]*\]$')
-	inc_checker = re.compile(r'[A-Za-z]+[0-9]*\+\+$')
-	dec_checker = re.compile(r'[A-Za-z]+[0-9]*\-\-$')
-	for stmt in program:
-		# tokenize the statement
-		stmt_tokens = stmt.split(' ')
-		stmt_tokens = [token for token in stmt_tokens if token.strip() != ""]
-		# start with the first token in the list.
-		first = stmt_tokens[0]
-		# if it's [L] we should extract the label and discard.
-		if label_checker.match(first):
-			# we need to confirm this label is not already in labels.
-			if not first[1:-1] in labels:
-				labels.append(first[1:-1])
-			else:
-				print("Error on line "+str(line)+": Repeated label")
-				print(stmt)
-				exit(-1)
-			stmt_tokens = stmt_tokens[1:]
-			first = stmt_tokens[0]
-		if inc_checker.match(first):
-			# match an increment operation, V++.
-			# make sure no other tokens exist after first.
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(line)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-			# grab the variable name
-			var = first.replace("++", "")
-			# add it to the list
-			if not var in vars:
-				vars.append(var)
-		elif dec_checker.match(first):
-			# match a decrement operation, V--.
-			# make sure no other tokens exist after first.
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(line)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-			# grab the variable name
-			var = first.replace("--", "")
-			# add it to the list
-			if not var in vars:
-				vars.append(var)
-		elif first == "if":
-			# if statement (conditional branch) has a very specific structure.
-			# if V not 0 goto L
-			# check remaining tokens... structure is very firm so we don't need to 
-			# be too concerned about looping over the tokens, just check the
-			# exact matching structure.
-			# check for wrong count of tokens
-			if len(stmt_tokens) < 6:
-				print("Error on line "+str(line)+": Not enough tokens")
-				print(stmt)
-				exit(-1)
-			# check for too many tokens (not in a comment)
-			if len(stmt_tokens) > 6 and stmt_tokens[6].strip() != ";":
-				print("Error on line "+str(line)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-			# get the V from the statement
-			var_compare = stmt_tokens[1]
-			# check for bad setup of the rest of the statement
-			if not stmt_tokens[2] == "not" or not stmt_tokens[3] == "0" or not stmt_tokens[4] == "goto":
-				print("Error on line "+str(line)+": if statement missing not 0 goto clause")
-				print(stmt)
-				exit(-1)
-			# get the L from the statement
-			label_compare = stmt_tokens[5]
-
-			# add var_compare to vars if not exists
-			if not var_compare in vars:
-				vars.append(var_compare)
-			# we don't need to appent label_compare, bc there is no guarantee
-			# that label_compare is real (if it is undeclared we will rename it to E later)
-		elif first == "skip":
-			# skip is always 'naked'
-			# make sure no other tokens exist
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(line)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-		elif first == "exit":
-			# this isnt part of the formal grammar
-			# but i will use it when compiling to just be a straight-up termination
-			# statement.
-			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
-				print("Error on line "+str(line)+": Too many tokens")
-				print(stmt)
-				exit(-1)
-		else:
-			# possible that the token matches a macro
-			# we need to check if first contains a macro prefix
-			if first not in macros:
-				print("Error on line "+str(line)+": Unmatched initial token")
-				print(stmt)
-				exit(-1)
-			else:
-				# we want to validate the right argument count is going to the macro
-				# this is imperfect at this step bc we don't have a full label/variable list.
-				# so we just check the arg count is equal to var_count+label_count
-				arg_count = macros[first]['label_count'] + macros[first]['var_count']
-				has_macro = True
-				if len(stmt_tokens) > (1+arg_count) and stmt_tokens[1+arg_count].strip() != ";":
-					print("Error on line "+str(line)+": Too many tokens")
-					print(stmt)
-					exit(-1)
-		line += 1
-	if debug:
-		print("Program passed syntax check")
-		print("Vars: " + str(vars))
-		print("Labels: " + str(labels))
-		print("Has macro: " + str(has_macro))
-		print()
-	return (vars, labels, has_macro)
-
-def macro_expansion(program, vars, labels):
-	if debug:
-		print("Expanding macros for program")
-	line = 0
-	label_checker = re.compile(r'\[\_[A-Za-z]+[0-9]*\]$')
-	label_checker_notmacro = re.compile(r'\[[A-Za-z]+[0-9]*\]$')
-	inc_checker = re.compile(r'\_[A-Za-z]+[0-9]*\+\+$')
-	dec_checker = re.compile(r'\_[A-Za-z]+[0-9]*\-\-$')
-	# iterate over all the statements in the program
-	while True:
-		var_repl = {}
-		lab_repl = {}
-		stmt = program[line]
-		# tokenize the statement
-		stmt_tokens = stmt.split(' ')
-		stmt_tokens = [token for token in stmt_tokens if token.strip() != ""]
-		# start with the first token in the list.
-		first = stmt_tokens[0]
-		# check for leading labels on the line
-		has_fl_prefix = False
-		if label_checker_notmacro.match(first):
-			# we need to confirm this label is not already in labels.
-			if not first[1:-1] in labels:
-				labels.append(first[1:-1])
-			stmt_tokens = stmt_tokens[1:]
-			has_fl_prefix = True
-			fl_prefix = first
-			first = stmt_tokens[0]
-		# we only care about tokens for macros
-		if first in macros:
-			# if a macro exists we need to define a label for the line immediately following the macro.
-			# this is because any macro calling 'goto E' should jump to next line instead of terminating.
-			# so first we will gen a new label name, and then replace any E with that label name
-			# within the macro.
-			# construct a new variable name not already in labels
-			new_name_suf = 0
-			new_name = "L" + str(new_name_suf)
-			while new_name in labels:
-				new_name_suf += 1
-				new_name = "L" + str(new_name_suf)
-			labels.append(new_name)
-			exit_name = new_name
-			if debug:
-				program.insert(line+1, "[" + exit_name + "] skip ; end of macro " + macros[first]['name'])
-			else:
-				program.insert(line+1, "[" + exit_name + "] skip")
-			# this gets the macro in use
-			macro = macros[first]
-			# get the number of input variables/labels from the line
-			varct = macro['var_count']
-			labct = macro['label_count']
-			in_vars = []
-			in_labs = []
-			# iterate over each input token and map it to one of each
-			for token in stmt_tokens[1:]:
-				if token in vars:
-					varct -= 1
-					in_vars.append(token)
-				elif token in labels:
-					labct -= 1
-					in_labs.append(token)
-				elif token == ";":
-					# this marks end bc rest of statement is a comment
-					break
-				else:
-					# we have to assume any other input token is a new, previously undefined variable
-					# and add it to vars.
-					vars.append(token)
-					in_vars.append(token)
-					varct -= 1
-			if not varct == 0 or not labct == 0:
-				print("Macro expansion error, input tokens do not match required count of variables or labels")
-				print(stmt_tokens)
-				print("Line " + str(line+1))
-				exit(-1)
-			# need to replace placeholder labels, variables with real ones
-			# first - replace the _V*, _L* because these are the ones which were input to the program
-			varct = macro['var_count']
-			labct = macro['label_count']
-			while varct != 0:
-				name = "_V" + str(varct)
-				repl = in_vars.pop(len(in_vars) - 1)
-				var_repl[name] = repl
-				varct -= 1
-			while labct != 0:
-				name = "_L" + str(labct)
-				repl = in_labs.pop(len(in_labs) - 1)
-				lab_repl[name] = repl
-				labct -= 1
-			# iterate over lines in macro['code'] to do the replacement
-			mc_code = macro['code'].copy()
-			lmc = 0
-			for c in mc_code:
-				has_prefix = False
-				# we need to tokenize this, again, because a find+replace doesnt work well (annoying)
-				mc_tokens = c.split(" ")
-				mc_tokens = [token for token in mc_tokens if token.strip() != ""]
-				# check the input... we care about V++, V--, if-goto statements
-				first = mc_tokens[0]
-				# if it's [L] we should extract the label and discard.
-				if label_checker.match(first):
-					# if it's the first line of the macro AND there's an fl prefix
-					if lmc == 0 and has_fl_prefix:
-						lb = first[1:-1]
-						if lb.startswith('_label'):
-							lab_repl[lb] = fl_prefix[1:-1]
-							del mc_tokens[0]
-							first = mc_tokens[0]
-							mc_code[lmc] = " ".join(mc_tokens)
-					# we need to confirm this label is not already in labels.
-					if not first[1:-1] in labels:
-						# now we want to check if this label needs replacing
-						lb = first[1:-1]
-						if not lb in lab_repl and lb.startswith('_label'):
-							# construct a new variable name not already in labels
-							new_name_suf = 0
-							new_name = "L" + str(new_name_suf)
-							while new_name in labels:
-								new_name_suf += 1
-								new_name = "L" + str(new_name_suf)
-							labels.append(new_name)
-							lab_repl[lb] = new_name
-							# now replace the line with the new case
-							label_prefix = "[" + lab_repl[lb] + "] "
-							has_prefix = True
-							del mc_tokens[0]
-							first = mc_tokens[0]
-							mc_code[lmc] = " ".join(mc_tokens)
-						elif lb in lab_repl and lb.startswith('_label'):
-							# now replace the line with the new case
-							label_prefix = "[" + lab_repl[lb] + "] "
-							has_prefix = True
-							del mc_tokens[0]
-							first = mc_tokens[0]
-							mc_code[lmc] = " ".join(mc_tokens)
-					else:
-						print("Error in macro expansion: Repeated label")
-						print(stmt)
-						exit(-1)
-				if inc_checker.match(first):
-					# match an increment operation, V++.
-					# make sure no other tokens exist after first.
-					if len(mc_tokens) > 1 and mc_tokens[1].strip() != ";":
-						print("Error in macro expansion: Too many tokens")
-						print(c)
-						exit(-1)
-					# grab the variable name
-					var = first.replace("++", "")
-					# replace if needed
-					if var in var_repl:
-						mc_code[lmc] = var_repl[var] + "++"
-					# check if the variable starts with _var
-					# (implicitly it won't be in var_repl due to previous if)
-					elif var.startswith('_var'):
-						# construct a new variable name not already in vars
-						new_name_suf = 0
-						new_name = "V" + str(new_name_suf)
-						while new_name in vars:
-							new_name_suf += 1
-							new_name = "V" + str(new_name_suf)
-						vars.append(new_name)
-						var_repl[var] = new_name
-						mc_code[lmc] = var_repl[var] + "++"
-				elif dec_checker.match(first):
-					# match an increment operation, V++.
-					# make sure no other tokens exist after first.
-					if len(mc_tokens) > 1 and mc_tokens[1].strip() != ";":
-						print("Error in macro expansion: Too many tokens")
-						print(c)
-						exit(-1)
-					# grab the variable name
-					var = first.replace("--", "")
-					# replace if needed
-					if var in var_repl:
-						mc_code[lmc] = var_repl[var] + "--"
-					# check if the variable starts with _var
-					# (implicitly it won't be in var_repl due to previous if)
-					elif var.startswith('_var'):
-						# construct a new variable name not already in vars
-						new_name_suf = 0
-						new_name = "V" + str(new_name_suf)
-						while new_name in vars:
-							new_name_suf += 1
-							new_name = "V" + str(new_name_suf)
-						vars.append(new_name)
-						var_repl[var] = new_name
-						mc_code[lmc] = var_repl[var] + "--"
-				elif first.startswith("if"):
-					# if statement (conditional branch) has a very specific structure.
-					# if V not 0 goto L
-					# check remaining tokens... structure is very firm so we don't need to 
-					# be too concerned about looping over the tokens, just check the
-					# exact matching structure.
-					# check for wrong count of tokens
-					if len(mc_tokens) < 6:
-						print("Error in macro expansion: Not enough tokens")
-						print(c)
-						exit(-1)
-					# check for too many tokens (not in a comment)
-					if len(mc_tokens) > 6 and mc_tokens[6].strip() != ";":
-						print("Error in macro expansion: Too many tokens")
-						print(c)
-						exit(-1)
-					# get the V from the statement
-					var_compare = mc_tokens[1]
-					# check for bad setup of the rest of the statement
-					if not mc_tokens[2] == "not" or not mc_tokens[3] == "0" or not mc_tokens[4] == "goto":
-						print("Error in macro expansion: if statement missing not 0 goto clause")
-						print(c)
-						exit(-1)
-					# get the L from the statement
-					label_compare = mc_tokens[5]
-					if label_compare == "E":
-						label_compare = exit_name
-
-					if var_compare not in var_repl and var_compare.startswith("_var"):
-						# construct a new variable name not already in vars
-						new_name_suf = 0
-						new_name = "V" + str(new_name_suf)
-						while new_name in vars:
-							new_name_suf += 1
-							new_name = "V" + str(new_name_suf)
-						vars.append(new_name)
-						var_repl[var_compare] = new_name
-
-					if label_compare not in lab_repl and label_compare.startswith("_label"):
-						# construct a new variable name not already in labels
-						new_name_suf = 0
-						new_name = "L" + str(new_name_suf)
-						while new_name in labels:
-							new_name_suf += 1
-							new_name = "L" + str(new_name_suf)
-						labels.append(new_name)
-						lab_repl[label_compare] = new_name
-
-
-					# we need to check if either V or L needs replacing.
-					if var_compare in var_repl and label_compare in lab_repl:
-						mc_code[lmc] = "if " + var_repl[var_compare] + " not 0 goto " + lab_repl[label_compare]
-					elif var_compare in var_repl:
-						mc_code[lmc] = "if " + var_repl[var_compare] + " not 0 goto " + label_compare
-					elif label_compare in lab_repl:
-						mc_code[lmc] = "if " + var_compare + " not 0 goto " + lab_repl[label_compare]
-				elif first in macros:
-					tk = 1
-					had_e = False
-					for next_token in mc_tokens[1:]:
-						if next_token == "E":
-							had_e = True
-							mc_tokens[tk] = exit_name
-						if next_token.startswith("_L") or next_token.startswith("_label"):
-							if next_token in lab_repl:
-								mc_tokens[tk] = lab_repl[next_token]
-							else:
-								# construct a new variable name not already in labels
-								new_name_suf = 0
-								new_name = "L" + str(new_name_suf)
-								while new_name in labels:
-									new_name_suf += 1
-									new_name = "L" + str(new_name_suf)
-								labels.append(new_name)
-								lab_repl[next_token] = new_name
-								mc_tokens[tk] = lab_repl[next_token]
-						if next_token.startswith("_V") or next_token.startswith("_var"):
-							if next_token in var_repl:
-								mc_tokens[tk] = var_repl[next_token]
-							else:
-								# construct a new variable name not already in labels
-								new_name_suf = 0
-								new_name = "V" + str(new_name_suf)
-								while new_name in vars:
-									new_name_suf += 1
-									new_name = "V" + str(new_name_suf)
-								vars.append(new_name)
-								var_repl[next_token] = new_name
-								mc_tokens[tk] = var_repl[next_token]
-						tk += 1
-					mc_code[lmc] = " ".join(mc_tokens)
-				if has_prefix:
-					mc_code[lmc] = label_prefix + mc_code[lmc]
-				if lmc == 0 and debug:
-					mc_code[lmc] = mc_code[lmc] + " ; start of macro " + macro['name'] + " (" + stmt + ")"
-				if lmc == 0 and has_fl_prefix:
-					mc_code[lmc] = fl_prefix + " " + mc_code[lmc]
-				lmc += 1
-			# remove the original line from the program
-			program.pop(line)
-			# insert the new code from the macro
-			for c in mc_code:
-				program.insert(line, c)
-				line += 1
-			# this is some manip to keep the line counter working...
-			line -= 1
-		line += 1
-		# break when whole program has been de-macroed
-		if line >= len(program):
-			break
-	if debug:
-		print("Macro expansion completed")
-		print()
-
-# replaces all instances of labels with their actual line number
-# so that all goto statements point to a specific line.
-def label_replacement(program):
-	if debug:
-		print ("Performing label replacement")
-	label_map = {}
-	label_checker = re.compile(r'\[[A-Za-z]+[0-9]*\]$')
-	line = 1
-	# iterate over each statement and find label definitions
-	for stmt in program:
-		# tokenize the statement
-		stmt_tokens = stmt.split(' ')
-		# start with the first token in the list.
-		first = stmt_tokens[0]
-		# if it's [L] we should extract the label.
-		if label_checker.match(first):
-			label = first[1:-1]
-			# now we want to map the label to the current line.
-			label_map[label] = line-1
-			program[line-1] = stmt[len(first)+1:]
-		line += 1
-	# now replace any uses of the label with the line number
-	line = 1
-	for stmt in program:
-		# tokenize the statement
-		stmt_tokens = stmt.split(' ')
-		# start with the first token in the list.
-		first = stmt_tokens[0]
-		# we only care about if-goto statements for label replacement
-		if first == "if":
-			# note that the label may or may not exist, if it doesn't exist we need to replace it with E
-			# (since non-existent labels terminate)
-			if not stmt_tokens[5] in label_map:
-				stmt_tokens[5] = 'E'
-			# we already validated the syntax so just grab stmt_tokens[5]
-			stmt_tokens[5] = str(label_map[stmt_tokens[5]])
-			program[line-1] = " ".join(stmt_tokens)
-		line += 1
-	if debug:
-		print("Label replacement completed")
-		print("Label mapping: " + str(label_map))
-	return program
-
-# the label E is used as a special label, which indicates the program should terminate.
-# this label doesn't exist so we just need to add it to the end.
-# fortunately this is simple, we just add one line to the very end of the program,
-# "exit"
-def e_insertion(program):
-	if debug:
-		print("Adding E label")
-	program.append("[E] exit")
-	if debug:
-		print("E label added")
-		print()
-	return program
-
-def collect_directives(program):
-	if debug:
-		print("Finding % directives")
-	dirs = []
-	line = 0
-	stmt = program[line]
-	while stmt.startswith("%"):
-		if debug:
-			print ("Found directive " + stmt)
-		dirs.append(stmt)
-		line += 1
-		stmt = program[line]
-	if debug:
-		print("Finished finding % directives")
-	return (line, dirs)
-
-# performs compilation on an input file
-def precompile(file):
-	program = []
-	global debug
-	global debug_extreme
-	if '-debug' in sys.argv:
-		debug = True
-	if '-debugx' in sys.argv:
-		debug = True
-		debug_extreme = True
-
-	folders_to_link = ['stdlib']
-
-	# check for -link arguments
-	for i in range(len(sys.argv)):
-		arg = sys.argv[i]
-		if arg == '-link' and len(sys.argv) != (i+1):
-			nextarg = sys.argv[i+1]
-			folders_to_link.append(nextarg)
-
-	print ("Compiling G-program from source file " + file)
-	# open the input file
-	with open(file) as f:
-		# load all lines into program
-		program = f.readlines()
-		# replace all newlines with blank and trim
-		# I also do a replacement from ';' -> ' ; ' to avoid difficulty tokenizing comments
-		program = [l.replace('\n', '').replace(';', ' ; ').strip() for l in program]
-		# remove any blank lines
-		program = [l for l in program if l is not ""]
-		# remove any lines starting with ;
-		# to not have to tokenize
-		program = [l for l in program if not l.startswith(';')]
-
-		# collect %directives
-		# these are passed directly from the .gc to the .g
-		# so you can specify e.g. %specvar directives
-		# and have them copied through to the compiled code
-		(line, dirs) = collect_directives(program)
-		program = program[line:]
-
-		# 0. perform macro loading by scanning folders.
-		# all folders in the macro subdirectory are 'packages' of macros.
-		# the stdlib folder is loaded by default as it contains a lot of generally useful macros.
-		# any other folders currently are not loaded but we will implement %directives for this.
-		macro_loading(folders_to_link)
-		macro_requirement_checking()
-
-		# 0b. E insertion
-		program = e_insertion(program)
-
-		# 1. syntax evaluation and 2. identify var/label list
-		(vars, labels, has_macro) = syntax_check(program)
-
-		x = 1
-
-		# we need to call this continually so long as more macros exist to expand.
-		while has_macro:
-			# 3. macro expansion
-			# essentially we need to scan lines in program again,
-			# identify which lines use a macro, and then insert the
-			# macro code into those lines.
-			macro_expansion(program, vars, labels)
-
-			# output to .g file
-			noext = file.split('.')[0]
-			if debug_extreme:
-				with open(noext + ".g" + str(x), "w+") as f2:
-					f2.write("\n".join(program))
-
-			# 4. syntax recheck
-			# this is important to make sure the macros expanded out properly,
-			# to check if more macros need to be expanded,
-			# and to recompute var/label lists
-			(v, l, has_macro) = syntax_check(program)
-
-			x += 1
-
-		# 5. label replacement
-		program = label_replacement(program)
-		# final processing - add variable list to the header
-		program.insert(0, "%vars " + ",".join(vars))
-		# add remaining %dirs to the file
-		program.insert(1, "\n".join(dirs) + "\n")
-		# output to .g file
-		noext = file.split('.')[0]
-		with open(noext + ".g", "w+") as f2:
-			f2.write("\n".join(program))
-			print("Wrote compiled code to " + noext + ".g")
-
-if __name__ == '__main__':
-	if len(sys.argv) < 2:
-		print("Please provide at least 1 argument, the path to a G source file, and optionally additional -flags after this.")
-		exit(-1)
-	precompile(sys.argv[1])
\ No newline at end of file
+import contextlib
+import copy
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import re
+import os
+import sys
+import time
+import tracemalloc
+
+import goptimize
+import gruntime
+
+# main steps for compilation:
+# 1. syntax evaluation, macro loading
+# 2. identify list of used variables and labels
+# 3. macro expansion
+# 4. label replacement
+# 5. E insertion
+# outputs code that can be run
+
+macros = {}
+debug = False
+debug_extreme = False
+# when set, calls to stdlib macros the runtime knows natively (gruntime.intrinsics)
+# are left in the compiled code instead of being expanded.
+use_intrinsics = False
+# when set, the expanded program goes through goptimize before label replacement
+optimize = False
+# when set, unreachable code and unused writes are removed and %vars is pruned
+eliminate_dead = False
+# prefixes of the macros used by the program being compiled (for the build manifest)
+used_macros = set()
+# when set, a source map (.gmap) is written next to the .g file
+source_map = False
+# when set, each macro is compiled once as a subroutine which the program calls,
+# instead of being expanded at every call (see link_shared)
+shared = False
+# where each line of the last compiled program came from, as (statement, macro stack),
+# statement being the number of the statement of the source program (from 1) and
+# the stack the prefixes of the macros it was expanded from, outermost first.
+# only filled in when source_map is set.
+line_origins = []
+# how long each phase of the last compile took, in seconds (phase -> time)
+phase_times = {}
+# when set (-stats), the compile also keeps the statistics below and reports them
+collect_stats = False
+# where to write the statistics as json (-stats-json FILE)
+stats_json = None
+# the peak memory python allocated in each phase of the last compile, in kilobytes
+phase_memory = {}
+# set while the compile is run again to measure phase_memory (see measure_memory)
+trace_memory = False
+# how long loading the macros took and the peak memory it allocated
+load_stats = {}
+# for each macro, by prefix, in the last compile: how many times it was expanded, the
+# lines its own code ended up as (not counting the macros it calls), and how many
+# fresh variables and labels its expansions made up
+macro_stats = {}
+# for each level of nesting in the last compile, [calls expanded, lines], level 0 being
+# the program's own calls and lines. these are the steps of the -debugx dumps.
+depth_stats = []
+# the folder the macro libraries are in
+macro_root = 'macro'
+
+# handles the %prefix macro
+# the minimum definition of a macro has a
+# %prefix directive to indicate how it's supposed to be used.
+# e.g. %prefix zero
+def macro_prefix(mc_struct, l):
+	if debug:
+		print("Handle macro prefix for macro " + mc_struct['name'])
+	mc_def = l.split(" ")
+	if not len(mc_def) == 2:
+		print("Macro compilation error, macro " + mc_struct['name'] + " has incorrect argument count for prefix directive")
+		exit(-1)
+	# get the prefix
+	pref = mc_def[1]
+	# store the prefix into mc_struct
+	mc_struct['prefix'] = pref
+	if debug:
+		print("Prefix " + pref + " assigned")
+		print()
+
+# handles the %input macro
+# e.g. %input 1 variable 1 label
+def macro_input(mc_struct, l):
+	if debug:
+		print("Handle macro input for macro " + mc_struct['name'])
+	mc_def = l.split(" ")
+	if not len(mc_def) == 5:
+		print("Macro compilation error, macro " + mc_struct['name'] + " has incorrect argument count for input directive")
+		exit(-1)
+	# check the right values are being passed
+	if not mc_def[1].isdigit() or not mc_def[3].isdigit():
+		print("Macro compilation error, macro " + mc_struct['name'] + " does not provide integer values for input directive")
+		exit(-1)
+	# get the number of variables and labels
+	var_count = int(mc_def[1])
+	label_count = int(mc_def[3])
+	if var_count < 0 or label_count < 0:
+		print("Macro compilation error, macro " + mc_struct['name'] + " defines negative label or variable counts")
+		exit(-1)
+	# put it into mc_struct
+	mc_struct['var_count'] = var_count
+	mc_struct['label_count'] = label_count
+	if debug:
+		print(str(var_count) + " in vars assigned for macro")
+		print(str(label_count) + " in labels assigned for macro")
+		print()
+
+def macro_require(mc_struct, l):
+	if debug:
+		print("Handle macro require for macro " + mc_struct['name'])
+	mc_def = l.split(" ")
+	if not len(mc_def) == 2:
+		print("Macro compilation error, macro " + mc_struct['name'] + " has incorrect argument count for require directive")
+		exit(-1)
+	prefreq = mc_def[1]
+	if not 'requires' in mc_struct:
+		mc_struct['requires'] = [prefreq]
+	else:
+		mc_struct['requires'].append(prefreq)
+	if debug:
+		print("Added macro requirement " + prefreq)
+
+# matchers for the lines of macro code
+mc_label_checker = re.compile(r'\[\_label[0-9]*\]$')
+mc_var_checker = re.compile(r'\_?[A-Za-z]+[0-9]*$')
+
+# works out what kind of placeholder a token in macro code is.
+# _V* and _L* are the inputs, _var* and _label* are made up fresh for each call,
+# E is the line after the call, anything else is used as it is.
+def placeholder(token):
+	if token == "E":
+		return "E"
+	for kind in ["_var", "_V", "_label", "_L"]:
+		if token.startswith(kind):
+			return kind
+	return ""
+
+# parses the code lines of a macro into a template, so expanding a call to it
+# doesn't need to tokenize or check anything again.
+# each line of the template is [label, op, word, args] where
+# - label is the _label* on the line, or None
+# - op is one of inc, dec, if, call, stmt
+# - word is ++ or -- for inc/dec, the prefix for a call, or the statement (skip, exit)
+# - args is a list of [placeholder kind, token] for the operands
+def macro_template(mc_struct, mc):
+	template = []
+	for c in mc:
+		mc_tokens = c.split(" ")
+		mc_tokens = [token for token in mc_tokens if token.strip() != ""]
+		# comments are dropped here
+		if ";" in mc_tokens:
+			mc_tokens = mc_tokens[:mc_tokens.index(";")]
+		label = None
+		if mc_tokens[0].startswith("["):
+			if not mc_label_checker.match(mc_tokens[0]):
+				print("Macro compilation error, macro " + mc_struct['name'] + " uses a label which is not _label*")
+				print(c)
+				exit(-1)
+			label = mc_tokens[0][1:-1]
+			mc_tokens = mc_tokens[1:]
+			if len(mc_tokens) == 0:
+				print("Macro compilation error, macro " + mc_struct['name'] + " has a label with no statement")
+				print(c)
+				exit(-1)
+		first = mc_tokens[0]
+		if (first.endswith("++") or first.endswith("--")) and mc_var_checker.match(first[:-2]):
+			# V++ or V--
+			if len(mc_tokens) > 1:
+				print("Macro compilation error, macro " + mc_struct['name'] + " has too many tokens on a line")
+				print(c)
+				exit(-1)
+			var = first[:-2]
+			line = [label, "inc" if first.endswith("++") else "dec", first[-2:], [[placeholder(var), var]]]
+		elif first == "if":
+			# if V not 0 goto L
+			if len(mc_tokens) != 6 or not mc_tokens[2] == "not" or not mc_tokens[3] == "0" or not mc_tokens[4] == "goto":
+				print("Macro compilation error, macro " + mc_struct['name'] + " has a badly formed if statement")
+				print(c)
+				exit(-1)
+			line = [label, "if", "if", [[placeholder(mc_tokens[1]), mc_tokens[1]], [placeholder(mc_tokens[5]), mc_tokens[5]]]]
+		elif first == "skip" or first == "exit":
+			if len(mc_tokens) > 1:
+				print("Macro compilation error, macro " + mc_struct['name'] + " has too many tokens on a line")
+				print(c)
+				exit(-1)
+			line = [label, "stmt", first, []]
+		else:
+			# anything else is a call to another macro.
+			# (whether that macro exists is only known once everything is loaded)
+			line = [label, "call", first, [[placeholder(token), token] for token in mc_tokens[1:]]]
+		# the inputs have to be ones the macro actually takes
+		for (kind, token) in line[3]:
+			if kind == "_V" or kind == "_L":
+				count = mc_struct['var_count'] if kind == "_V" else mc_struct['label_count']
+				if not token[2:].isdigit() or int(token[2:]) < 1 or int(token[2:]) > count:
+					print("Macro compilation error, macro " + mc_struct['name'] + " uses input " + token + " which it does not take")
+					print(c)
+					exit(-1)
+		template.append(line)
+	return template
+
+# parses one .gmacro file (given as its text) into a mc_struct
+def parse_macro(filename, folder, text):
+	if debug:
+		print ("Start processing macro " + filename.replace(".gmacro", ""))
+	mc = text.split("\n")
+	mc = [l.replace('\r', '').replace(';', ' ; ').strip() for l in mc]
+	# remove any blank lines
+	mc = [l for l in mc if l != ""]
+	# remove any lines starting with ;
+	# to not have to tokenize
+	mc = [l for l in mc if not l.startswith(';')]
+	# now we process % directives
+	# some will be processed but the rest will be ignored
+	mc_struct = {'name': filename.replace('.gmacro', ''), 'library': folder, 'requires': [], 'label_count': 0, 'var_count': 0}
+	line = 0
+	while line < len(mc) and mc[line].startswith("%"):
+		l = mc[line]
+		if l.startswith("%input"):
+			macro_input(mc_struct, l)
+		elif l.startswith("%prefix"):
+			macro_prefix(mc_struct, l)
+		elif l.startswith("%require"):
+			macro_require(mc_struct, l)
+		line += 1
+	# this cuts off all the % directives
+	mc = mc[line:]
+	# confirm that the macro contained at a minimum the %prefix directive
+	if not 'prefix' in mc_struct:
+		print("Macro compilation error, macro " + mc_struct['name'] + " does not define a prefix operator")
+		exit(-1)
+	# store code into mc_struct, both as it was written and parsed
+	mc_struct['code'] = mc
+	mc_struct['template'] = macro_template(mc_struct, mc)
+	if debug:
+		print("Finish processing macro")
+		print()
+	return mc_struct
+
+# parsed macros are cached in each library folder so they are only parsed again
+# when a .gmacro file changes.
+# the cache has an entry per file with its mtime, size and hash.
+# bump this whenever the parsed format changes so old caches get thrown away.
+macro_cache_version = 1
+macro_cache_name = '.gmcache'
+
+def load_macro_cache(folder_path):
+	try:
+		with open(os.path.join(folder_path, macro_cache_name)) as f:
+			cache = json.load(f)
+	except (OSError, ValueError):
+		return {}
+	if cache.get('version') != macro_cache_version:
+		return {}
+	return cache['macros']
+
+def save_macro_cache(folder_path, cache):
+	# the cache is only an optimization, so if it can't be written just carry on
+	try:
+		with open(os.path.join(folder_path, macro_cache_name), "w") as f:
+			json.dump({'version': macro_cache_version, 'macros': cache}, f)
+	except OSError:
+		if debug:
+			print("Could not write macro cache for " + folder_path)
+
+def macro_loading(macro_folders):
+	if debug:
+		print("Start processing macros")
+	global macros
+	for folder in macro_folders:
+		if debug:
+			print("Start processing macros from library " + folder)
+		folder_path = os.path.join(macro_root, folder)
+		if not os.path.exists(folder_path):
+			print("No macro folder found for linked folder " + folder + ", skipping")
+			continue
+		cache = load_macro_cache(folder_path)
+		changed = False
+		found = set()
+		for filename in os.listdir(folder_path):
+			if filename.endswith('.gmacro'):
+				found.add(filename)
+				path = os.path.join(folder_path, filename)
+				stat = os.stat(path)
+				entry = cache.get(filename)
+				if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+					if debug:
+						print("Using cached macro " + filename.replace(".gmacro", ""))
+					mc_struct = entry['macro']
+				else:
+					with open(path, 'rb') as macro:
+						data = macro.read()
+					digest = hashlib.sha1(data).hexdigest()
+					if entry and entry['hash'] == digest:
+						# touched but not changed
+						mc_struct = entry['macro']
+					else:
+						mc_struct = parse_macro(filename, folder, data.decode())
+					cache[filename] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': digest, 'macro': mc_struct}
+					changed = True
+				mc_struct['hash'] = cache[filename]['hash']
+				# check if the prefix has already been used
+				pref = mc_struct['prefix']
+				if pref in macros:
+					print("Macro compilation error, macro " + mc_struct['name'] + " duplicates prefix with " + macros[pref]['name'])
+					exit(-1)
+				# and push the struct into macros
+				macros[pref] = mc_struct
+		# forget macro files which have been removed
+		for filename in list(cache):
+			if not filename in found:
+				del cache[filename]
+				changed = True
+		if changed:
+			save_macro_cache(folder_path, cache)
+	if debug:
+		print("All macros finished processing")
+		print("Macro definitions: " + str(macros))
+		print()
+
+# checks that all macros have their requirements met.
+# will unload any macros with a missing requirement.
+def macro_requirement_checking():
+	global macros
+	if debug:
+		print("Checking macro requirements")
+	should_unload = []
+	for m in macros:
+		macro = macros[m]
+		reqs = macro['requires']
+		for req in reqs:
+			if not req in macros:
+				if debug:
+					print("Macro " + macro['name'] + " is missing requirement " + req)
+					print("Unloading")
+				should_unload.append(m)
+				break
+	for m in should_unload:
+		del macros[m]
+	if debug:
+		print("Macro requirements checked")
+
+# symbol table for the variables or labels of a program.
+# this is an ordered set of names (so %vars comes out in a deterministic order),
+# optionally with a value for each name (e.g. the line a label is on),
+# plus a counter for making fresh names like V0, V1, ...
+# the counter only moves forward, names are never removed, so every name below
+# the counter is already taken and a fresh name never has to rescan from 0.
+class SymbolTable:
+	def __init__(self, prefix, names=[]):
+		self.prefix = prefix
+		self.names = {}
+		self.counter = 0
+		# names which are used without being defined, which fresh mustn't hand out
+		self.reserved = set()
+		for name in names:
+			self.add(name)
+
+	def add(self, name, value=None):
+		self.names[name] = value
+
+	def reserve(self, name):
+		self.reserved.add(name)
+
+	def fresh(self):
+		while self.prefix + str(self.counter) in self.names or self.prefix + str(self.counter) in self.reserved:
+			self.counter += 1
+		name = self.prefix + str(self.counter)
+		self.add(name)
+		self.counter += 1
+		return name
+
+	def __contains__(self, name):
+		return name in self.names
+
+	def __getitem__(self, name):
+		return self.names[name]
+
+	def __iter__(self):
+		return iter(self.names)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __str__(self):
+		return str(list(self.names))
+
+# checks if a macro call should be left for the runtime to do natively.
+# only the stdlib macros are, since those are the ones the runtime knows the meaning of.
+def is_intrinsic(prefix):
+	if not use_intrinsics or not prefix in gruntime.intrinsics or not prefix in macros:
+		return False
+	return macros[prefix]['library'] == 'stdlib'
+
+# checks syntax on an input program (list of statements)
+# it will also produce a list of variables and labels used in the program
+# and return a tuple (vars, labels).
+def syntax_check(program):
+	if debug:
+		print("syntax checking program")
+	# symbol tables of vars, labels
+	vars = SymbolTable('V', ['Y'])
+	labels = SymbolTable('L')
+	# line count
+	line = 1
+	# this is used to continually re-load/re-check until all macros are expanded
+	# this allows macros to use other macros themselves.
+	has_macro = False
+	# possible stmt in a program:
+	# V++
+	# V--
+	# if V not 0 goto L
+	# skip
+	# any content after a semicolon ; should be ignored
+	# any statement can have a [L] before it to indicate a label
+	# due to the above 2 requirements we must tokenize
+	label_checker = re.compile(r'\[[A-Za-z]+[0-9]*\]$')
+	inc_checker = re.compile(r'[A-Za-z]+[0-9]*\+\+$')
+	dec_checker = re.compile(r'[A-Za-z]+[0-9]*\-\-$')
+	for stmt in program:
+		# tokenize the statement
+		stmt_tokens = stmt.split(' ')
+		stmt_tokens = [token for token in stmt_tokens if token.strip() != ""]
+		# start with the first token in the list.
+		first = stmt_tokens[0]
+		# if it's [L] we should extract the label and discard.
+		if label_checker.match(first):
+			# we need to confirm this label is not already in labels.
+			if not first[1:-1] in labels:
+				labels.add(first[1:-1])
+			else:
+				print("Error on line "+str(line)+": Repeated label")
+				print(stmt)
+				exit(-1)
+			stmt_tokens = stmt_tokens[1:]
+			first = stmt_tokens[0]
+		if inc_checker.match(first):
+			# match an increment operation, V++.
+			# make sure no other tokens exist after first.
+			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
+				print("Error on line "+str(line)+": Too many tokens")
+				print(stmt)
+				exit(-1)
+			# grab the variable name
+			var = first.replace("++", "")
+			# add it to the list
+			if not var in vars:
+				vars.add(var)
+		elif dec_checker.match(first):
+			# match a decrement operation, V--.
+			# make sure no other tokens exist after first.
+			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
+				print("Error on line "+str(line)+": Too many tokens")
+				print(stmt)
+				exit(-1)
+			# grab the variable name
+			var = first.replace("--", "")
+			# add it to the list
+			if not var in vars:
+				vars.add(var)
+		elif first == "if":
+			# if statement (conditional branch) has a very specific structure.
+			# if V not 0 goto L
+			# check remaining tokens... structure is very firm so we don't need to 
+			# be too concerned about looping over the tokens, just check the
+			# exact matching structure.
+			# check for wrong count of tokens
+			if len(stmt_tokens) < 6:
+				print("Error on line "+str(line)+": Not enough tokens")
+				print(stmt)
+				exit(-1)
+			# check for too many tokens (not in a comment)
+			if len(stmt_tokens) > 6 and stmt_tokens[6].strip() != ";":
+				print("Error on line "+str(line)+": Too many tokens")
+				print(stmt)
+				exit(-1)
+			# get the V from the statement
+			var_compare = stmt_tokens[1]
+			# check for bad setup of the rest of the statement
+			if not stmt_tokens[2] == "not" or not stmt_tokens[3] == "0" or not stmt_tokens[4] == "goto":
+				print("Error on line "+str(line)+": if statement missing not 0 goto clause")
+				print(stmt)
+				exit(-1)
+			# get the L from the statement
+			label_compare = stmt_tokens[5]
+
+			# add var_compare to vars if not exists
+			if not var_compare in vars:
+				vars.add(var_compare)
+			# we don't need to appent label_compare, bc there is no guarantee
+			# that label_compare is real (if it is undeclared we will rename it to E later)
+			# but a label made up for a macro mustn't take its name, or the jump would go there
+			labels.reserve(label_compare)
+		elif first == "skip":
+			# skip is always 'naked'
+			# make sure no other tokens exist
+			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
+				print("Error on line "+str(line)+": Too many tokens")
+				print(stmt)
+				exit(-1)
+		elif first == "exit":
+			# this isnt part of the formal grammar
+			# but i will use it when compiling to just be a straight-up termination
+			# statement.
+			if len(stmt_tokens) > 1 and stmt_tokens[1].strip() != ";":
+				print("Error on line "+str(line)+": Too many tokens")
+				print(stmt)
+				exit(-1)
+		elif is_intrinsic(first):
+			# a macro call which is left for the runtime to do natively.
+			# these take their variables first, then their labels.
+			(var_count, label_count) = gruntime.intrinsics[first]
+			used_macros.add(first)
+			if len(stmt_tokens) < 1+var_count+label_count:
+				print("Error on line "+str(line)+": Not enough tokens")
+				print(stmt)
+				exit(-1)
+			if len(stmt_tokens) > 1+var_count+label_count and stmt_tokens[1+var_count+label_count].strip() != ";":
+				print("Error on line "+str(line)+": Too many tokens")
+				print(stmt)
+				exit(-1)
+			for var in stmt_tokens[1:1+var_count]:
+				if not var in vars:
+					vars.add(var)
+			for label in stmt_tokens[1+var_count:1+var_count+label_count]:
+				labels.reserve(label)
+		else:
+			# possible that the token matches a macro
+			# we need to check if first contains a macro prefix
+			if first not in macros:
+				print("Error on line "+str(line)+": Unmatched initial token")
+				print(stmt)
+				exit(-1)
+			else:
+				# we want to validate the right argument count is going to the macro
+				# this is imperfect at this step bc we don't have a full label/variable list.
+				# so we just check the arg count is equal to var_count+label_count
+				arg_count = macros[first]['label_count'] + macros[first]['var_count']
+				used_macros.add(first)
+				has_macro = True
+				if len(stmt_tokens) > (1+arg_count) and stmt_tokens[1+arg_count].strip() != ";":
+					print("Error on line "+str(line)+": Too many tokens")
+					print(stmt)
+					exit(-1)
+		line += 1
+	if debug:
+		print("Program passed syntax check")
+		print("Vars: " + str(vars))
+		print("Labels: " + str(labels))
+		print("Has macro: " + str(has_macro))
+		print()
+	return (vars, labels, has_macro)
+
+label_checker_notmacro = re.compile(r'\[[A-Za-z]+[0-9]*\]$')
+
+# how many macros deep a call can go before we give up (a macro that ends up calling itself)
+max_nesting = 100
+
+# expands all the macro calls in a program in a single pass.
+# this is a generator over the statements of the expanded program, as lists of tokens.
+# each macro call is expanded recursively right where it is, so nothing is ever
+# inserted into or removed from the program and nothing has to be scanned twice.
+# if max_depth is given, calls nested deeper than that are left as they are
+# (this is how the -debugx dumps get the code at each step of expansion).
+def macro_expansion(program, vars, labels, max_depth=None):
+	if debug:
+		print("Expanding macros for program")
+	line = 1
+	for stmt in program:
+		stmt_tokens = [token for token in stmt.split(' ') if token.strip() != ""]
+		yield from expand_statement(stmt_tokens, line, vars, labels, 0, max_depth, ())
+		line += 1
+	if debug:
+		print("Macro expansion completed")
+		print()
+
+# splits the operands of a call to a macro into its variables and its labels, the way
+# expand_statement does: names already known as labels are labels, anything else is a
+# variable (which is added to vars if it's new). kinds, if given, is the placeholder
+# kind of each operand in a macro's code, which says which it is straight away.
+def call_operands(tokens, vars, labels, kinds=None):
+	in_vars = []
+	in_labs = []
+	for i in range(len(tokens)):
+		token = tokens[i]
+		if token == ";":
+			# this marks end bc rest of statement is a comment
+			break
+		kind = kinds[i] if kinds else ""
+		if kind in ["_L", "_label", "E"] or (kind == "" and token in labels and not token in vars):
+			in_labs.append(token)
+		else:
+			if kind == "" and not token in vars:
+				vars.add(token)
+			in_vars.append(token)
+	return (in_vars, in_labs)
+
+# links the program against its macros as subroutines, for -shared.
+# every call to a macro becomes `call prefix vars... labels...` (the variables first,
+# then the labels, in the order the macro numbers them), and the body of every macro
+# the program uses, directly or from other macros, is put once after the program:
+#   sub prefix var_count label_count
+#   ... the macro's code, with calls to other macros the same way ...
+#   [exit label] ret
+# in a body the macro's own inputs and variables keep their names (_V1, _var2, _L1),
+# which the runtime binds for each call, and its _label*s and E get fresh labels like
+# in an expansion. the runtime gives each call its own _var*s, kept from one time the
+# call is made to the next like an expansion's, and counts the ret as the skip an
+# expansion ends with and the call as nothing, so the results and step counts are the
+# same as expanding everything.
+# the program grows with the number of calls and macros, rather than with every call
+# being expanded over again inside every macro that uses it.
+def link_shared(program, vars, labels):
+	if debug:
+		print("Linking macros as subroutines")
+	linked = []
+	# the macros a macro calls, for finding ones which end up calling themselves
+	calls = {}
+	# where is the line of the program, or the macro, the call is in (for errors)
+	def call(prefix, tokens, kinds, where, stmt):
+		macro = macros[prefix]
+		used_macros.add(prefix)
+		if collect_stats:
+			# (with -stats, the expansions of a linked macro are the calls to it)
+			macro_stat(prefix)['expansions'] += 1
+		if not prefix in calls:
+			calls[prefix] = set()
+			linked.append(prefix)
+		(in_vars, in_labs) = call_operands(tokens, vars, labels, kinds)
+		if len(in_vars) != macro['var_count'] or len(in_labs) != macro['label_count']:
+			print("Macro expansion error, input tokens do not match required count of variables or labels")
+			print(stmt)
+			print(where)
+			exit(-1)
+		return ["call", prefix] + in_vars + in_labs
+	out = []
+	line = 1
+	for stmt in program:
+		stmt_tokens = [token for token in stmt.split(' ') if token.strip() != ""]
+		first = stmt_tokens[0]
+		start = 0
+		if label_checker_notmacro.match(first):
+			first = stmt_tokens[1]
+			start = 1
+		if first in macros:
+			tokens = call(first, stmt_tokens[start+1:], None, "Line " + str(line), stmt_tokens)
+			out.append(" ".join(stmt_tokens[:start] + tokens))
+		else:
+			out.append(stmt)
+		line += 1
+	# the bodies, including those of the macros they call as they turn up
+	i = 0
+	while i < len(linked):
+		prefix = linked[i]
+		macro = macros[prefix]
+		out.append("sub " + prefix + " " + str(macro['var_count']) + " " + str(macro['label_count']))
+		exit_name = labels.fresh()
+		lab_repl = {}
+		def replace(kind, token):
+			if kind == "E":
+				return exit_name
+			if kind == "_label":
+				if not token in lab_repl:
+					lab_repl[token] = labels.fresh()
+				return lab_repl[token]
+			return token
+		for (label, op, word, args) in macro['template']:
+			kinds = [kind for (kind, token) in args]
+			tokens = [replace(kind, token) for (kind, token) in args]
+			if op == "inc" or op == "dec":
+				mc_tokens = [tokens[0] + word]
+			elif op == "if":
+				mc_tokens = ["if", tokens[0], "not", "0", "goto", tokens[1]]
+			elif op == "call":
+				if not word in macros:
+					print("Macro expansion error, macro " + macro['name'] + " calls " + word + " which is not loaded")
+					exit(-1)
+				calls[prefix].add(word)
+				mc_tokens = call(word, tokens, kinds, "In macro " + macro['name'], [word] + tokens)
+			else:
+				mc_tokens = [word]
+			# the variables a macro uses by name are the program's
+			if op in ["inc", "dec", "if"] and kinds[0] == "" and not tokens[0] in vars:
+				vars.add(tokens[0])
+			if label:
+				mc_tokens = ["[" + replace("_label", label) + "]"] + mc_tokens
+			out.append(" ".join(mc_tokens))
+		out.append("[" + exit_name + "] ret")
+		if collect_stats:
+			macro_stat(prefix)['lines'] += len(macro['template']) + 1
+			macro_stat(prefix)['labels'] += len(lab_repl) + 1
+		i += 1
+	# calls are only ever as deep as the macros nest, which a macro calling itself breaks
+	state = {}
+	def visit(prefix):
+		state[prefix] = 'visiting'
+		for callee in calls[prefix]:
+			if state.get(callee) == 'visiting':
+				print("Macro expansion error, macros are nested too deeply (does a macro call itself?)")
+				print(prefix + " calls " + callee)
+				exit(-1)
+			if not callee in state:
+				visit(callee)
+		state[prefix] = 'done'
+	for prefix in linked:
+		if not prefix in state:
+			visit(prefix)
+	if debug:
+		print("Linked " + str(len(linked)) + " macros")
+		print()
+	return out
+
+# tags a statement with where it came from, for the source map.
+# this is a comment, so it goes through syntax checking and the optimizer like any other
+# (see split_source_map for how it's taken off again).
+def mark(stmt_tokens, line, stack):
+	tag = [";", "@" + str(line)]
+	if stack:
+		tag.append(">".join(stack))
+	return stmt_tokens + tag
+
+# expands one statement, yielding the statements it turns into.
+# line is the line of the original program the statement came from (for errors),
+# stack is the prefixes of the macros being expanded to get here.
+def expand_statement(stmt_tokens, line, vars, labels, depth, max_depth, stack):
+	# start with the first token in the list.
+	first = stmt_tokens[0]
+	# check for leading labels on the line
+	fl_prefix = None
+	if label_checker_notmacro.match(first):
+		# we need to confirm this label is not already in labels.
+		if not first[1:-1] in labels:
+			labels.add(first[1:-1])
+		fl_prefix = first
+		first = stmt_tokens[1]
+	# (intrinsics count as used too, they are kept as they are just below)
+	if first in macros:
+		used_macros.add(first)
+	# we only care about tokens for macros (that aren't left for the runtime)
+	if not first in macros or is_intrinsic(first) or depth == max_depth:
+		# (the -debugx dumps don't get tagged)
+		if source_map and max_depth is None:
+			if is_intrinsic(first):
+				stack = stack + (first,)
+			stmt_tokens = mark(stmt_tokens, line, stack)
+		if collect_stats and max_depth is None:
+			count_line(stack, depth)
+		yield stmt_tokens
+		return
+	stmt = " ".join(stmt_tokens)
+	if depth > max_nesting:
+		print("Macro expansion error, macros are nested too deeply (does a macro call itself?)")
+		print(stmt)
+		exit(-1)
+	var_repl = {}
+	lab_repl = {}
+	# if a macro exists we need to define a label for the line immediately following the macro.
+	# this is because any macro calling 'goto E' should jump to next line instead of terminating.
+	# so first we will gen a new label name, and then replace any E with that label name
+	# within the macro.
+	exit_name = labels.fresh()
+	# this gets the macro in use
+	macro = macros[first]
+	counting = collect_stats and max_depth is None
+	if counting:
+		count_call(first, depth)
+		macro_stats[first]['labels'] += 1
+	# get the number of input variables/labels from the line
+	varct = macro['var_count']
+	labct = macro['label_count']
+	in_vars = []
+	in_labs = []
+	# iterate over each input token and map it to one of each
+	for token in stmt_tokens[(2 if fl_prefix else 1):]:
+		if token in vars:
+			varct -= 1
+			in_vars.append(token)
+		elif token in labels:
+			labct -= 1
+			in_labs.append(token)
+		elif token == ";":
+			# this marks end bc rest of statement is a comment
+			break
+		else:
+			# we have to assume any other input token is a new, previously undefined variable
+			# and add it to vars.
+			vars.add(token)
+			in_vars.append(token)
+			varct -= 1
+	if not varct == 0 or not labct == 0:
+		print("Macro expansion error, input tokens do not match required count of variables or labels")
+		print(stmt_tokens)
+		print("Line " + str(line))
+		exit(-1)
+	# need to replace placeholder labels, variables with real ones
+	# first - replace the _V*, _L* because these are the ones which were input to the program
+	for i in range(len(in_vars)):
+		var_repl["_V" + str(i+1)] = in_vars[i]
+	for i in range(len(in_labs)):
+		lab_repl["_L" + str(i+1)] = in_labs[i]
+	# gives the real name for an operand of a line of the macro
+	def replace(kind, token):
+		if kind == "E":
+			return exit_name
+		if kind == "_V" or kind == "_var":
+			if not token in var_repl:
+				# make a fresh name not already in vars
+				var_repl[token] = vars.fresh()
+				if counting:
+					macro_stats[first]['variables'] += 1
+			return var_repl[token]
+		if kind == "_L" or kind == "_label":
+			if not token in lab_repl:
+				# make a fresh name not already in labels
+				lab_repl[token] = labels.fresh()
+				if counting:
+					macro_stats[first]['labels'] += 1
+			return lab_repl[token]
+		return token
+	# go over the lines of the macro's template to do the replacement
+	lmc = 0
+	for (label, op, word, args) in macro['template']:
+		label_prefix = None
+		if label:
+			if lmc == 0 and fl_prefix:
+				# first line of the macro AND there's an fl prefix, the two labels are the same line
+				lab_repl[label] = fl_prefix[1:-1]
+			else:
+				label_prefix = "[" + replace("_label", label) + "]"
+		args = [replace(kind, token) for (kind, token) in args]
+		if op == "inc" or op == "dec":
+			mc_tokens = [args[0] + word]
+		elif op == "if":
+			mc_tokens = ["if", args[0], "not", "0", "goto", args[1]]
+		elif op == "call":
+			# a call to another macro, it gets expanded below
+			mc_tokens = [word] + args
+		else:
+			mc_tokens = [word]
+		if label_prefix:
+			mc_tokens = [label_prefix] + mc_tokens
+		if lmc == 0 and debug:
+			mc_tokens = mc_tokens + [";", "start", "of", "macro", macro['name'], "(" + stmt + ")"]
+		if lmc == 0 and fl_prefix:
+			mc_tokens = [fl_prefix] + mc_tokens
+		# and expand whatever that line turned into
+		yield from expand_statement(mc_tokens, line, vars, labels, depth+1, max_depth, stack + (first,))
+		lmc += 1
+	if debug:
+		exit_tokens = ["[" + exit_name + "]", "skip", ";", "end", "of", "macro", macro['name']]
+	else:
+		exit_tokens = ["[" + exit_name + "]", "skip"]
+	if source_map and max_depth is None:
+		exit_tokens = mark(exit_tokens, line, stack + (first,))
+	if counting:
+		count_line(stack + (first,), depth+1)
+	yield exit_tokens
+
+# replaces all instances of labels with their actual line number
+# so that all goto statements point to a specific line.
+def label_replacement(program):
+	if debug:
+		print ("Performing label replacement")
+	label_map = SymbolTable('L')
+	label_checker = re.compile(r'\[[A-Za-z]+[0-9]*\]$')
+	line = 1
+	# iterate over each statement and find label definitions
+	for stmt in program:
+		# tokenize the statement
+		stmt_tokens = stmt.split(' ')
+		# start with the first token in the list.
+		first = stmt_tokens[0]
+		# if it's [L] we should extract the label.
+		if label_checker.match(first):
+			label = first[1:-1]
+			# now we want to map the label to the current line.
+			label_map.add(label, line-1)
+			program[line-1] = stmt[len(first)+1:]
+		line += 1
+	# now replace any uses of the label with the line number
+	line = 1
+	for stmt in program:
+		# tokenize the statement
+		stmt_tokens = stmt.split(' ')
+		# start with the first token in the list.
+		first = stmt_tokens[0]
+		# we only care about if-goto statements for label replacement
+		if first == "if":
+			# note that the label may or may not exist, if it doesn't exist we need to replace it with E
+			# (since non-existent labels terminate)
+			# (the _L* inputs of a subroutine are only known when it's called, see link_shared)
+			if not stmt_tokens[5].startswith("_L"):
+				if not stmt_tokens[5] in label_map:
+					stmt_tokens[5] = 'E'
+				# we already validated the syntax so just grab stmt_tokens[5]
+				stmt_tokens[5] = str(label_map[stmt_tokens[5]])
+				program[line-1] = " ".join(stmt_tokens)
+		elif first == "call":
+			# the label operands of a call to a subroutine come after its variables
+			macro = macros[stmt_tokens[1]]
+			for i in range(2+macro['var_count'], 2+macro['var_count']+macro['label_count']):
+				if not stmt_tokens[i].startswith("_L"):
+					if not stmt_tokens[i] in label_map:
+						stmt_tokens[i] = 'E'
+					stmt_tokens[i] = str(label_map[stmt_tokens[i]])
+			program[line-1] = " ".join(stmt_tokens)
+		elif is_intrinsic(first):
+			# same again for the label operands of intrinsics, which come after the variables
+			(var_count, label_count) = gruntime.intrinsics[first]
+			for i in range(1+var_count, 1+var_count+label_count):
+				if not stmt_tokens[i] in label_map:
+					stmt_tokens[i] = 'E'
+				stmt_tokens[i] = str(label_map[stmt_tokens[i]])
+			program[line-1] = " ".join(stmt_tokens)
+		line += 1
+	if debug:
+		print("Label replacement completed")
+		print("Label mapping: " + str(label_map.names))
+	return program
+
+# takes the tags mark put on the statements back off.
+# returns the statements as they would have been without them, and the
+# (statement, macro stack) of each one, or None for lines the compiler made up.
+# the tag is always the last comment on the line, so any comments from the source
+# (or from -debug) are left as they were.
+def split_source_map(program):
+	origins = []
+	for i in range(len(program)):
+		stmt = program[i]
+		at = stmt.rfind(" ; @")
+		origin = None
+		if at >= 0:
+			tag = stmt[at+4:].split(" ")
+			if tag[0].isdigit():
+				origin = (int(tag[0]), tag[1] if len(tag) > 1 else "")
+				program[i] = stmt[:at]
+		origins.append(origin)
+	return (program, origins)
+
+# the label E is used as a special label, which indicates the program should terminate.
+# this label doesn't exist so we just need to add it to the end.
+# fortunately this is simple, we just add one line to the very end of the program,
+# "exit"
+def e_insertion(program):
+	if debug:
+		print("Adding E label")
+	program.append("[E] exit")
+	if debug:
+		print("E label added")
+		print()
+	return program
+
+def collect_directives(program):
+	if debug:
+		print("Finding % directives")
+	dirs = []
+	line = 0
+	while line < len(program) and program[line].startswith("%"):
+		stmt = program[line]
+		if debug:
+			print ("Found directive " + stmt)
+		dirs.append(stmt)
+		line += 1
+	if debug:
+		print("Finished finding % directives")
+	return (line, dirs)
+
+# writes the .g# files for -debugx, .gN has the macros expanded N levels deep.
+# this expands on copies of the symbol tables so the real compile gets the same names either way.
+def dump_expansion(program, vars, labels, noext):
+	x = 1
+	while True:
+		step = [" ".join(stmt_tokens) for stmt_tokens in macro_expansion(program, copy.deepcopy(vars), copy.deepcopy(labels), x)]
+		with open(noext + ".g" + str(x), "w+") as f2:
+			f2.write("\n".join(step))
+		(v, l, has_macro) = syntax_check(step)
+		if not has_macro:
+			break
+		x += 1
+
+# records the time since start against a phase of the compile, returns the time now.
+# in the memory pass of -stats it records the peak memory since the last phase instead.
+def lap(phase, start):
+	if trace_memory:
+		(current, peak) = tracemalloc.get_traced_memory()
+		phase_memory[phase] = max(phase_memory.get(phase, 0), peak // 1024)
+		tracemalloc.reset_peak()
+	now = time.perf_counter()
+	phase_times[phase] = phase_times.get(phase, 0) + now - start
+	return now
+
+# the statistics of a macro, for -stats
+def macro_stat(prefix):
+	if not prefix in macro_stats:
+		macro_stats[prefix] = {'expansions': 0, 'lines': 0, 'variables': 0, 'labels': 0}
+	return macro_stats[prefix]
+
+# counts a macro being expanded at a level of nesting
+def count_call(prefix, depth):
+	macro_stat(prefix)['expansions'] += 1
+	while len(depth_stats) <= depth:
+		depth_stats.append([0, 0])
+	depth_stats[depth][0] += 1
+
+# counts a line of the compiled program, stack being the macros it was expanded from
+def count_line(stack, depth):
+	if stack:
+		macro_stats[stack[-1]]['lines'] += 1
+	while len(depth_stats) <= depth:
+		depth_stats.append([0, 0])
+	depth_stats[depth][1] += 1
+
+# compiles a program (list of statements, directives already removed)
+# with the macros which are currently loaded.
+# returns the compiled statements and the list of variables they use.
+# noext is only used to name the .g# files written by -debugx,
+# dirs are the %directives of the program (for the %specvar variables).
+def compile_program(program, noext, dirs=[]):
+	if shared and (use_intrinsics or optimize or eliminate_dead or source_map or debug_extreme):
+		print("Compile error, -shared can't be used with -intrinsics, -O, -dce, -map or -debugx")
+		exit(-1)
+	phase_times.clear()
+	if collect_stats:
+		phase_memory.clear()
+		macro_stats.clear()
+		del depth_stats[:]
+	result = compile_phases(program, noext, dirs)
+	if collect_stats:
+		measure_memory(program, noext, dirs)
+	return result
+
+# the peak memory python allocates while f runs, in kilobytes, with what it prints
+# thrown away (as in gbench.py)
+def peak_memory(f):
+	tracemalloc.start()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			f()
+		(current, peak) = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return peak // 1024
+
+# compiles the program again with tracemalloc on, for the peak memory of each phase.
+# this is a separate pass since tracing slows everything down, and it leaves the times
+# and statistics of the real compile alone.
+def measure_memory(program, noext, dirs):
+	global collect_stats, trace_memory
+	times = dict(phase_times)
+	(collect_stats, trace_memory) = (False, True)
+	try:
+		peak_memory(lambda: compile_phases(program, noext, dirs))
+	finally:
+		(collect_stats, trace_memory) = (True, False)
+	phase_times.clear()
+	phase_times.update(times)
+
+# the phases of compile_program, timed with lap
+def compile_phases(program, noext, dirs):
+	start = time.perf_counter()
+	source = program
+	# 0b. E insertion
+	program = e_insertion(list(program))
+
+	# 1. syntax evaluation and 2. identify var/label list
+	(vars, labels, has_macro) = syntax_check(program)
+	start = lap('syntax', start)
+
+	# 3. macro expansion
+	# every macro call is expanded where it is, recursively, in one go.
+	# (with a source map this also has to go over a program with no macros, to tag it)
+	if shared and has_macro:
+		# or each macro once, as a subroutine
+		program = link_shared(program, vars, labels)
+		start = lap('expansion', start)
+	elif has_macro or source_map:
+		# output each step of the expansion to a .g# file
+		if has_macro and debug_extreme:
+			dump_expansion(program, vars, labels, noext)
+		program = [" ".join(stmt_tokens) for stmt_tokens in macro_expansion(program, vars, labels)]
+		start = lap('expansion', start)
+
+		# 4. syntax recheck
+		# this is important to make sure the macros expanded out properly.
+		# (vars and labels are already complete, expansion adds to them as it goes)
+		syntax_check(program)
+		start = lap('recheck', start)
+
+	# 4b. optimization
+	if optimize:
+		before = len(program)
+		program = goptimize.optimize(program, vars, source_variables(source), is_intrinsic('goto'))
+		print("Optimized " + str(before) + " lines to " + str(len(program)) + " lines")
+		start = lap('optimize', start)
+
+	# 4c. dead code elimination
+	if eliminate_dead:
+		before = len(program)
+		program = goptimize.eliminate_dead_code(program, vars, source_variables(source))
+		print("Removed " + str(before - len(program)) + " lines of dead code")
+		start = lap('dce', start)
+
+	# 5. label replacement
+	program = label_replacement(program)
+	start = lap('labels', start)
+
+	# 5b. take the source map tags back off
+	if source_map:
+		global line_origins
+		(program, line_origins) = split_source_map(program)
+		start = lap('map', start)
+
+	# 6. drop the variables which aren't used any more,
+	# apart from Y and any which are given a value by %specvar
+	if eliminate_dead:
+		keep = goptimize.variables_used(program)
+		keep.add('Y')
+		for d in dirs:
+			if d.startswith("%specvar") and len(d.split(" ")) > 1:
+				keep.add(d.split(" ")[1])
+		before = len(vars)
+		vars = SymbolTable('V', [var for var in vars if var in keep])
+		print("Removed " + str(before - len(vars)) + " unused variables")
+		start = lap('dce', start)
+	return (program, vars)
+
+# the names used directly by a source program, plus Y.
+# (this takes every token so it has some keywords and labels in it too, which doesn't matter)
+def source_variables(program):
+	source_vars = set(['Y'])
+	for stmt in program:
+		for token in stmt.split(' '):
+			if token == ";":
+				break
+			source_vars.add(token.replace("++", "").replace("--", ""))
+	return source_vars
+
+# compiles the program both with and without intrinsics, runs both
+# and checks they agree on Y and on every variable named in the source.
+# (the variables made up during macro expansion only exist in the expanded version.)
+def intrinsics_check(program, dirs, noext):
+	global use_intrinsics
+	# names used directly by the source program
+	source_vars = source_variables(program)
+	results = []
+	for mode in [False, True]:
+		use_intrinsics = mode
+		(compiled, vars) = compile_program(program, noext, dirs)
+		gruntime.variables = dict.fromkeys(vars, 0)
+		for d in dirs:
+			if d.startswith("%specvar"):
+				gruntime.specvar(d)
+		regs = list(gruntime.variables.values())
+		(steps, stop) = gruntime.execute(gruntime.decode(compiled, vars), regs)
+		state = dict(zip(vars, regs))
+		results.append((len(compiled), steps, state))
+		how = " steps"
+		if stop != "halted":
+			how = " steps (stopped, " + stop + ")"
+		if mode:
+			print("With intrinsics: " + str(len(compiled)) + " lines, " + str(steps) + how)
+		else:
+			print("Expanded: " + str(len(compiled)) + " lines, " + str(steps) + how)
+	expanded = results[0][2]
+	native = results[1][2]
+	mismatched = False
+	for var in native:
+		if var in source_vars and var in expanded and native[var] != expanded[var]:
+			print("Intrinsics check failed, " + var + " is " + str(expanded[var]) + " expanded but " + str(native[var]) + " with intrinsics")
+			mismatched = True
+	if mismatched:
+		exit(-1)
+	print("Intrinsics check passed, out: " + str(native['Y']))
+
+# works out the macro libraries to link, stdlib plus any -link arguments
+def linked_folders():
+	folders_to_link = ['stdlib']
+	for i in range(len(sys.argv)):
+		arg = sys.argv[i]
+		if arg == '-link' and len(sys.argv) != (i+1):
+			nextarg = sys.argv[i+1]
+			folders_to_link.append(nextarg)
+	return folders_to_link
+
+# sets the globals for the flags given on the command line
+def read_flags():
+	global debug
+	global debug_extreme
+	global use_intrinsics
+	global optimize
+	global eliminate_dead
+	global source_map
+	global shared
+	global collect_stats
+	global stats_json
+	if '-debug' in sys.argv:
+		debug = True
+	if '-debugx' in sys.argv:
+		debug = True
+		debug_extreme = True
+	if '-intrinsics' in sys.argv:
+		use_intrinsics = True
+	if '-O' in sys.argv:
+		optimize = True
+	if '-dce' in sys.argv:
+		eliminate_dead = True
+	if '-map' in sys.argv:
+		source_map = True
+	if '-shared' in sys.argv:
+		shared = True
+	if '-stats' in sys.argv:
+		collect_stats = True
+	if '-stats-json' in sys.argv:
+		i = sys.argv.index('-stats-json')
+		if i+1 == len(sys.argv):
+			print("Please give -stats-json the file to write the statistics to.")
+			exit(-1)
+		collect_stats = True
+		stats_json = sys.argv[i+1]
+
+# splits the text of a .gc file into its %directives and its statements.
+# also returns the line of the file each statement is on (for the source map).
+def read_source(text):
+	# load all lines into program
+	program = text.split("\n")
+	# replace all newlines with blank and trim
+	# I also do a replacement from ';' -> ' ; ' to avoid difficulty tokenizing comments
+	program = [l.replace('\r', '').replace(';', ' ; ').strip() for l in program]
+	# remove any blank lines
+	# remove any lines starting with ;
+	# to not have to tokenize
+	lines = [i+1 for i in range(len(program)) if program[i] != "" and not program[i].startswith(';')]
+	program = [program[i-1] for i in lines]
+
+	# collect %directives
+	# these are passed directly from the .gc to the .g
+	# so you can specify e.g. %specvar directives
+	# and have them copied through to the compiled code
+	(line, dirs) = collect_directives(program)
+	if line == len(program):
+		print("Compile error, the program has no statements (only blank lines, comments or % directives)")
+		exit(-1)
+	return (program[line:], dirs, lines[line:])
+
+# the source map for a .g file lives next to it as a .gmap file.
+# it's json, with the name of the .gc file and for each line of the .g file (after
+# the directives, so the same numbering as the if-gotos) the line of the .gc file it came
+# from and the macros it was expanded from, e.g. [3, "lte>monus>assign"].
+# lines the compiler made up itself are null.
+def map_path(out):
+	return os.path.splitext(out)[0] + ".gmap"
+
+# lines is the line of the .gc file each statement is on, from read_source
+def write_source_map(path, source, lines):
+	entries = []
+	for origin in line_origins:
+		if origin is None or origin[0] > len(lines):
+			# the made up lines, and the exit at the end
+			entries.append(None)
+		else:
+			entries.append([lines[origin[0]-1], origin[1]])
+	with open(path, "w") as f:
+		json.dump({'version': 1, 'source': source, 'lines': entries}, f)
+	print("Wrote source map to " + path)
+
+# the build manifest records how each .g file in a folder was made, so it
+# only has to be compiled again when something it depends on changes.
+# each entry (by .g filename) has
+# - key: hash of the compiler, the .gc source, the linked libraries and the flags
+# - macros: the hash of every macro the program used
+# - output: hash of the .g file that was written
+manifest_name = '.gcmanifest'
+
+def manifest_path(out):
+	return os.path.join(os.path.dirname(out), manifest_name)
+
+def load_manifest(out):
+	try:
+		with open(manifest_path(out)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+# writes the manifest to a temporary file first so a half-written manifest is never read
+def save_manifest(out, manifest):
+	path = manifest_path(out)
+	try:
+		with open(path + ".tmp", "w") as f:
+			json.dump(manifest, f, indent=1, sort_keys=True)
+		os.replace(path + ".tmp", path)
+	except OSError:
+		print("Could not write build manifest " + path)
+
+def file_hash(path):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+# what a compiled file depends on apart from the macros: the source, the flags, and
+# the code of the compiler, including goptimize.py with -O or -dce and gruntime.py (which
+# says what the intrinsics are) with -intrinsics
+def build_key(text, folders_to_link):
+	h = hashlib.sha1()
+	h.update(file_hash(os.path.abspath(__file__)).encode())
+	if optimize or eliminate_dead:
+		h.update(file_hash(os.path.abspath(goptimize.__file__)).encode())
+	if use_intrinsics:
+		h.update(file_hash(os.path.abspath(gruntime.__file__)).encode())
+	h.update(text.encode())
+	h.update((",".join(folders_to_link) + "\n").encode())
+	h.update((str(debug) + "," + str(use_intrinsics) + "," + str(optimize) + "," + str(eliminate_dead) + "," + str(source_map) + (",shared" if shared else "") + "\n").encode())
+	return h.hexdigest()
+
+# checks a manifest entry against the current state of things.
+# the macros have to be loaded already.
+def up_to_date(entry, key, out):
+	if not entry or entry['key'] != key:
+		return False
+	for prefix in entry['macros']:
+		if not prefix in macros or macros[prefix]['hash'] != entry['macros'][prefix]:
+			return False
+	if source_map and not os.path.exists(map_path(out)):
+		return False
+	return os.path.exists(out) and file_hash(out) == entry['output']
+
+# compiles one .gc file to a .g file next to it, unless the manifest says it's up to date.
+# returns True if it compiled it.
+def build(file, manifest):
+	global used_macros
+	with open(file) as f:
+		text = f.read()
+	noext = os.path.splitext(file)[0]
+	out = noext + ".g"
+	key = build_key(text, linked_folders())
+	if not '-force' in sys.argv and not debug_extreme and not collect_stats and up_to_date(manifest.get(os.path.basename(out)), key, out):
+		print(out + " is up to date")
+		return False
+
+	print ("Compiling G-program from source file " + file)
+	(program, dirs, lines) = read_source(text)
+	used_macros = set()
+	(program, vars) = compile_program(program, noext, dirs)
+	if collect_stats:
+		file_stats[file] = compile_stats(len(program), len(vars))
+		print_stats(file, file_stats[file])
+	# final processing - add variable list to the header
+	program.insert(0, "%vars " + ",".join(vars))
+	# add remaining %dirs to the file
+	program.insert(1, "\n".join(dirs) + "\n")
+	# output to .g file
+	with open(out, "w+") as f2:
+		f2.write("\n".join(program))
+		print("Wrote compiled code to " + out)
+	if source_map:
+		write_source_map(map_path(out), os.path.basename(file), lines)
+	manifest[os.path.basename(out)] = {
+		'key': key,
+		'macros': dict([(prefix, macros[prefix]['hash']) for prefix in sorted(used_macros)]),
+		'output': file_hash(out)
+	}
+	return True
+
+# 0. perform macro loading by scanning folders.
+# all folders in the macro subdirectory are 'packages' of macros.
+# the stdlib folder is loaded by default as it contains a lot of generally useful macros.
+# any other folders are loaded with -link arguments.
+def load_macros():
+	global macros
+	start = time.perf_counter()
+	macro_loading(linked_folders())
+	macro_requirement_checking()
+	if collect_stats:
+		load_stats['seconds'] = time.perf_counter() - start
+		# (the memory from loading them all again, traced, see measure_memory)
+		loaded = macros
+		macros = {}
+		load_stats['peak_kb'] = peak_memory(lambda: (macro_loading(linked_folders()), macro_requirement_checking()))
+		macros = loaded
+
+# the statistics of each file compiled with -stats, by file
+file_stats = {}
+
+# the statistics of the last compile, lines and vars being the size of what it made
+def compile_stats(lines, vars):
+	phases = {}
+	for phase in phase_times:
+		phases[phase] = {'seconds': phase_times[phase], 'peak_kb': phase_memory.get(phase, 0)}
+	return {
+		'lines': lines,
+		'variables': vars,
+		'phases': phases,
+		'levels': [{'calls': calls, 'lines': lines} for (calls, lines) in depth_stats],
+		'macros': dict([(prefix, dict(macro_stats[prefix])) for prefix in macro_stats]),
+	}
+
+# prints the statistics of a compile as tables
+def print_stats(file, stats):
+	print("Statistics for " + file + ": " + str(stats['lines']) + " lines, " + str(stats['variables']) + " variables")
+	print("  %-16s %10s %10s" % ("phase", "seconds", "peak kB"))
+	if load_stats:
+		print("  %-16s %10.4f %10d" % ("macro loading", load_stats['seconds'], load_stats['peak_kb']))
+	for phase in stats['phases']:
+		print("  %-16s %10.4f %10d" % (phase, stats['phases'][phase]['seconds'], stats['phases'][phase]['peak_kb']))
+	print("  %-16s %10.4f" % ("total", sum([p['seconds'] for p in stats['phases'].values()])))
+	if stats['levels']:
+		print("  %-16s %10s %10s" % ("nesting level", "calls", "lines"))
+		for level in range(len(stats['levels'])):
+			print("  %-16d %10d %10d" % (level, stats['levels'][level]['calls'], stats['levels'][level]['lines']))
+	if stats['macros']:
+		print("  %-16s %10s %10s %10s %10s" % ("macro", "expansions", "lines", "variables", "labels"))
+		# the ones which made the most code first
+		for prefix in sorted(stats['macros'], key=lambda prefix: -stats['macros'][prefix]['lines']):
+			m = stats['macros'][prefix]
+			print("  %-16s %10d %10d %10d %10d" % (prefix, m['expansions'], m['lines'], m['variables'], m['labels']))
+
+# writes the statistics of everything compiled to the -stats-json file
+def write_stats():
+	with open(stats_json, "w") as f:
+		json.dump({'version': 1, 'macro_loading': load_stats, 'files': file_stats}, f, indent=1)
+	print("Wrote statistics to " + stats_json)
+
+# performs compilation on an input file
+def precompile(file):
+	read_flags()
+	load_macros()
+
+	if '-intrinsics-check' in sys.argv:
+		with open(file) as f:
+			(program, dirs, lines) = read_source(f.read())
+		intrinsics_check(program, dirs, os.path.splitext(file)[0])
+		return
+
+	noext = os.path.splitext(file)[0]
+	manifest = load_manifest(noext + ".g")
+	if build(file, manifest):
+		save_manifest(noext + ".g", manifest)
+	emit_outputs(noext + ".g")
+	if stats_json is not None:
+		write_stats()
+
+# writes the optional extra outputs for a compiled .g file
+def emit_outputs(out):
+	# the compiled code translated to python
+	if '-emitpy' in sys.argv:
+		import gcodegen
+		gcodegen.emit(out)
+	# the compiled code in binary form
+	if '-binary' in sys.argv:
+		import gbinary
+		gbinary.emit(out)
+
+# the .gc files named on the command line (folders mean every .gc file in them, and
+# patterns like programs/**/*.gc every file they match)
+def make_files():
+	files = []
+	for i in range(1, len(sys.argv)):
+		arg = sys.argv[i]
+		if arg.startswith('-') or sys.argv[i-1] in ['-link', '-stats-json', '-jobs']:
+			continue
+		if os.path.isdir(arg):
+			files += sorted([os.path.join(arg, f) for f in os.listdir(arg) if f.endswith('.gc')])
+		elif glob.has_magic(arg):
+			files += sorted([f for f in glob.glob(arg, recursive=True) if f.endswith('.gc')])
+		else:
+			files.append(arg)
+	# a file can be named more than once
+	return list(dict.fromkeys(files))
+
+# the number of processes -make compiles with, -jobs N or one per cpu
+def make_jobs():
+	if not '-jobs' in sys.argv:
+		return os.cpu_count() or 1
+	i = sys.argv.index('-jobs')
+	if i+1 == len(sys.argv) or not sys.argv[i+1].isdigit() or int(sys.argv[i+1]) < 1:
+		print("Please give -jobs the number of processes to compile with.")
+		exit(-1)
+	return int(sys.argv[i+1])
+
+# sets up a process to compile for make, with the macros make loaded
+def make_setup(loaded):
+	global macros
+	read_flags()
+	macros = loaded
+
+# compiles one file for make, entry being its manifest entry (or None).
+# everything it prints is kept rather than printed, and an error doesn't stop the build.
+# returns (whether it worked, whether it compiled it, what it printed, its new manifest
+# entry, its -stats).
+def make_file(file, entry):
+	out = os.path.splitext(file)[0] + ".g"
+	manifest = {}
+	if entry is not None:
+		manifest[os.path.basename(out)] = entry
+	printed = io.StringIO()
+	ok = True
+	compiled = False
+	try:
+		with contextlib.redirect_stdout(printed):
+			compiled = build(file, manifest)
+			emit_outputs(out)
+	except SystemExit:
+		# the error has been printed
+		ok = False
+	except Exception as e:
+		printed.write("Could not compile " + file + ": " + repr(e) + "\n")
+		ok = False
+	return (ok, compiled, printed.getvalue(), manifest.get(os.path.basename(out)), file_stats.get(file))
+
+def make_file_args(args):
+	return make_file(*args)
+
+# compiles every file given, skipping the ones which are up to date.
+# the macros are loaded once and the files are shared out over -jobs processes. a file
+# which doesn't compile doesn't stop the others, they're all reported at the end.
+def make():
+	read_flags()
+	load_macros()
+	manifests = {}
+	compiled = 0
+	failed = []
+	files = make_files()
+	jobs = min(make_jobs(), max(len(files), 1))
+	work = []
+	for file in files:
+		out = os.path.splitext(file)[0] + ".g"
+		path = manifest_path(out)
+		if not path in manifests:
+			manifests[path] = load_manifest(out)
+		work.append((file, manifests[path].get(os.path.basename(out))))
+	pool = None
+	if jobs > 1:
+		pool = multiprocessing.Pool(jobs, make_setup, (macros,))
+		results = pool.imap(make_file_args, work)
+	else:
+		results = map(make_file_args, work)
+	try:
+		for (file, result) in zip(files, results):
+			(ok, done, printed, entry, stats) = result
+			print(printed, end="")
+			out = os.path.splitext(file)[0] + ".g"
+			if not ok:
+				failed.append((file, printed))
+				continue
+			if done:
+				compiled += 1
+				manifests[manifest_path(out)][os.path.basename(out)] = entry
+				save_manifest(out, manifests[manifest_path(out)])
+			if stats is not None:
+				file_stats[file] = stats
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	print(str(compiled) + " compiled, " + str(len(files) - compiled - len(failed)) + " up to date, " + str(len(failed)) + " failed")
+	if stats_json is not None:
+		write_stats()
+	if failed:
+		print()
+		print("These files did not compile:")
+		for (file, printed) in failed:
+			# leave out the line saying it was compiling it
+			lines = [line for line in printed.split("\n") if line != "" and not line.startswith("Compiling G-program")]
+			print(file)
+			for line in lines:
+				print("    " + line)
+		exit(-1)
+
+if __name__ == '__main__':
+	if '-make' in sys.argv:
+		make()
+		exit(0)
+	if len(sys.argv) < 2:
+		print("Please provide at least 1 argument, the path to a G source file, and optionally additional -flags after this.")
+		exit(-1)
+	precompile(sys.argv[1])
@@ -0,0 +1,23 @@
+import unittest
+
+import gapi
+
+class TestCompileErrors(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.compiler = gapi.Compiler()
+
+	# a program with nothing to run comes back as a CompileError, not whatever the
+	# compiler tripped over
+	def test_no_statements(self):
+		for text in ["", "\n\n", "; just a comment\n", "%specvar X 1\n"]:
+			with self.assertRaises(gapi.CompileError, msg=repr(text)) as caught:
+				self.compiler.compile(text)
+			self.assertIn("no statements", str(caught.exception))
+
+	def test_directives_and_statements(self):
+		program = self.compiler.compile("%specvar X 2\nY++\nX--\n")
+		self.assertEqual(program.run().variables['X'], 1)
+
+if __name__ == '__main__':
+	unittest.main()
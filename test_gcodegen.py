@@ -0,0 +1,79 @@
+import unittest
+
+import gcodegen
+import gruntime
+
+names = ['Y', 'X', 'A', 'B', 'C']
+
+# programs with loops that look unreachable, behind if-gotos that look like the goto
+# idiom but aren't (the intrinsic after the ++ can set the variable back to 0)
+programs = [
+	[
+		"X++",
+		"Y++",
+		"monus C Y X",
+		"if X not 0 goto 10",
+		"if C not 0 goto 4",
+		"X++",
+		"Y--",
+		"X++",
+		"if A not 0 goto 10",
+		"B++",
+		"X++",
+	],
+	[
+		"A++",
+		"zero A",
+		"if A not 0 goto 7",
+		"B++",
+		"X--",
+		"if X not 0 goto 4",
+		"Y++",
+	],
+	[
+		"C++",
+		"assign C A",
+		"if C not 0 goto 8",
+		"X++",
+		"B++",
+		"lte B X C",
+		"if C not 0 goto 4",
+		"Y++",
+		"if A not 0 goto 4",
+	],
+]
+
+class TestNative(unittest.TestCase):
+	def setUp(self):
+		self.settings = (gruntime.max_steps, gruntime.max_seconds, gruntime.detect_cycles, gcodegen.find_entries)
+
+	def tearDown(self):
+		(gruntime.max_steps, gruntime.max_seconds, gruntime.detect_cycles, gcodegen.find_entries) = self.settings
+
+	# runs program both ways from regs and checks they end up the same
+	def compare(self, program, regs):
+		gruntime.max_steps = 100000
+		gruntime.max_seconds = None
+		interpreted = list(regs)
+		(steps, status) = gruntime.execute(gruntime.decode(program, names), interpreted)
+		self.assertEqual(status, "halted")
+		scope = {}
+		exec(gcodegen.generate(names, gruntime.decode(program, names)), scope)
+		native = list(regs)
+		self.assertEqual((scope['run'](native), native), (steps, interpreted), program)
+
+	def test_unreachable_looking_loops(self):
+		for program in programs:
+			for x in range(4):
+				self.compare(program, [0, x, 0, 0, 0])
+
+	# if find_entries misses a block with more than one way in, it's reached through the
+	# dispatch instead of being inlined forever
+	def test_missed_entries(self):
+		gcodegen.find_entries = lambda code, blocks: set([0])
+		for program in programs:
+			for x in range(4):
+				self.compare(program, [0, x, 0, 0, 0])
+
+if __name__ == '__main__':
+	unittest.main()
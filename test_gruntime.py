@@ -0,0 +1,44 @@
+import os
+import unittest
+
+import gruntime
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+class TestProfile(unittest.TestCase):
+	def setUp(self):
+		self.settings = (gruntime.variables, gruntime.max_steps, gruntime.max_seconds, gruntime.detect_cycles)
+
+	def tearDown(self):
+		(gruntime.variables, gruntime.max_steps, gruntime.max_seconds, gruntime.detect_cycles) = self.settings
+
+	# decodes a sample program with the loop and block shortcuts, returns (code, regs)
+	def sample(self, name):
+		program = gruntime.load(os.path.join(here, name))
+		code = gruntime.decode(program, list(gruntime.variables))
+		gruntime.find_loops(code)
+		gruntime.find_blocks(code)
+		return (code, list(gruntime.variables.values()))
+
+	# execute_profile is execute with counting added, so it has to run programs the same way
+	def test_same_as_execute(self):
+		gruntime.max_seconds = None
+		for name in ['lte.g', 'monus.g', 'be_test.g', 'zero_function.g', 'everywhere_diverging_function.g']:
+			for limit in [None, 500]:
+				gruntime.max_steps = limit
+				(code, regs) = self.sample(name)
+				counted = list(regs)
+				profiled = gruntime.execute_profile(code, counted, [0] * len(code), [0] * len(code))
+				self.assertEqual((profiled, counted), (gruntime.execute(code, regs), regs), name)
+
+	# including carrying on a run from part way through
+	def test_resume(self):
+		gruntime.max_seconds = None
+		gruntime.max_steps = None
+		(code, regs) = self.sample('lte.g')
+		counted = list(regs)
+		profiled = gruntime.execute_profile(code, counted, [0] * len(code), [0] * len(code), 3, 10, 1.0)
+		self.assertEqual((profiled, counted), (gruntime.execute(code, regs, 3, 10, 1.0), regs))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import gruntime
+
+try:
+	import gvector
+except ImportError:
+	gvector = None
+
+# a program which doubles Y (from 1) X times, so Y and the step count both get past
+# 64 bits once X is a little over 60
+doubling = [
+	"Y++",
+	"if X not 0 goto 4",
+	"W++",
+	"if W not 0 goto 20",
+	"X--",
+	"if Y not 0 goto 8",
+	"W++",
+	"if W not 0 goto 13",
+	"Y--",
+	"Z++",
+	"Z++",
+	"W++",
+	"if W not 0 goto 5",
+	"if Z not 0 goto 16",
+	"W++",
+	"if W not 0 goto 1",
+	"Z--",
+	"Y++",
+	"W++",
+	"if W not 0 goto 13",
+	"exit",
+]
+names = ['Y', 'X', 'W', 'Z']
+
+@unittest.skipIf(gvector is None, "gvector needs numpy")
+class TestVectorOverflow(unittest.TestCase):
+	def setUp(self):
+		self.settings = (gruntime.loops, gruntime.fuse, gruntime.max_steps, gruntime.max_seconds, gruntime.detect_cycles)
+
+	def tearDown(self):
+		(gruntime.loops, gruntime.fuse, gruntime.max_steps, gruntime.max_seconds, gruntime.detect_cycles) = self.settings
+
+	# (only the loop shortcut gets there in any reasonable number of instructions)
+	def test_past_64_bits(self):
+		gruntime.loops = gruntime.fuse = True
+		gruntime.max_steps = None
+		gruntime.max_seconds = None
+		code = gruntime.decode(doubling, names)
+		gruntime.find_loops(code)
+		gruntime.find_blocks(code)
+		slots = dict([(names[i], i) for i in range(len(names))])
+		# enough lanes that they aren't all handed straight to gruntime.execute
+		inputs = [[('X', x)] for x in range(40, 100)]
+		results = gvector.run(code, [0] * len(names), slots, inputs)
+		for i in range(len(inputs)):
+			regs = [0] * len(names)
+			regs[slots['X']] = inputs[i][0][1]
+			(steps, status) = gruntime.execute(code, regs)
+			self.assertEqual(results[i], (regs[slots['Y']], steps, status), inputs[i])
+		# the last ones really are past 2^63
+		self.assertGreater(results[-1][0], 1 << 63)
+		self.assertGreater(results[-1][1], 1 << 63)
+
+if __name__ == '__main__':
+	unittest.main()